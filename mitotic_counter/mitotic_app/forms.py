@@ -1,11 +1,18 @@
 # forms.py
 from django import forms
+from django.conf import settings
 from .models import Analysis
+from .utils.roi import ROIError, parse_roi
+from .utils.tiff_metadata import TiffHeaderError, read_tiff_header, validate_tiff_header
 
 class TiffUploadForm(forms.ModelForm):
+    # Polygons or rectangles in level-0 pixels as JSON (see utils/roi.py)
+    roi = forms.CharField(required=False, widget=forms.Textarea(attrs={'rows': 3}))
+    draw_roi = forms.BooleanField(required=False)
+    
     class Meta:
         model = Analysis
-        fields = ['uploaded_image']
+        fields = ['uploaded_image', 'roi']
         
     def clean_uploaded_image(self):
         image = self.cleaned_data.get('uploaded_image')
@@ -13,4 +20,46 @@ class TiffUploadForm(forms.ModelForm):
             name = image.name.lower()
             if not (name.endswith('.tif') or name.endswith('.tiff')):
                 raise forms.ValidationError("Only TIFF files are supported")
-        return image
\ No newline at end of file
+            
+            # Validate from the header alone; the pixels are never decoded here
+            try:
+                metadata = validate_tiff_header(
+                    read_tiff_header(image.file),
+                    max_pixels=getattr(settings, 'TIFF_MAX_PIXELS', None)
+                )
+            except TiffHeaderError as e:
+                raise forms.ValidationError(str(e))
+            finally:
+                image.file.seek(0)
+            self.instance.set_tiff_metadata(metadata)
+        return image
+    
+    def clean_roi(self):
+        # Runs after clean_uploaded_image, so the slide size is known
+        try:
+            return parse_roi(self.cleaned_data.get('roi'), self.instance.image_width, self.instance.image_height)
+        except ROIError as e:
+            raise forms.ValidationError(str(e))
+    
+    def save(self, commit=True):
+        # Uploads that still need an ROI drawn wait as drafts so no worker starts them
+        if self.cleaned_data.get('draw_roi') and not self.cleaned_data.get('roi'):
+            self.instance.status = Analysis.DRAFT
+        return super().save(commit)
+
+
+class ROIForm(forms.Form):
+    roi = forms.CharField(widget=forms.HiddenInput)
+    
+    def __init__(self, *args, analysis=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.analysis = analysis
+    
+    def clean_roi(self):
+        try:
+            polygons = parse_roi(self.cleaned_data['roi'], self.analysis.image_width, self.analysis.image_height)
+        except ROIError as e:
+            raise forms.ValidationError(str(e))
+        if not polygons:
+            raise forms.ValidationError("Draw at least one region, or scan the whole slide")
+        return polygons
@@ -0,0 +1,172 @@
+# management/commands/analyze_slides.py
+import csv
+import glob
+import os
+import time
+from multiprocessing import Pool
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from mitotic_app.models import Analysis, DetectedFigure
+from mitotic_app.utils.roi import ROIError, parse_roi
+from mitotic_app.utils.scan_plan import ScanPlan
+from mitotic_app.utils.tiff_metadata import read_tiff_header, validate_tiff_header
+
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+
+CSV_FIELDS = [
+    'source_path', 'analysis_id', 'status', 'mitotic_count', 'non_mitotic_count',
+    'total_hpfs', 'mitoses_per_10_hpf', 'tumor_grade', 'seconds',
+]
+
+
+def collect_slides(inputs):
+    """Expand directories and glob patterns into a sorted list of TIFF paths"""
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            candidates = glob.glob(os.path.join(item, '**', '*'), recursive=True)
+        else:
+            candidates = glob.glob(item, recursive=True)
+        for path in candidates:
+            if os.path.isfile(path) and path.lower().endswith(TIFF_EXTENSIONS):
+                paths.add(os.path.abspath(path))
+    return sorted(paths)
+
+
+def is_analyzed(source_path):
+    """A slide counts as analyzed once an analysis for it is done"""
+    return Analysis.objects.filter(source_path=source_path, status=Analysis.DONE).exists()
+
+
+def create_analysis(source_path, plan=None, roi=None):
+    """A queued Analysis for a slide on disk, with its header parsed and the upload copied"""
+    analysis = Analysis(source_path=source_path)
+    analysis.set_tiff_metadata(validate_tiff_header(read_tiff_header(source_path)))
+    if plan is not None:
+        analysis.scan_plan = plan
+    if roi:
+        analysis.roi = parse_roi(roi, analysis.image_width, analysis.image_height)
+    with open(source_path, 'rb') as f:
+        analysis.uploaded_image.save(os.path.basename(source_path), File(f), save=True)
+    return analysis
+
+
+def analyze_slide(job):
+    """Worker entry point: create an Analysis for one slide and run the pipeline.
+
+    The analysis is queued like any other, so a run_worker process may claim
+    it first. The slide is then reported as 'delegated' once that run
+    finishes (or taken over if its lease expires), not as failed.
+    """
+    from mitotic_app.utils.pipeline import run_analysis_exclusive
+
+    source_path, model_path, plan, roi = job
+    row = {'source_path': source_path, 'status': 'failed'}
+    started = time.monotonic()
+    try:
+        analysis = create_analysis(source_path, plan, roi)
+        row['analysis_id'] = analysis.id
+
+        # Block until the node's JOB_BUDGET has room, so extra workers queue instead of thrashing
+        ran, results = run_analysis_exclusive(analysis, model_path=model_path, wait=True)
+        while not ran:
+            analysis.refresh_from_db()
+            if analysis.status in (Analysis.DONE, Analysis.FAILED):
+                break
+            time.sleep(getattr(settings, 'ADMISSION_POLL_SECONDS', 10))
+            ran, results = run_analysis_exclusive(analysis, model_path=model_path, wait=True)
+
+        if results or (not ran and analysis.status == Analysis.DONE):
+            analysis.refresh_from_db()
+            row.update({
+                'status': 'done' if ran else 'delegated',
+                'mitotic_count': analysis.figures.filter(category=DetectedFigure.MITOTIC).count(),
+                'non_mitotic_count': analysis.figures.filter(category=DetectedFigure.NON_MITOTIC).count(),
+                'total_hpfs': analysis.total_hpfs,
+                'mitoses_per_10_hpf': analysis.mitoses_per_10_hpf,
+                'tumor_grade': analysis.tumor_grade,
+            })
+    except Exception as e:
+        print(f"Error analyzing {source_path}: {e}")
+    finally:
+        connections.close_all()
+    row['seconds'] = round(time.monotonic() - started, 2)
+    return row
+
+
+class Command(BaseCommand):
+    help = "Analyze TIFF slides from directories or glob patterns without the web UI"
+
+    def add_arguments(self, parser):
+        parser.add_argument('inputs', nargs='+', help="Directories or glob patterns of TIFF slides")
+        parser.add_argument('--workers', type=int, default=1, help="Number of worker processes")
+        parser.add_argument('--model', default=None, help="Path to the YOLO weights (defaults to model/best.pt)")
+        parser.add_argument('--summary', default='analysis_summary.csv', help="Where to write the summary CSV")
+        parser.add_argument('--window', type=int, default=None,
+                            help="Scan with square windows of this size (e.g. the model input size, 640)")
+        parser.add_argument('--overlap', type=float, default=0.9,
+                            help="Horizontal overlap between frames when --window is given (at least 0.5)")
+        parser.add_argument('--roi', default=None,
+                            help="JSON file of ROI polygons/rectangles in level-0 pixels, applied to every slide")
+        parser.add_argument('--force', action='store_true', help="Re-analyze slides that already have results")
+
+    def handle(self, *args, **options):
+        slides = collect_slides(options['inputs'])
+        if not slides:
+            raise CommandError("No TIFF slides found")
+
+        plan = None
+        if options['window']:
+            try:
+                plan = ScanPlan.for_model(options['window'], overlap_x=options['overlap'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        roi = None
+        if options['roi']:
+            try:
+                with open(options['roi']) as f:
+                    roi = parse_roi(f.read())
+            except (OSError, ROIError) as e:
+                raise CommandError(f"Invalid --roi: {e}")
+
+        rows = []
+        jobs = []
+        for path in slides:
+            if not options['force'] and is_analyzed(path):
+                rows.append({'source_path': path, 'status': 'skipped'})
+            else:
+                jobs.append((path, options['model'], plan, roi))
+
+        self.stdout.write(f"Found {len(slides)} slides, {len(jobs)} to analyze, {len(rows)} skipped")
+
+        if jobs:
+            workers = max(1, options['workers'])
+            if workers == 1:
+                results = map(analyze_slide, jobs)
+            else:
+                # Forked workers must not share the parent's database connection
+                connections.close_all()
+                pool = Pool(processes=workers)
+                results = pool.imap_unordered(analyze_slide, jobs)
+            try:
+                for row in results:
+                    rows.append(row)
+                    self.stdout.write(f"[{row['status']}] {row['source_path']} ({row['seconds']}s)")
+            finally:
+                if workers > 1:
+                    pool.close()
+                    pool.join()
+
+        with open(options['summary'], 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            for row in sorted(rows, key=lambda r: r['source_path']):
+                writer.writerow(row)
+
+        failed = sum(1 for row in rows if row['status'] == 'failed')
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote summary for {len(rows)} slides to {options['summary']} ({failed} failed)"
+        ))
@@ -0,0 +1,68 @@
+# management/commands/benchmark_keyframes.py
+import os
+import shutil
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from mitotic_app.utils.detectors import get_detector
+from mitotic_app.utils.mitotic_counter import process_video
+
+
+class Command(BaseCommand):
+    help = "Compare line-crossing counts of keyframe inference against inference on every frame"
+
+    def add_arguments(self, parser):
+        parser.add_argument('videos', nargs='+', help="Scan videos (e.g. media/analysis_N/tiff_scan.mp4)")
+        parser.add_argument('--intervals', default='2,3,4,5', help="Comma-separated keyframe intervals to try")
+        parser.add_argument('--step', type=int, default=settings.SCAN_PLAN['step_x'],
+                            help="Horizontal scan stride the videos were made with")
+        parser.add_argument('--frames-per-row', type=int, default=None,
+                            help="Frames per scan row, to force inference on row changes")
+        parser.add_argument('--model', default=os.path.join(settings.BASE_DIR, 'model', 'best.pt'))
+        parser.add_argument('--tolerance', type=float, default=0.02,
+                            help="Maximum relative count difference to accept")
+
+    def run(self, video, detector, interval, options):
+        analysis_id = f'keyframe_benchmark_{interval}'
+        started = time.monotonic()
+        try:
+            results = process_video(
+                video, options['model'], analysis_id, detector=detector,
+                scan_shift=options['step'], save_figures=False, resume=False, checkpoint_every=0,
+                keyframe_interval=interval, frames_per_row=options['frames_per_row'],
+            )
+        finally:
+            shutil.rmtree(os.path.join(settings.MEDIA_ROOT, f'analysis_{analysis_id}'), ignore_errors=True)
+        if not results:
+            raise CommandError(f"Could not read {video}")
+        results['seconds'] = time.monotonic() - started
+        return results
+
+    def handle(self, *args, **options):
+        intervals = [int(k) for k in options['intervals'].split(',') if int(k) > 1]
+        detector = get_detector(options['model'])
+        worst = 0.0
+
+        for video in options['videos']:
+            self.stdout.write(video)
+            self.stdout.write(f"{'K':>3} {'mitotic':>8} {'non-mit':>8} {'inferred':>9} {'seconds':>8} {'diff':>7}")
+            reference = self.run(video, detector, 1, options)
+            for interval in [1] + intervals:
+                results = reference if interval == 1 else self.run(video, detector, interval, options)
+                diff = (
+                    abs(results['mitotic_count'] - reference['mitotic_count'])
+                    + abs(results['non_mitotic_count'] - reference['non_mitotic_count'])
+                ) / max(reference['total_count'], 1)
+                worst = max(worst, diff)
+                self.stdout.write(
+                    f"{interval:>3} {results['mitotic_count']:>8} {results['non_mitotic_count']:>8} "
+                    f"{results['inference_frames']:>4}/{results['frame_count']:<4} "
+                    f"{results['seconds']:>8.1f} {diff:>6.1%}"
+                )
+
+        if worst > options['tolerance']:
+            self.stdout.write(self.style.WARNING(
+                f"Largest count difference {worst:.1%} exceeds the {options['tolerance']:.1%} tolerance"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"All counts within {options['tolerance']:.1%} of full inference"))
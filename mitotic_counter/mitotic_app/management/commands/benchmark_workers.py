@@ -0,0 +1,120 @@
+# management/commands/benchmark_workers.py
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from multiprocessing import Process
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import override_settings
+from mitotic_app.models import Analysis, DetectedFigure
+from mitotic_app.utils.media_storage import analysis_dir
+from mitotic_app.utils.scan_plan import ScanPlan
+from mitotic_app.utils.workers import run_worker
+from .analyze_slides import collect_slides, create_analysis
+
+
+@contextmanager
+def isolated_database():
+    """Run the block against a fresh test database and a temporary MEDIA_ROOT.
+
+    Benchmark rows are then invisible to live run_worker processes, and the
+    media of their analyses (whose ids start again at 1) cannot overwrite
+    real analysis_N directories. Both are removed afterwards.
+    """
+    media_root = tempfile.mkdtemp(prefix='mitotic_benchmark_')
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    test_name = test_settings.get('NAME')
+    if connection.vendor == 'sqlite' and not test_name:
+        # Forked workers need a file; the default SQLite test database is in memory
+        test_settings['NAME'] = os.path.join(media_root, 'benchmark.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with override_settings(MEDIA_ROOT=media_root):
+            yield
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = test_name
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def delete_analyses(analyses):
+    """Delete analyses with their media directories and upload copies"""
+    for analysis in analyses:
+        shutil.rmtree(analysis_dir(analysis), ignore_errors=True)
+        analysis.uploaded_image.delete(save=False)
+    analyses.delete()
+
+
+class Command(BaseCommand):
+    help = "Measure throughput of local worker pools of increasing size on the same slides, in a test database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('inputs', nargs='+', help="Directories or glob patterns of TIFF slides")
+        parser.add_argument('--workers', default='1,2,4', help="Comma-separated worker counts to try")
+        parser.add_argument('--model', default=None, help="Path to the YOLO weights (defaults to model/best.pt)")
+        parser.add_argument('--shard-frames', type=int, default=None,
+                            help="Split each slide into shards of about this many frames (default: ANALYSIS_SHARD_FRAMES)")
+        parser.add_argument('--window', type=int, default=None,
+                            help="Scan with square windows of this size (e.g. the model input size, 640)")
+
+    def run_pool(self, slides, workers, plan, options):
+        """Queue every slide, run workers until they are all finished and return the timings"""
+        analyses = [create_analysis(path, plan) for path in slides]
+
+        connections.close_all()  # Forked workers must not share the parent's connection
+        processes = [
+            Process(target=run_worker, kwargs={'model_path': options['model'], 'poll_seconds': 1, 'exit_when_idle': True})
+            for _ in range(workers)
+        ]
+        started = time.monotonic()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        seconds = time.monotonic() - started
+
+        finished = Analysis.objects.filter(id__in=[a.id for a in analyses])
+        counts = {
+            analysis.source_path: (
+                analysis.status,
+                analysis.figures.filter(category=DetectedFigure.MITOTIC).count(),
+                analysis.figures.filter(category=DetectedFigure.NON_MITOTIC).count(),
+            )
+            for analysis in finished
+        }
+        frames = sum(a.estimated_frames or 0 for a in finished)
+        delete_analyses(finished)
+        return seconds, frames, counts
+
+    def handle(self, *args, **options):
+        slides = collect_slides(options['inputs'])
+        if not slides:
+            raise CommandError("No TIFF slides found")
+        plan = ScanPlan.for_model(options['window']) if options['window'] else None
+        worker_counts = [int(n) for n in options['workers'].split(',')]
+
+        overrides = {}
+        if options['shard_frames']:
+            overrides['ANALYSIS_SHARD_FRAMES'] = options['shard_frames']
+
+        self.stdout.write(f"{len(slides)} slides")
+        self.stdout.write(f"{'workers':>7} {'seconds':>8} {'frames/s':>9} {'speedup':>8} {'efficiency':>10}")
+        baseline = reference = None
+        with isolated_database(), override_settings(**overrides):
+            for workers in worker_counts:
+                seconds, frames, counts = self.run_pool(slides, workers, plan, options)
+                baseline = baseline or seconds
+                speedup = baseline / seconds
+                self.stdout.write(
+                    f"{workers:>7} {seconds:>8.1f} {frames / seconds:>9.1f} {speedup:>7.2f}x {speedup / workers * worker_counts[0]:>9.0%}"
+                )
+                failed = [path for path, (status, _, _) in counts.items() if status != Analysis.DONE]
+                if failed:
+                    self.stdout.write(self.style.ERROR(f"  {len(failed)} slides did not finish: {', '.join(failed)}"))
+                # However the work was split, every slide must get the same counts
+                reference = reference or counts
+                if counts != reference:
+                    self.stdout.write(self.style.WARNING("  Counts differ from the first run"))
@@ -0,0 +1,37 @@
+# management/commands/check_detector_parity.py
+import os
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from mitotic_app.utils.detectors import compare_backends, get_detector
+
+
+class Command(BaseCommand):
+    help = "Compare detection counts and recall of a detector backend against the PyTorch backend"
+
+    def add_arguments(self, parser):
+        parser.add_argument('videos', nargs='+', help="Scan videos (e.g. media/analysis_N/tiff_scan.mp4)")
+        parser.add_argument('--backend', default='onnx', help="Backend to check against 'yolo' (onnx, cascade)")
+        parser.add_argument('--model', default=os.path.join(settings.BASE_DIR, 'model', 'best.pt'))
+        parser.add_argument('--conf', type=float, default=0.7, help="Confidence threshold used for counting")
+        parser.add_argument('--max-frames', type=int, default=None)
+
+    def handle(self, *args, **options):
+        reference = get_detector(options['model'], backend='yolo')
+        candidate = get_detector(options['model'], backend=options['backend'])
+
+        for video in options['videos']:
+            started = time.monotonic()
+            report = compare_backends(
+                video, reference, candidate,
+                conf_threshold=options['conf'], max_frames=options['max_frames'],
+            )
+            report['seconds'] = round(time.monotonic() - started, 2)
+            if hasattr(candidate, 'fine_frames'):
+                # Share of frames the cascade escalated to full resolution
+                report['fine_pass_frames'] = f"{candidate.fine_frames}/{candidate.frames}"
+                candidate.frames = candidate.fine_frames = 0
+
+            self.stdout.write(video)
+            for key, value in report.items():
+                self.stdout.write(f"  {key}: {value}")
@@ -0,0 +1,64 @@
+# management/commands/evict_media.py
+from django.core.management.base import BaseCommand, CommandError
+from mitotic_app.models import Analysis
+from mitotic_app.utils.media_storage import (
+    compact_analysis, dedupe_scan_videos, eviction_candidates, evict_analysis, media_usage,
+)
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(value):
+    """Parse sizes like 500M or 20G into bytes"""
+    value = value.strip().upper().rstrip('B')
+    try:
+        if value and value[-1] in SIZE_UNITS:
+            return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+        return int(value)
+    except ValueError:
+        raise CommandError(f"Invalid size: {value}")
+
+
+def format_size(num_bytes):
+    for unit in ['B', 'K', 'M', 'G']:
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f}{unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f}T"
+
+
+class Command(BaseCommand):
+    help = "Compact and evict regenerable analysis media by size, age and least-recent use"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-size', default=None, help="Evict until MEDIA_ROOT is below this size (e.g. 50G)")
+        parser.add_argument('--older-than', type=int, default=None, help="Evict analyses unused for this many days")
+        parser.add_argument('--compact', action='store_true', help="Drop intermediates of all finished analyses")
+        parser.add_argument('--dedupe', action='store_true', help="Remove duplicate scan videos under videos/")
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be evicted without deleting")
+
+    def handle(self, *args, **options):
+        finished = Analysis.objects.filter(status=Analysis.DONE)
+        self.stdout.write(f"Media usage: {format_size(media_usage())}")
+
+        if options['dedupe'] and not options['dry_run']:
+            freed = dedupe_scan_videos(Analysis.objects.all())
+            self.stdout.write(f"Deduplicated scan videos: freed {format_size(freed)}")
+
+        if options['compact'] and not options['dry_run']:
+            freed = sum(compact_analysis(analysis) for analysis in finished)
+            self.stdout.write(f"Compacted finished analyses: freed {format_size(freed)}")
+
+        max_bytes = parse_size(options['max_size']) if options['max_size'] else None
+        if max_bytes is None and options['older_than'] is None:
+            return
+
+        total = 0
+        for analysis, size in list(eviction_candidates(finished, max_bytes, options['older_than'])):
+            total += evict_analysis(analysis, dry_run=options['dry_run'])
+            self.stdout.write(f"{'Would evict' if options['dry_run'] else 'Evicted'} {analysis} ({format_size(size)})")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Would free' if options['dry_run'] else 'Freed'} {format_size(total)}; "
+            f"media usage now {format_size(media_usage())}"
+        ))
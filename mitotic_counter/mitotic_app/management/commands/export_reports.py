@@ -0,0 +1,42 @@
+# management/commands/export_reports.py
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from mitotic_app.utils.reports import csv_lines, json_chunks, report_queryset, report_rows
+
+
+def parse_day(value):
+    day = parse_date(value) if value else None
+    if value and day is None:
+        raise CommandError(f"Invalid date: {value} (expected YYYY-MM-DD)")
+    return day
+
+
+class Command(BaseCommand):
+    help = "Export counts, HPF metrics and timing for many analyses as CSV or JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+        parser.add_argument('--start', default=None, help="First upload date to include (YYYY-MM-DD)")
+        parser.add_argument('--end', default=None, help="Last upload date to include (YYYY-MM-DD)")
+        parser.add_argument('--ids', default=None, help="Comma-separated analysis ids")
+        parser.add_argument('--output', default='-', help="Output file (default: stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            ids = [int(i) for i in options['ids'].split(',') if i.strip()] if options['ids'] else None
+        except ValueError:
+            raise CommandError(f"Invalid ids: {options['ids']}")
+        queryset = report_queryset(parse_day(options['start']), parse_day(options['end']), ids)
+
+        rows = report_rows(queryset)
+        chunks = json_chunks(rows) if options['format'] == 'json' else csv_lines(rows)
+        if options['output'] == '-':
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+            return
+
+        with open(options['output'], 'w', newline='') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
@@ -0,0 +1,46 @@
+# management/commands/index_figures.py
+from django.core.management.base import BaseCommand
+from mitotic_app.models import Analysis, DetectedFigure
+from mitotic_app.utils.figure_hashes import group_duplicates, hash_figure_file, slide_position
+from mitotic_app.utils.scan_plan import ScanPlan
+
+
+class Command(BaseCommand):
+    help = "Hash figures of older analyses and group near-duplicate captures for review"
+
+    def add_arguments(self, parser):
+        parser.add_argument('analysis_ids', nargs='*', type=int, help="Analyses to index (default: all)")
+        parser.add_argument('--distance', type=int, default=None, help="Maximum hash distance in bits")
+        parser.add_argument('--radius', type=int, default=None, help="Maximum slide distance in pixels")
+
+    def handle(self, *args, **options):
+        analyses = Analysis.objects.filter(status=Analysis.DONE)
+        if options['analysis_ids']:
+            analyses = analyses.filter(id__in=options['analysis_ids'])
+
+        skipped = 0
+        for analysis in analyses:
+            # Analyses from before scan plans were stored used the default plan
+            plan = analysis.scan_plan or ScanPlan()
+            layout = plan.layout(analysis.image_width, analysis.image_height, analysis.roi) if analysis.image_width else None
+
+            hashed = []
+            try:
+                for figure in analysis.figures.filter(phash__isnull=True):
+                    figure.phash = hash_figure_file(figure.image_file.path)
+                    if layout:
+                        figure.slide_x, figure.slide_y = slide_position(figure.frame_number, layout)
+                    hashed.append(figure)
+            except IndexError as e:
+                # The stored plan or ROI does not describe the scan these figures came from
+                self.stdout.write(self.style.WARNING(f"[skipped] {analysis}: {e}; its scan layout has "
+                                                     f"{layout.frame_count} frames"))
+                skipped += 1
+                continue
+            DetectedFigure.objects.bulk_update(hashed, ['phash', 'slide_x', 'slide_y'], batch_size=500)
+
+            groups = group_duplicates(analysis, options['distance'], options['radius'])
+            self.stdout.write(f"{analysis}: hashed {len(hashed)} figures, {groups} duplicate groups")
+
+        if skipped:
+            self.stdout.write(self.style.WARNING(f"Skipped {skipped} analyses whose figures fall outside their scan"))
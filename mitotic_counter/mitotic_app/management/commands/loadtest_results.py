@@ -0,0 +1,67 @@
+# management/commands/loadtest_results.py
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from mitotic_app.models import Analysis, DetectedFigure
+from .benchmark_workers import isolated_database
+
+CATEGORIES = [DetectedFigure.MITOTIC, DetectedFigure.NON_MITOTIC, DetectedFigure.DISCARDED]
+
+
+def create_synthetic_analysis(figure_count):
+    """A finished analysis with figure_count fake figures, inserted without per-row HPF updates"""
+    # DONE, so no worker that could see the database would try to run it
+    analysis = Analysis.objects.create(
+        uploaded_image='uploads/loadtest.tiff', processed_video='loadtest.mp4', total_hpfs=100,
+        status=Analysis.DONE,
+    )
+    batch = [
+        DetectedFigure(
+            analysis=analysis,
+            image_file=f'figures/loadtest_{i}.jpg',
+            category=CATEGORIES[i % len(CATEGORIES)],
+            confidence=0.9,
+            frame_number=i,
+        )
+        for i in range(figure_count)
+    ]
+    DetectedFigure.objects.bulk_create(batch, batch_size=2000)
+    return analysis
+
+
+class Command(BaseCommand):
+    help = "Measure results-page latency as the number of figures per analysis grows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,10000,30000',
+                            help="Comma-separated figure counts per analysis")
+        parser.add_argument('--repeat', type=int, default=5, help="Requests per size")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        client = Client(HTTP_HOST='localhost')
+        # A throwaway database and MEDIA_ROOT: live workers and analyses never see the synthetic ones
+        with isolated_database():
+            self.stdout.write(f"{'figures':>8} {'median ms':>10} {'max ms':>8} {'queries':>8}")
+            for size in sizes:
+                analysis = create_synthetic_analysis(size)
+                url = reverse('results', args=[analysis.id])
+                client.get(url)  # Warm up caches and the HPF update
+
+                timings = []
+                for _ in range(options['repeat']):
+                    reset_queries()
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        response = client.get(url)
+                        timings.append((time.perf_counter() - started) * 1000)
+                    if response.status_code != 200:
+                        self.stderr.write(f"Unexpected status {response.status_code} for {size} figures")
+
+                self.stdout.write(
+                    f"{size:>8} {statistics.median(timings):>10.1f} {max(timings):>8.1f} {len(queries):>8}"
+                )
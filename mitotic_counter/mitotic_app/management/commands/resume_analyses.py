@@ -0,0 +1,27 @@
+# management/commands/resume_analyses.py
+from django.core.management.base import BaseCommand
+from mitotic_app.models import Analysis
+from mitotic_app.utils.leases import claimable
+from mitotic_app.utils.pipeline import run_analysis_exclusive
+
+
+class Command(BaseCommand):
+    help = "Run queued analyses and resume those whose worker died, from their last checkpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=None, help="Path to the YOLO weights (defaults to model/best.pt)")
+
+    def handle(self, *args, **options):
+        pending = list(Analysis.objects.filter(claimable()).order_by('upload_date'))
+        self.stdout.write(f"Found {len(pending)} queued or abandoned analyses")
+
+        for analysis in pending:
+            try:
+                started, results = run_analysis_exclusive(analysis, model_path=options['model'], wait=True)
+            except Exception as e:
+                started, results = True, None
+                print(f"Error resuming {analysis}: {e}")
+            if not started:
+                self.stdout.write(f"[skipped] {analysis} is owned by another worker")
+            else:
+                self.stdout.write(f"[{'done' if results else 'failed'}] {analysis}")
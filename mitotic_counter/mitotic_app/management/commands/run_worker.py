@@ -0,0 +1,43 @@
+# management/commands/run_worker.py
+from multiprocessing import Process
+from django.core.management.base import BaseCommand
+from django.db import connections
+from mitotic_app.utils.workers import run_worker
+
+
+class Command(BaseCommand):
+    help = "Run analyses and analysis shards claimed from the database, alongside workers on other hosts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help="Worker processes to start on this host")
+        parser.add_argument('--model', default=None, help="Path to the YOLO weights (defaults to model/best.pt)")
+        parser.add_argument('--poll', type=float, default=None, help="Seconds to wait when there is no work")
+        parser.add_argument('--exit-when-idle', action='store_true',
+                            help="Stop once no analysis is queued or running instead of polling forever")
+        parser.add_argument('--no-warm-up', action='store_true',
+                            help="Skip loading the models and one dummy inference before claiming work")
+
+    def handle(self, *args, **options):
+        kwargs = {
+            'model_path': options['model'],
+            'poll_seconds': options['poll'],
+            'exit_when_idle': options['exit_when_idle'],
+            'warm_up': False if options['no_warm_up'] else None,
+        }
+        processes = max(1, options['processes'])
+        if processes == 1:
+            run_worker(**kwargs)
+            return
+
+        # Forked workers must not share the parent's database connection
+        connections.close_all()
+        workers = [Process(target=run_worker, kwargs=kwargs) for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+            raise
@@ -0,0 +1,53 @@
+# management/commands/warm_up.py
+import json
+import os
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from mitotic_app.utils.warmup import warm_up
+
+# Run in a fresh interpreter: this process has already imported whatever the
+# management command machinery needed
+BOOT_SCRIPT = """
+import importlib, json, time
+started = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter()
+from django.conf import settings
+importlib.import_module(settings.ROOT_URLCONF)
+urls = time.perf_counter()
+from mitotic_app.utils.warmup import heavy_modules_loaded
+print(json.dumps({'setup_seconds': setup - started, 'urlconf_seconds': urls - setup,
+                  'heavy_modules': heavy_modules_loaded()}))
+"""
+
+
+class Command(BaseCommand):
+    help = "Time the web process boot and an inference worker's warm-up (imports, model load, first inference)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=None, help="Path to the YOLO weights (defaults to model/best.pt)")
+        parser.add_argument('--boot-only', action='store_true', help="Only measure the web process boot")
+
+    def handle(self, *args, **options):
+        boot = subprocess.run(
+            [sys.executable, '-c', BOOT_SCRIPT], cwd=settings.BASE_DIR, env=os.environ.copy(),
+            capture_output=True, text=True, check=True,
+        )
+        boot = json.loads(boot.stdout.strip().splitlines()[-1])
+        self.stdout.write(
+            f"Web boot: django.setup {boot['setup_seconds']:.3f}s, URLconf import {boot['urlconf_seconds']:.3f}s"
+        )
+        if boot['heavy_modules']:
+            self.stdout.write(self.style.WARNING(f"  URLconf imports {', '.join(boot['heavy_modules'])}"))
+        else:
+            self.stdout.write("  No inference dependencies imported")
+        if options['boot_only']:
+            return
+
+        timings = warm_up(options['model'])
+        self.stdout.write(f"Worker warm-up ({timings['models']} models):")
+        for step in ('import', 'load', 'inference'):
+            self.stdout.write(f"  {step}: {timings[f'{step}_seconds']:.3f}s")
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mitotic_app', '0002_analysis_hpf_height_px_analysis_hpf_width_px_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='source_path',
+            field=models.CharField(blank=True, default='', max_length=1024),
+        ),
+    ]
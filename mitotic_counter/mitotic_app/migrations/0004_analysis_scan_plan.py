@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mitotic_app', '0003_analysis_source_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='estimated_frames',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='scan_step_x',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='scan_step_y',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='scan_window_height',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='scan_window_width',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mitotic_app', '0004_analysis_scan_plan'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='image_height',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='image_width',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='tiff_metadata',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='analysis',
+            name='uploaded_image',
+            field=models.FileField(upload_to='uploads/'),
+        ),
+    ]
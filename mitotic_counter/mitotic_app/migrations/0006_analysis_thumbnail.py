@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mitotic_app', '0005_analysis_tiff_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='thumbnails/'),
+        ),
+    ]
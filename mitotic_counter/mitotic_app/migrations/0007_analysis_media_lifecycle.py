@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mitotic_app', '0006_analysis_thumbnail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='last_accessed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='media_evicted',
+            field=models.BooleanField(default=False),
+        ),
+    ]
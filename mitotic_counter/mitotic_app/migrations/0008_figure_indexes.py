@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mitotic_app', '0007_analysis_media_lifecycle'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='analysis',
+            name='upload_date',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='detectedfigure',
+            index=models.Index(fields=['analysis', 'category', 'frame_number'], name='figure_analysis_cat_frame'),
+        ),
+    ]
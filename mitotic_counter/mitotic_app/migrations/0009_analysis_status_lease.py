@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:48
+
+from django.db import migrations, models
+
+
+def mark_finished_analyses_done(apps, schema_editor):
+    Analysis = apps.get_model('mitotic_app', 'Analysis')
+    Analysis.objects.exclude(processed_video='').exclude(processed_video__isnull=True).update(status='done')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mitotic_app', '0008_figure_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='error_message',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='lease_owner',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10),
+        ),
+        migrations.RunPython(mark_finished_analyses_done, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mitotic_app', '0009_analysis_status_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='detectedfigure',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='mitotic_app.detectedfigure'),
+        ),
+        migrations.AddField(
+            model_name='detectedfigure',
+            name='phash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='detectedfigure',
+            name='slide_x',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='detectedfigure',
+            name='slide_y',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
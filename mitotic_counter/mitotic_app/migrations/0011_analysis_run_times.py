@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mitotic_app', '0010_figure_hashes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mitotic_app', '0011_analysis_run_times'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mitotic_app', '0012_analysis_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='detectedfigure',
+            name='box_height',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='detectedfigure',
+            name='box_width',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mitotic_app', '0013_figure_boxes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShadowResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('model_path', models.CharField(blank=True, default='', max_length=1024)),
+                ('mitotic_count', models.IntegerField()),
+                ('non_mitotic_count', models.IntegerField()),
+                ('inference_frames', models.IntegerField(default=0)),
+                ('mitoses_per_10_hpf', models.FloatField(blank=True, null=True)),
+                ('tumor_grade', models.IntegerField(blank=True, null=True)),
+                ('agreement', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('analysis', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shadow_results', to='mitotic_app.analysis')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('analysis', 'name'), name='shadow_result_analysis_name')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mitotic_app', '0015_analysis_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='roi',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='analysis',
+            name='status',
+            field=models.CharField(choices=[('draft', 'Awaiting ROI'), ('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mitotic_app', '0016_analysis_roi'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='progressive_samples',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='running_estimate',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
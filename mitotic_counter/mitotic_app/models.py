@@ -3,10 +3,45 @@ from django.db import models
 import os
 
 class Analysis(models.Model):
-    uploaded_image = models.ImageField(upload_to='uploads/')
+    DRAFT = 'draft'
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    
+    STATUS_CHOICES = [
+        (DRAFT, 'Awaiting ROI'),  # Uploaded; workers leave it alone until the ROI is drawn
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    
+    # Plain FileField: uploads are validated from the TIFF header instead of being opened by Pillow
+    uploaded_image = models.FileField(upload_to='uploads/')
     video_file = models.FileField(upload_to='videos/', null=True, blank=True)
     processed_video = models.FileField(upload_to='videos/processed/', null=True, blank=True)
-    upload_date = models.DateTimeField(auto_now_add=True)
+    thumbnail = models.ImageField(upload_to='thumbnails/', null=True, blank=True)
+    upload_date = models.DateTimeField(auto_now_add=True, db_index=True)
+    source_path = models.CharField(max_length=1024, blank=True, default='')  # Set by analyze_slides
+    
+    # Pipeline state; a running analysis is owned by whoever holds an unexpired lease (see utils/leases.py)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    lease_owner = models.CharField(max_length=255, blank=True, default='')
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    error_message = models.TextField(blank=True, default='')
+    started_at = models.DateTimeField(null=True, blank=True)   # When the current/last run took the lease
+    finished_at = models.DateTimeField(null=True, blank=True)  # When it was released as done or failed
+    
+    # Media lifecycle (see utils/media_storage.py)
+    last_accessed = models.DateTimeField(null=True, blank=True)
+    media_evicted = models.BooleanField(default=False)
+    
+    # TIFF header, parsed once at upload time
+    image_width = models.IntegerField(null=True, blank=True)
+    image_height = models.IntegerField(null=True, blank=True)
+    tiff_metadata = models.JSONField(null=True, blank=True)
     
     # HPF-related fields
     x_mpp = models.FloatField(null=True, blank=True)
@@ -17,9 +52,86 @@ class Analysis(models.Model):
     mitoses_per_10_hpf = models.FloatField(null=True, blank=True)
     tumor_grade = models.IntegerField(null=True, blank=True)
     
+    # Scan plan shared by TIFFScanner.smooth_scan and the HPF calculation
+    scan_window_width = models.IntegerField(null=True, blank=True)
+    scan_window_height = models.IntegerField(null=True, blank=True)
+    scan_step_x = models.IntegerField(null=True, blank=True)
+    scan_step_y = models.IntegerField(null=True, blank=True)
+    estimated_frames = models.IntegerField(null=True, blank=True)
+    
+    # Progressive scans sample this many HPF-sized blocks first (see ScanLayout.progressive)
+    progressive_samples = models.IntegerField(null=True, blank=True)
+    # Provisional mitoses per 10 HPF with its confidence interval, published while scanning (utils/progressive.py)
+    running_estimate = models.JSONField(null=True, blank=True)
+    
+    # Region of interest as polygons of [x, y] level-0 pixels (see utils/roi.py); empty scans the whole slide
+    roi = models.JSONField(null=True, blank=True)
+    
+    # Incremented whenever the analysis or its figures change; the JSON API derives ETags from it
+    version = models.PositiveIntegerField(default=0)
+    
     def __str__(self):
         return f"Analysis {self.id} - {self.upload_date.strftime('%Y-%m-%d %H:%M')}"
     
+    # Written only by the conditional updates in utils/leases.py. A plain save of an instance
+    # loaded before the last renewal would roll the lease back to an expiry already passed
+    LEASE_FIELDS = {'status', 'lease_owner', 'lease_expires_at', 'heartbeat_at', 'error_message', 'started_at', 'finished_at'}
+    
+    def save(self, *args, **kwargs):
+        # version only ever moves forward in the database, so a stale instance must not write it back
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = [name for name in update_fields if name != 'version']
+        elif not self._state.adding:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'version' and field.name not in self.LEASE_FIELDS
+            ]
+        super().save(*args, **kwargs)
+        self.bump_version()
+    
+    def bump_version(self):
+        type(self).objects.filter(id=self.id).update(version=models.F('version') + 1)
+    
+    def set_tiff_metadata(self, metadata):
+        """Store a parsed TIFF header so later steps never reopen the slide"""
+        from .utils.hpf_calculator import extract_strict_tiff_metadata, get_microns_per_pixel
+        
+        self.tiff_metadata = metadata
+        self.image_width = metadata["ImageWidth"]
+        self.image_height = metadata["ImageLength"]
+        try:
+            self.x_mpp, self.y_mpp = get_microns_per_pixel(extract_strict_tiff_metadata(None, metadata))
+        except ValueError:
+            # No usable resolution tags; HPF metrics will be unavailable
+            pass
+    
+    @property
+    def scan_plan(self):
+        """The persisted ScanPlan, or None if the analysis has not been planned yet"""
+        from .utils.scan_plan import ScanPlan
+        if self.scan_window_width is None:
+            return None
+        return ScanPlan(self.scan_window_width, self.scan_window_height, self.scan_step_x, self.scan_step_y)
+    
+    @scan_plan.setter
+    def scan_plan(self, plan):
+        self.scan_window_width = plan.window_width
+        self.scan_window_height = plan.window_height
+        self.scan_step_x = plan.step_x
+        self.scan_step_y = plan.step_y
+    
+    @property
+    def scan_layout(self):
+        """The ScanLayout of the scan plan over the ROI, or None before planning"""
+        plan = self.scan_plan
+        if plan is None or not self.image_width or not self.image_height:
+            return None
+        layout = plan.layout(self.image_width, self.image_height, self.roi)
+        if self.progressive_samples and self.hpf_width_px and self.hpf_height_px:
+            layout = layout.progressive(self.progressive_samples, self.hpf_width_px, self.hpf_height_px)
+        return layout
+    
     def update_hpf_analysis(self):
         """Update HPF analysis based on current mitotic count"""
         from .utils.hpf_calculator import get_tumor_grade, mitoses_per_10_hpf
@@ -29,10 +141,13 @@ class Analysis(models.Model):
         
         # If we have HPF data, recalculate mitoses_per_10_hpf
         if self.total_hpfs:
-            self.mitoses_per_10_hpf = mitoses_per_10_hpf(mitotic_count, self.total_hpfs)
-            self.mitoses_per_10_hpf = round(self.mitoses_per_10_hpf, 2)
-            self.tumor_grade = get_tumor_grade(self.mitoses_per_10_hpf)
-            self.save()
+            density = round(mitoses_per_10_hpf(mitotic_count, self.total_hpfs), 2)
+            grade = get_tumor_grade(density)
+            if density == self.mitoses_per_10_hpf and grade == self.tumor_grade:
+                return  # Nothing changed; avoid a write (and a database lock) on every page view
+            self.mitoses_per_10_hpf = density
+            self.tumor_grade = grade
+            self.save(update_fields=['mitoses_per_10_hpf', 'tumor_grade'])
             
             # Print for debugging
             print(f"Updated HPF analysis: {mitotic_count} mitotic figures, {self.mitoses_per_10_hpf} per 10 HPF, Grade {self.tumor_grade}")
@@ -53,6 +168,21 @@ class DetectedFigure(models.Model):
     category = models.CharField(max_length=20, choices=CATEGORY_CHOICES)
     confidence = models.FloatField()
     frame_number = models.IntegerField()
+    # Perceptual hash of the figure crop and its level-0 slide position, for duplicate detection
+    phash = models.BigIntegerField(null=True, blank=True)
+    slide_x = models.IntegerField(null=True, blank=True)
+    slide_y = models.IntegerField(null=True, blank=True)
+    box_width = models.IntegerField(null=True, blank=True)
+    box_height = models.IntegerField(null=True, blank=True)
+    # Set on near-duplicates of another capture of the same cell (see utils/figure_hashes.py)
+    duplicate_of = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL,
+                                     related_name='duplicates')
+    
+    class Meta:
+        indexes = [
+            # Matches how results, download_figures and update_hpf_analysis filter and order
+            models.Index(fields=['analysis', 'category', 'frame_number'], name='figure_analysis_cat_frame'),
+        ]
     
     def __str__(self):
         return f"{self.category} figure ({self.confidence:.2f}) - Frame {self.frame_number}"
@@ -66,4 +196,65 @@ class DetectedFigure(models.Model):
         
         # Update HPF analysis on the parent analysis object
         if self.analysis:
-            self.analysis.update_hpf_analysis()
\ No newline at end of file
+            self.analysis.bump_version()
+            self.analysis.update_hpf_analysis()
+
+
+class ShadowResult(models.Model):
+    """Counts from a shadow model run over the same scan as the primary model (see utils/shadow_eval.py)"""
+    analysis = models.ForeignKey(Analysis, on_delete=models.CASCADE, related_name='shadow_results')
+    name = models.CharField(max_length=100)
+    model_path = models.CharField(max_length=1024, blank=True, default='')
+    mitotic_count = models.IntegerField()
+    non_mitotic_count = models.IntegerField()
+    inference_frames = models.IntegerField(default=0)
+    mitoses_per_10_hpf = models.FloatField(null=True, blank=True)
+    tumor_grade = models.IntegerField(null=True, blank=True)
+    # Matched/unmatched crossings, recall, precision and category agreement against the primary model
+    agreement = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['analysis', 'name'], name='shadow_result_analysis_name'),
+        ]
+    
+    def __str__(self):
+        return f"Shadow {self.name} for Analysis {self.analysis_id}"
+
+
+class AnalysisShard(models.Model):
+    """A row-aligned range of scan frames, detected by whichever worker holds its lease (see utils/shards.py)"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    
+    analysis = models.ForeignKey(Analysis, on_delete=models.CASCADE, related_name='shards')
+    start_frame = models.IntegerField()
+    end_frame = models.IntegerField()  # Exclusive; lowered when an idle worker steals the tail
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    lease_owner = models.CharField(max_length=255, blank=True, default='')
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error_message = models.TextField(blank=True, default='')
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # process_video results for the range (figures and shadow crossings), merged once every shard is done
+    results = models.JSONField(null=True, blank=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['analysis', 'start_frame'], name='shard_analysis_start'),
+        ]
+    
+    def __str__(self):
+        return f"Analysis {self.analysis_id} frames {self.start_frame}-{self.end_frame}"
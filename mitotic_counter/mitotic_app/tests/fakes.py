@@ -0,0 +1,131 @@
+# tests/fakes.py
+import random
+import sys
+import types
+from contextlib import contextmanager
+from unittest import mock
+
+
+class Interrupted(Exception):
+    """Raised by SceneDetector to stop process_video as a killed worker would"""
+
+
+class FakeFrame:
+    """A decoded scan window: only its frame number and shape are known.
+
+    Copies, crops and drawing all return or ignore the same object, which is
+    all process_video does with frames besides handing them to the detector.
+    """
+
+    def __init__(self, number, width, height):
+        self.number = number
+        self.shape = (height, width, 3)
+
+    def copy(self):
+        return self
+
+    def __getitem__(self, key):
+        return self
+
+
+class FakeCapture:
+    """cv2.VideoCapture over the frames of a ScanLayout"""
+
+    def __init__(self, layout):
+        self.plan = layout.plan
+        self.frame_count = layout.frame_count
+        self.position = 0
+        self.opened = True
+
+    def isOpened(self):
+        return self.opened
+
+    def grab(self):
+        if self.position >= self.frame_count:
+            return False
+        self.position += 1
+        return True
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return True, FakeFrame(self.position - 1, self.plan.window_width, self.plan.window_height)
+
+    def get(self, prop):
+        return 30
+
+    def release(self):
+        self.opened = False
+
+
+class FakeWriter:
+    def __init__(self, *args):
+        pass
+
+    def write(self, frame):
+        pass
+
+    def release(self):
+        pass
+
+
+def fake_cv2(layout):
+    """A cv2 module whose captures replay layout's frames and whose drawing does nothing"""
+    module = types.ModuleType('cv2')
+    module.VideoCapture = lambda path: FakeCapture(layout)
+    module.VideoWriter = FakeWriter
+    module.VideoWriter_fourcc = lambda *code: 0
+    module.CAP_PROP_FPS = 5
+    module.FONT_HERSHEY_SIMPLEX = 0
+    for name in ('line', 'rectangle', 'putText', 'circle', 'imwrite', 'setNumThreads'):
+        setattr(module, name, lambda *args, **kwargs: None)
+    return module
+
+
+@contextmanager
+def scan_environment(layout):
+    """Run process_video over layout's frames without OpenCV or real pixels"""
+    with mock.patch.dict(sys.modules, {'cv2': fake_cv2(layout)}), \
+            mock.patch('mitotic_app.utils.figure_hashes.phash', return_value=0):
+        yield
+
+
+def random_cells(layout, count, seed=0, size=30):
+    """count square cells at random level-0 positions, each (x, y, size, class_id)"""
+    rng = random.Random(seed)
+    return [
+        (rng.randrange(0, layout.image_width - size), rng.randrange(0, layout.image_height - size), size, rng.randrange(2))
+        for _ in range(count)
+    ]
+
+
+class SceneDetector:
+    """Detects the cells of a synthetic slide in each scan window.
+
+    Boxes are the cells' level-0 squares moved into the frame's window and
+    clipped to it, so they move by exactly the scan stride between frames.
+    With fail_at the detector raises Interrupted when it is first given a
+    frame at or past that frame number.
+    """
+
+    def __init__(self, layout, cells, fail_at=None, confidence=0.9):
+        self.layout = layout
+        self.cells = cells
+        self.fail_at = fail_at
+        self.confidence = confidence
+        self.calls = 0
+
+    def detect(self, frame):
+        self.calls += 1
+        if self.fail_at is not None and frame.number >= self.fail_at:
+            raise Interrupted(f"Stopped at frame {frame.number}")
+        x0, y0 = self.layout.window(frame.number)
+        height, width = frame.shape[:2]
+        detections = []
+        for x, y, size, class_id in self.cells:
+            x1, y1 = x - x0, y - y0
+            x2, y2 = x1 + size, y1 + size
+            if x2 <= 0 or y2 <= 0 or x1 >= width or y1 >= height:
+                continue
+            detections.append((max(x1, 0), max(y1, 0), min(x2, width), min(y2, height), self.confidence, class_id))
+        return detections
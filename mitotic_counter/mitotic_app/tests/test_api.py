@@ -0,0 +1,97 @@
+# tests/test_api.py
+import shutil
+import tempfile
+from unittest import mock
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from mitotic_app.models import Analysis, DetectedFigure
+from mitotic_app.utils import pipeline
+from mitotic_app.utils.scan_plan import ScanPlan
+
+
+class APIConditionalRequestTests(TestCase):
+    """Every endpoint answers a matching If-None-Match with 304 until the analysis changes"""
+
+    def setUp(self):
+        self.analysis = Analysis.objects.create(uploaded_image='uploads/slide.tiff', status=Analysis.DONE)
+        DetectedFigure.objects.bulk_create([
+            DetectedFigure(analysis=self.analysis, image_file=f'figures/{i}.jpg', confidence=0.9, frame_number=i,
+                           category=DetectedFigure.MITOTIC if i % 2 else DetectedFigure.NON_MITOTIC)
+            for i in range(5)
+        ])
+        self.urls = [
+            reverse('api_analyses'),
+            reverse('api_analysis', args=[self.analysis.id]),
+            reverse('api_figures', args=[self.analysis.id]),
+            reverse('api_overlay', args=[self.analysis.id]),
+        ]
+
+    def test_matching_etag_gives_304(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                etag = response['ETag']
+                self.assertTrue(etag.startswith('W/"'))
+                again = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(again.status_code, 304)
+                self.assertEqual(again.content, b'')
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='W/"other"').status_code, 200)
+
+    def test_changing_a_figure_changes_every_etag(self):
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        figure = self.analysis.figures.get(frame_number=0)
+        figure.category = DetectedFigure.DISCARDED
+        figure.save()
+        for url, etag in etags.items():
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+    def test_query_string_is_part_of_the_etag(self):
+        url = reverse('api_figures', args=[self.analysis.id])
+        etag = self.client.get(url, {'category': 'mitotic'})['ETag']
+        self.assertNotEqual(self.client.get(url, {'category': 'non_mitotic'})['ETag'], etag)
+        self.assertEqual(self.client.get(url, {'category': 'mitotic'}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+@override_settings(RENDER_PROCESSED_VIDEO=False, MEDIA_COMPACT_ON_COMPLETE=False)
+class StoreFiguresTests(TestCase):
+    """detect_figures writes its figures in bulk, with one version bump and one HPF update"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def store(self, count):
+        """Queries run storing count figures for a new analysis, and the analysis"""
+        analysis = Analysis(uploaded_image='uploads/slide.tiff', image_width=3000, image_height=1000,
+                            total_hpfs=10, status=Analysis.RUNNING)
+        analysis.scan_plan = ScanPlan()
+        analysis.save()
+        figures = [
+            {'image_path': f'figures/{i}.jpg', 'category': DetectedFigure.MITOTIC, 'confidence': 0.9,
+             'frame_number': i * 5, 'box': [10, 20, 40, 50], 'phash': None}
+            for i in range(count)
+        ]
+        results = {'figures_data': figures, 'processed_video': None, 'frame_count': 552, 'shadows': {}}
+        with mock.patch.object(pipeline, 'process_video', return_value=results), \
+                mock.patch.object(pipeline, 'loaded_detector'), mock.patch.object(pipeline, 'shadow_models', dict), \
+                CaptureQueriesContext(connection) as queries:
+            pipeline.detect_figures(analysis, 'tiff_scan.mp4', 'best.pt')
+        return len(queries), Analysis.objects.get(id=analysis.id)
+
+    def test_query_count_does_not_grow_with_figures(self):
+        few, first = self.store(10)
+        many, analysis = self.store(60)
+        self.assertEqual(many, few)
+        self.assertEqual((first.figures.count(), analysis.figures.count()), (10, 60))
+        self.assertEqual(analysis.mitoses_per_10_hpf, 60.0)
+        # One bump for the whole batch, not one per figure
+        self.assertEqual(analysis.version, first.version)
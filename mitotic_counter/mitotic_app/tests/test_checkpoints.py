@@ -0,0 +1,84 @@
+# tests/test_checkpoints.py
+import json
+import shutil
+import tempfile
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from mitotic_app.utils import mitotic_counter
+from mitotic_app.utils.mitotic_counter import load_checkpoint, process_video
+from mitotic_app.utils.scan_plan import ScanPlan
+from .fakes import Interrupted, SceneDetector, random_cells, scan_environment
+
+
+class ResumeAfterInterruptionTests(SimpleTestCase):
+    """A run killed after a checkpoint and resumed must match an uninterrupted run"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.plan = ScanPlan()
+        self.layout = self.plan.layout(3000, 1000)
+        self.cells = random_cells(self.layout, 60)
+
+    def run_scan(self, detector, analysis_id='scan', **options):
+        """process_video over the synthetic slide; returns (results, checkpoint states by frame)"""
+        states = {}
+        save = mitotic_counter.save_checkpoint
+
+        def record(analysis_id, state, shard=None):
+            # As a resumed run would read it back
+            states[state['frame_count']] = json.loads(json.dumps(state))
+            save(analysis_id, state, shard)
+
+        with scan_environment(self.layout), mock.patch.object(mitotic_counter, 'save_checkpoint', record):
+            results = process_video(
+                'tiff_scan.mp4', None, analysis_id, detector=detector,
+                scan_shift=self.plan.step_x, row_starts=self.layout.row_starts,
+                write_video=False, checkpoint_every=50, **options
+            )
+        return results, states
+
+    def assert_resumes(self, keyframe_interval):
+        options = {'keyframe_interval': keyframe_interval}
+        expected, expected_states = self.run_scan(SceneDetector(self.layout, self.cells), **options)
+        self.assertEqual(expected['frame_count'], self.layout.frame_count)
+        self.assertGreater(expected['total_count'], 0)
+
+        # Killed between the checkpoints at frames 100 and 150
+        interrupted = SceneDetector(self.layout, self.cells, fail_at=130)
+        with self.assertRaises(Interrupted):
+            self.run_scan(interrupted, **options)
+        checkpoint = load_checkpoint('scan')
+        self.assertEqual(checkpoint['frame_count'], 100)
+
+        detector = SceneDetector(self.layout, self.cells)
+        results, states = self.run_scan(detector, resume=True, **options)
+
+        for key in ('frame_count', 'mitotic_count', 'non_mitotic_count', 'inference_frames', 'figures_data'):
+            self.assertEqual(results[key], expected[key], key)
+        # Tracker, keyframe and count state at every later checkpoint is the same
+        self.assertEqual(sorted(states), [frame for frame in sorted(expected_states) if frame > 100])
+        for frame, state in states.items():
+            self.assertEqual(state, expected_states[frame], f"checkpoint at frame {frame}")
+        # The resumed run skipped the frames before its checkpoint
+        self.assertLess(detector.calls, expected['inference_frames'])
+        self.assertIsNone(load_checkpoint('scan'))
+
+    def test_resume_matches_uninterrupted_run(self):
+        self.assert_resumes(keyframe_interval=1)
+
+    def test_resume_with_keyframes_matches_uninterrupted_run(self):
+        self.assert_resumes(keyframe_interval=3)
+
+    def test_fresh_run_ignores_checkpoint_without_resume(self):
+        with self.assertRaises(Interrupted):
+            self.run_scan(SceneDetector(self.layout, self.cells, fail_at=130))
+        detector = SceneDetector(self.layout, self.cells)
+        results, _ = self.run_scan(detector, resume=False)
+        expected, _ = self.run_scan(SceneDetector(self.layout, self.cells))
+        self.assertEqual(detector.calls, self.layout.frame_count)
+        self.assertEqual(results['figures_data'], expected['figures_data'])
@@ -0,0 +1,32 @@
+# tests/test_index_figures.py
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+from mitotic_app.models import Analysis, DetectedFigure
+from mitotic_app.utils.scan_plan import ScanPlan
+
+
+class IndexFiguresTests(TestCase):
+
+    def add_analysis(self, frame_numbers):
+        analysis = Analysis(uploaded_image='uploads/slide.tiff', image_width=3000, image_height=1000,
+                            status=Analysis.DONE)
+        analysis.scan_plan = ScanPlan()
+        analysis.save()
+        DetectedFigure.objects.bulk_create([
+            DetectedFigure(analysis=analysis, image_file=f'figures/{frame}.jpg', category=DetectedFigure.MITOTIC,
+                           confidence=0.9, frame_number=frame)
+            for frame in frame_numbers
+        ])
+        return analysis
+
+    def test_figures_outside_the_layout_skip_only_their_analysis(self):
+        frame_count = ScanPlan().layout(3000, 1000).frame_count
+        broken = self.add_analysis([5, frame_count + 10])
+        good = self.add_analysis([5, 40])
+        out = StringIO()
+        call_command('index_figures', stdout=out)
+
+        self.assertIn(f"[skipped] {broken}", out.getvalue())
+        self.assertFalse(broken.figures.filter(slide_x__isnull=False).exists())
+        self.assertEqual(good.figures.filter(slide_x__isnull=False).count(), 2)
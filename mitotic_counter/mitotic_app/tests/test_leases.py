@@ -0,0 +1,83 @@
+# tests/test_leases.py
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from mitotic_app.models import Analysis, DetectedFigure
+from mitotic_app.utils import pipeline
+from mitotic_app.utils.leases import acquire_lease, claimable, renew_lease
+from mitotic_app.utils.scan_plan import ScanPlan
+from .fakes import SceneDetector, random_cells, scan_environment
+
+
+class TakeoverDetector(SceneDetector):
+    """Hands the lease to another worker when first given frame takeover_at"""
+
+    def __init__(self, layout, cells, analysis_id, takeover_at):
+        super().__init__(layout, cells)
+        self.analysis_id = analysis_id
+        self.takeover_at = takeover_at
+
+    def detect(self, frame):
+        if frame.number == self.takeover_at:
+            # As if the lease expired and another worker claimed the analysis
+            Analysis.objects.filter(id=self.analysis_id).update(lease_owner='other')
+        return super().detect(frame)
+
+
+@override_settings(RENDER_PROCESSED_VIDEO=False, MEDIA_COMPACT_ON_COMPLETE=False)
+class AnalysisLeaseTests(TestCase):
+    """Only the current lease holder's writes reach the analysis"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.analysis = Analysis(uploaded_image='uploads/slide.tiff', image_width=3000, image_height=1000)
+        self.analysis.scan_plan = ScanPlan()
+        self.analysis.save()
+
+    def test_stale_save_keeps_the_renewed_lease(self):
+        self.assertTrue(acquire_lease(self.analysis.id, 'worker'))
+        stale = Analysis.objects.get(id=self.analysis.id)
+        Analysis.objects.filter(id=self.analysis.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        stale.refresh_from_db()  # Loaded with an expiry that has already passed
+        self.assertTrue(renew_lease(self.analysis.id, 'worker'))
+
+        stale.total_hpfs = 42
+        stale.save()
+        fresh = Analysis.objects.get(id=self.analysis.id)
+        self.assertEqual(fresh.total_hpfs, 42)
+        self.assertGreater(fresh.lease_expires_at, timezone.now())
+        self.assertFalse(Analysis.objects.filter(claimable(), id=self.analysis.id).exists())
+
+    def test_run_that_lost_its_lease_writes_no_figures(self):
+        layout = self.analysis.scan_layout
+        video_path = pipeline.scan_video_path(self.analysis)
+        os.makedirs(os.path.dirname(video_path))
+        open(video_path, 'wb').close()
+        self.analysis.video_file.name = os.path.relpath(video_path, settings.MEDIA_ROOT)
+        self.analysis.save()
+        DetectedFigure.objects.bulk_create([
+            DetectedFigure(analysis=self.analysis, image_file='figures/other.jpg', category=DetectedFigure.MITOTIC,
+                           confidence=0.9, frame_number=5),
+        ])
+
+        detector = TakeoverDetector(layout, random_cells(layout, 60), self.analysis.id, takeover_at=300)
+        with scan_environment(layout), mock.patch.object(pipeline, 'loaded_detector', lambda path: detector), \
+                mock.patch.object(pipeline, 'shadow_models', dict):
+            started, results = pipeline.run_analysis_exclusive(self.analysis, owner='worker')
+        self.assertTrue(started)
+        self.assertIsNone(results)
+        self.assertGreater(detector.calls, 300)
+        analysis = Analysis.objects.get(id=self.analysis.id)
+        # The new owner's run is left alone
+        self.assertEqual((analysis.status, analysis.lease_owner), (Analysis.RUNNING, 'other'))
+        self.assertEqual(list(analysis.figures.values_list('image_file', flat=True)), ['figures/other.jpg'])
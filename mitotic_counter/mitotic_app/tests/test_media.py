@@ -0,0 +1,167 @@
+# tests/test_media.py
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from mitotic_app.models import Analysis
+from mitotic_app.utils import pipeline
+from mitotic_app.utils.media_serving import parse_range
+from mitotic_app.utils.media_storage import analysis_dir, compact_analysis, evict_analysis
+
+
+class MediaLifecycleTests(TestCase):
+    """Compaction forgets the scan video, and evicted media is rebuilt by a queued run"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        finished = timezone.now() - timedelta(days=1)
+        self.analysis = Analysis.objects.create(
+            uploaded_image='uploads/slide.tiff', processed_video='analysis_1/processed_video_browser.mp4',
+            status=Analysis.DONE, started_at=finished - timedelta(minutes=5), finished_at=finished,
+        )
+        self.scan_video = os.path.join(analysis_dir(self.analysis), 'tiff_scan.mp4')
+        os.makedirs(os.path.dirname(self.scan_video))
+        with open(self.scan_video, 'wb') as f:
+            f.write(b'scan')
+        self.analysis.video_file.name = os.path.relpath(self.scan_video, media_root)
+        self.analysis.save()
+
+    def test_compaction_clears_the_scan_video_reference(self):
+        self.assertEqual(compact_analysis(self.analysis), 4)
+        self.assertFalse(os.path.exists(self.scan_video))
+        self.analysis.refresh_from_db()
+        self.assertFalse(self.analysis.video_file)
+
+    def test_eviction_clears_the_scan_video_reference(self):
+        evict_analysis(self.analysis, dry_run=True)
+        self.analysis.refresh_from_db()
+        self.assertTrue(self.analysis.video_file)
+        evict_analysis(self.analysis)
+        self.analysis.refresh_from_db()
+        self.assertFalse(self.analysis.video_file)
+        self.assertTrue(self.analysis.media_evicted)
+
+    @override_settings(RUN_ANALYSES_IN_WORKERS=True)
+    def test_regeneration_is_queued_and_run_under_the_lease(self):
+        evict_analysis(self.analysis)
+        url = reverse('regenerate_media', args=[self.analysis.id])
+        with mock.patch.object(pipeline, 'regenerate_artifacts') as regenerate:
+            response = self.client.post(url)
+            self.assertRedirects(response, reverse('processing', args=[self.analysis.id]), fetch_redirect_response=False)
+            regenerate.assert_not_called()  # Not inside the request
+            self.analysis.refresh_from_db()
+            self.assertEqual(self.analysis.status, Analysis.QUEUED)
+
+            run_times = self.analysis.started_at, self.analysis.finished_at
+            started, regenerated = pipeline.run_analysis_exclusive(self.analysis)
+        self.assertTrue(started)
+        self.assertTrue(regenerated)
+        regenerate.assert_called_once()
+        self.analysis.refresh_from_db()
+        self.assertEqual(self.analysis.status, Analysis.DONE)
+        self.assertEqual((self.analysis.started_at, self.analysis.finished_at), run_times)
+
+    def test_failed_regeneration_leaves_the_analysis_done(self):
+        evict_analysis(self.analysis)
+        Analysis.objects.filter(id=self.analysis.id).update(status=Analysis.QUEUED)
+        with mock.patch.object(pipeline, 'regenerate_artifacts', side_effect=OSError("slide missing")):
+            started, regenerated = pipeline.run_analysis_exclusive(self.analysis)
+        self.assertEqual((started, regenerated), (True, False))
+        self.analysis.refresh_from_db()
+        self.assertEqual(self.analysis.status, Analysis.DONE)
+        self.assertTrue(self.analysis.media_evicted)
+        self.assertTrue(self.analysis.error_message)
+
+
+class ParseRangeTests(SimpleTestCase):
+
+    def test_ranges(self):
+        for header, expected in [
+            ('bytes=0-99', (0, 99)), ('bytes=100-', (100, 999)), ('bytes=-100', (900, 999)),
+            ('bytes=900-5000', (900, 999)), ('bytes=-5000', (0, 999)), (' bytes=5-5 ', (5, 5)),
+        ]:
+            with self.subTest(header=header):
+                self.assertEqual(parse_range(header, 1000), expected)
+
+    def test_ignored(self):
+        for header in (None, '', 'bytes=-', 'bytes=0-1,5-6', 'items=0-5', 'bytes=a-b'):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range(header, 1000))
+
+    def test_unsatisfiable(self):
+        for header in ('bytes=1000-', 'bytes=1000-2000', 'bytes=50-10', 'bytes=-0'):
+            with self.subTest(header=header), self.assertRaises(ValueError):
+                parse_range(header, 1000)
+
+
+class ServeMediaTests(SimpleTestCase):
+    """Ranges, conditional requests and which files are served at all"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root, MEDIA_ACCEL=None)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.data = bytes(range(256)) * 4
+        for name in ('analysis_1/processed_video_browser.mp4', 'analysis_1/output_mitotic/crossing0001.jpg',
+                     'analysis_1/checkpoint.json', 'analysis_1/tiff_scan.mp4', 'uploads/slide.tiff'):
+            os.makedirs(os.path.join(self.media_root, os.path.dirname(name)), exist_ok=True)
+            with open(os.path.join(self.media_root, name), 'wb') as f:
+                f.write(self.data)
+        self.url = reverse('media', args=['analysis_1/processed_video_browser.mp4'])
+
+    def test_full_and_partial_content(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 100-199/1024')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(b''.join(response.streaming_content), self.data[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-24')
+        self.assertEqual(b''.join(response.streaming_content), self.data[-24:])
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_conditional_requests(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # A stale If-Range gets the whole file instead of the range
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag).status_code, 206)
+
+    def test_only_linked_media_is_served(self):
+        self.assertEqual(
+            self.client.get(reverse('media', args=['analysis_1/output_mitotic/crossing0001.jpg'])).status_code, 200)
+        for name in ('uploads/slide.tiff', 'analysis_1/checkpoint.json', 'analysis_1/tiff_scan.mp4',
+                     'analysis_1/../uploads/slide.tiff', 'missing.jpg'):
+            with self.subTest(name=name):
+                self.assertEqual(self.client.get(reverse('media', args=[name])).status_code, 404)
+        # A link from a served path to an upload is judged by where it points
+        link = os.path.join(self.media_root, 'analysis_1', 'thumbnail.jpg')
+        os.symlink(os.path.join(self.media_root, 'uploads', 'slide.tiff'), link)
+        self.assertEqual(self.client.get(reverse('media', args=['analysis_1/thumbnail.jpg'])).status_code, 404)
+
+    @override_settings(MEDIA_ACCEL='x-accel-redirect')
+    def test_proxy_hand_off_is_restricted_too(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/analysis_1/processed_video_browser.mp4')
+        self.assertEqual(self.client.get(reverse('media', args=['uploads/slide.tiff'])).status_code, 404)
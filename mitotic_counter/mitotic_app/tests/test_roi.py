@@ -0,0 +1,146 @@
+# tests/test_roi.py
+from django.test import SimpleTestCase
+from mitotic_app.utils.hpf_calculator import compute_mitotic_density_from_image, estimate_hpf_count, roi_columns
+from mitotic_app.utils.roi import ROIError, band_intervals, parse_roi
+from mitotic_app.utils.scan_plan import ScanLayout, ScanPlan
+
+
+def counted_cells(layout):
+    """(y, column) of every cell whose crossings the layout's frames count"""
+    return {(y, column) for y, first, columns in layout.runs for column in range(first + 1, first + columns)}
+
+
+class ParseROITests(SimpleTestCase):
+
+    def test_shapes(self):
+        square = [[0.0, 0.0], [10.0, 0.0], [10.0, 10.0], [0.0, 10.0]]
+        triangle = [[0, 0], [10, 0], [0, 10]]
+        self.assertEqual(parse_roi('{"x": 0, "y": 0, "width": 10, "height": 10}'), [square])
+        self.assertEqual(parse_roi(triangle), [[[0.0, 0.0], [10.0, 0.0], [0.0, 10.0]]])
+        self.assertEqual(parse_roi({'shapes': [{'x': 0, 'y': 0, 'width': 10, 'height': 10}, triangle]})[0], square)
+        self.assertEqual(len(parse_roi([triangle, triangle])), 2)
+
+    def test_empty_means_whole_slide(self):
+        for data in ('', '  ', None, [], {'shapes': []}):
+            with self.subTest(data=data):
+                self.assertIsNone(parse_roi(data))
+
+    def test_invalid(self):
+        for data in (
+            '{not json', 42, [[0, 0], [1, 1]], [[0, 0], [1, 1], [2, 2]], {'x': 0, 'y': 0, 'width': 0, 'height': 5},
+            {'x': 'a', 'y': 0, 'width': 1, 'height': 1}, [[0, 0], [True, 1], [2, 0]],
+        ):
+            with self.subTest(data=data), self.assertRaises(ROIError):
+                parse_roi(data)
+
+    def test_must_overlap_the_slide(self):
+        outside = {'x': 2000, 'y': 0, 'width': 50, 'height': 50}
+        with self.assertRaises(ROIError):
+            parse_roi(outside, 1000, 1000)
+        self.assertTrue(parse_roi(dict(outside, x=990), 1000, 1000))
+
+
+class BandIntervalTests(SimpleTestCase):
+
+    def test_rectangle(self):
+        rectangle = [[10, 10], [50, 10], [50, 30], [10, 30]]
+        self.assertEqual(band_intervals(rectangle, 0, 20), [(10, 50)])
+        self.assertEqual(band_intervals(rectangle, 15, 25), [(10, 50)])
+        self.assertEqual(band_intervals(rectangle, 31, 40), [])
+
+    def test_triangle_narrows_with_the_band(self):
+        triangle = [[0, 0], [100, 0], [0, 100]]
+        self.assertEqual(band_intervals(triangle, 50, 60), [(0, 50)])
+        self.assertEqual(band_intervals(triangle, 90, 200), [(0, 10)])
+
+    def test_concave_polygon_splits(self):
+        # A U: two arms above y=60 joined by a base below it
+        u_shape = [[0, 0], [0, 100], [100, 100], [100, 0], [70, 0], [70, 60], [30, 60], [30, 0]]
+        self.assertEqual(band_intervals(u_shape, 10, 50), [(0, 30), (70, 100)])
+        self.assertEqual(band_intervals(u_shape, 50, 80), [(0, 100)])
+
+    def test_band_inside_a_polygon_spans_its_width(self):
+        # No vertex or edge end lies in the band; only the band lines cross the diamond
+        diamond = [[50, 0], [100, 50], [50, 100], [0, 50]]
+        self.assertEqual(band_intervals(diamond, 40, 60), [(0, 100)])
+
+
+class ScanLayoutTests(SimpleTestCase):
+
+    def setUp(self):
+        self.plan = ScanPlan()
+        self.width, self.height = 3000, 2000
+        self.full = self.plan.layout(self.width, self.height)
+
+    def expected_cells(self, left, top, right, bottom):
+        """Counted cells whose strip of slide overlaps the rectangle, found cell by cell"""
+        plan, line = self.plan, self.plan.window_width / 2
+        return {
+            (y, column)
+            for y in plan.y_positions(self.height) if top <= y + plan.step_y - 0.5 and bottom >= y + 0.5
+            for column in range(1, self.full.columns)
+            if column * plan.step_x + line >= left and column * plan.step_x + line - plan.step_x <= right
+        }
+
+    def test_roi_keeps_exactly_the_overlapping_cells(self):
+        for left, top, right, bottom in [
+            (500, 300, 900, 800), (0, 0, 40, 40), (2950, 1900, 3000, 2000), (1234.5, 250, 1235.5, 251), (0, 0, 3000, 2000),
+        ]:
+            roi = parse_roi({'x': left, 'y': top, 'width': right - left, 'height': bottom - top})
+            layout = ScanLayout.for_roi(self.plan, self.width, self.height, roi)
+            with self.subTest(box=(left, top, right, bottom)):
+                self.assertEqual(counted_cells(layout), self.expected_cells(left, top, right, bottom))
+                # Every run starts with one lead-in frame before its first counted cell
+                self.assertTrue(all(columns >= 2 for _, _, columns in layout.runs))
+
+    def test_whole_slide_roi_matches_the_full_layout(self):
+        roi = parse_roi({'x': 0, 'y': 0, 'width': self.width, 'height': self.height})
+        layout = ScanLayout.for_roi(self.plan, self.width, self.height, roi)
+        self.assertEqual(layout.runs, self.full.runs)
+        self.assertEqual(layout.counted_area(), self.full.counted_area())
+        self.assertEqual(ScanLayout.for_roi(self.plan, self.width, self.height, None).runs, self.full.runs)
+
+    def test_counted_cells_before(self):
+        roi = parse_roi([[[300, 200], [1500, 200], [300, 1500]], {'x': 2000, 'y': 1200, 'width': 400, 'height': 300}])
+        for layout in (self.full, self.plan.layout(self.width, self.height, roi)):
+            # The first frame of a run counts nothing
+            counting = [frame not in layout.row_starts for frame in range(layout.frame_count)]
+            for frame in range(layout.frame_count + 2):
+                self.assertEqual(layout.counted_cells_before(frame), sum(counting[:frame]), frame)
+            self.assertEqual(layout.counted_cells_before(layout.frame_count), layout.total_cells)
+        self.assertEqual(self.full.counted_cells_before(0), 0)
+
+
+class HPFCountTests(SimpleTestCase):
+    """HPF area is counted in scan-stride grid cells, over the whole slide or the cells an ROI touches"""
+
+    metadata = {'ImageWidth': 20000, 'ImageLength': 15000, 'XResolution': 40000.0, 'YResolution': 40000.0,
+                'ResolutionUnit': 3}  # 0.25 um per pixel
+
+    def density(self, layout=None):
+        return compute_mitotic_density_from_image('slide.tiff', 0, scan_plan=ScanPlan(), metadata=self.metadata,
+                                                  layout=layout)
+
+    def test_whole_slide_count_matches_the_original_formula(self):
+        result = self.density()
+        hpf_w, hpf_h = result['hpf_size']
+        # (W // step_x) * (H // step_y) cells of step_x * step_y pixels
+        self.assertEqual(result['total_hpfs'], (20000 // 20) * (15000 // 250) * (20 * 250) // (hpf_w * hpf_h))
+        self.assertEqual(result['total_hpfs'], 79)
+        self.assertEqual(self.density(ScanPlan().layout(20000, 15000))['total_hpfs'], 79)
+
+    def test_whole_slide_roi_gives_the_same_count(self):
+        roi = parse_roi({'x': 0, 'y': 0, 'width': 20000, 'height': 15000})
+        self.assertEqual(self.density(ScanPlan().layout(20000, 15000, roi))['total_hpfs'], 79)
+
+    def test_roi_counts_the_grid_cells_it_touches(self):
+        # On the 20 x 250 grid, x 100-200 is columns 5-9 and y 500-1000 is rows 2-3
+        roi = parse_roi({'x': 100, 'y': 500, 'width': 100, 'height': 500})
+        self.assertEqual([roi_columns(roi, row * 250, 20, 250, 1000) for row in (1, 2, 3, 4)],
+                         [set(), set(range(5, 10)), set(range(5, 10)), set()])
+        # Shifted 10 px, the region reaches into one more column and row
+        shifted = parse_roi({'x': 110, 'y': 510, 'width': 100, 'height': 500})
+        self.assertEqual(sum(len(roi_columns(shifted, row * 250, 20, 250, 1000)) for row in range(60)), 6 * 3)
+        self.assertEqual(estimate_hpf_count(20000, 15000, 20, 250, 100, 100, shifted), 6 * 3 * 20 * 250 // 10000)
+        half = parse_roi({'x': 0, 'y': 0, 'width': 10000, 'height': 15000})
+        self.assertEqual(self.density(ScanPlan().layout(20000, 15000, half))['total_hpfs'], 39)
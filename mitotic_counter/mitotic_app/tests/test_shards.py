@@ -0,0 +1,145 @@
+# tests/test_shards.py
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from mitotic_app.models import Analysis, AnalysisShard
+from mitotic_app.utils import pipeline
+from mitotic_app.utils.mitotic_counter import load_checkpoint, process_video
+from mitotic_app.utils.scan_plan import ScanPlan
+from mitotic_app.utils.shards import (
+    claim_shard, complete_shard, merge_shard_results, plan_shards, steal_shard, trim_results,
+)
+from .fakes import Interrupted, SceneDetector, random_cells, scan_environment
+
+
+def crossings(figures_data):
+    """What a figure is, without the per-run crop file name"""
+    return [(f['frame_number'], f['category'], f['confidence'], f['box']) for f in figures_data]
+
+
+class StealingDetector(SceneDetector):
+    """Calls on_frame once, when first given frame steal_at, then keeps detecting"""
+
+    def __init__(self, layout, cells, steal_at, on_frame):
+        super().__init__(layout, cells)
+        self.steal_at = steal_at
+        self.on_frame = on_frame
+
+    def detect(self, frame):
+        if frame.number == self.steal_at and self.on_frame:
+            on_frame, self.on_frame = self.on_frame, None
+            on_frame()
+        return super().detect(frame)
+
+
+@override_settings(CHECKPOINT_EVERY_FRAMES=50, SHARD_STEAL_MIN_FRAMES=100, SHARD_POLL_SECONDS=0)
+class ShardedScanTests(TestCase):
+    """Shards that are stolen from or abandoned must merge into the unsharded result"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.analysis = Analysis(
+            uploaded_image='uploads/slide.tiff', image_width=3000, image_height=2000, status=Analysis.RUNNING,
+        )
+        self.analysis.scan_plan = ScanPlan()
+        self.analysis.save()
+        self.layout = self.analysis.scan_layout
+        self.cells = random_cells(self.layout, 150)
+        self.detector = SceneDetector(self.layout, self.cells)
+
+        environment = scan_environment(self.layout)
+        environment.__enter__()
+        self.addCleanup(environment.__exit__, None, None, None)
+        for name, value in (('loaded_detector', lambda path: self.detector), ('shadow_models', dict)):
+            patcher = mock.patch.object(pipeline, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def unsharded(self):
+        plan = self.analysis.scan_plan
+        return process_video(
+            'tiff_scan.mp4', None, self.analysis.id, detector=SceneDetector(self.layout, self.cells),
+            scan_shift=plan.step_x, row_starts=self.layout.row_starts, write_video=False, resume=False,
+        )
+
+    def assert_matches_unsharded(self, merged):
+        expected = self.unsharded()
+        self.assertGreater(expected['total_count'], 0)
+        self.assertEqual(crossings(merged['figures_data']), crossings(expected['figures_data']))
+        for key in ('mitotic_count', 'non_mitotic_count', 'frame_count'):
+            self.assertEqual(merged[key], expected[key], key)
+
+    def test_plan_covers_the_scan_in_whole_rows(self):
+        shards = plan_shards(self.analysis, target_frames=400)
+        self.assertEqual([(s.start_frame, s.end_frame) for s in shards], [(0, 414), (414, 828), (828, 966)])
+        self.assertEqual(self.layout.frame_count, 966)
+        self.assertTrue(all(s.start_frame in self.layout.row_starts for s in shards))
+        # Planning again (as a racing coordinator would) keeps the first set
+        self.assertEqual(plan_shards(self.analysis, target_frames=200), shards)
+        # A scan that fits in one shard is not split
+        small = Analysis(uploaded_image='uploads/small.tiff', image_width=3000, image_height=500)
+        small.scan_plan = ScanPlan()
+        small.save()
+        self.assertEqual(plan_shards(small, target_frames=400), [])
+
+    def test_steal_mid_shard_matches_unsharded_run(self):
+        plan_shards(self.analysis, target_frames=400)
+        first = claim_shard('owner', self.analysis.id)
+        stolen = []
+        # Past the owner's checkpoint at frame 50, so its next row starts at 138
+        self.detector = StealingDetector(
+            self.layout, self.cells, steal_at=60, on_frame=lambda: stolen.append(steal_shard('thief', self.analysis.id)),
+        )
+        # The owner's heartbeat never fires, so it scans to its old end; complete_shard trims the stolen rows
+        self.assertTrue(pipeline.run_shard(first, 'owner'))
+        self.assertEqual((stolen[0].start_frame, stolen[0].end_frame), (276, 414))
+        first.refresh_from_db()
+        self.assertEqual(first.end_frame, 276)
+        self.assertTrue(all(f['frame_number'] < 276 for f in first.results['figures_data']))
+
+        self.assertIsNone(merge_shard_results(self.analysis))
+        self.detector = SceneDetector(self.layout, self.cells)
+        self.assertTrue(pipeline.run_shard(stolen[0], 'thief'))
+        while (shard := claim_shard('other', self.analysis.id)) is not None:
+            self.assertTrue(pipeline.run_shard(shard, 'other'))
+        self.assert_matches_unsharded(merge_shard_results(self.analysis))
+
+    def test_expired_lease_matches_unsharded_run(self):
+        plan_shards(self.analysis, target_frames=400)
+        dead = claim_shard('dead', self.analysis.id)
+        plan = self.analysis.scan_plan
+        with self.assertRaises(Interrupted):
+            process_video(
+                'tiff_scan.mp4', None, self.analysis.id, detector=SceneDetector(self.layout, self.cells, fail_at=180),
+                scan_shift=plan.step_x, row_starts=self.layout.row_starts, write_video=False,
+                start_frame=dead.start_frame, end_frame=dead.end_frame, shard=dead.id,
+            )
+        self.assertEqual(load_checkpoint(self.analysis.id, dead.id)['frame_count'], 150)
+        AnalysisShard.objects.filter(id=dead.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        merged = pipeline.run_shards(self.analysis)
+        self.assert_matches_unsharded(merged)
+        dead.refresh_from_db()
+        self.assertEqual(dead.attempts, 2)
+        # The resumed shard skipped the frames before the dead worker's checkpoint
+        self.assertEqual(self.detector.calls, self.layout.frame_count - 150)
+        # The dead worker coming back cannot overwrite the results
+        self.assertFalse(complete_shard(dead, 'dead', {'figures_data': [], 'inference_frames': 0}))
+
+    def test_trim_keeps_crossings_before_the_end(self):
+        figures = [{'frame_number': n} for n in (10, 275, 276, 300)]
+        results = {
+            'figures_data': figures, 'inference_frames': 300,
+            'shadows': {'candidate': {'figures': figures, 'inference_frames': 290}},
+        }
+        trimmed = trim_results(results, 276)
+        self.assertEqual(trimmed['figures_data'], figures[:2])
+        self.assertEqual(trimmed['shadows']['candidate'], {'figures': figures[:2], 'inference_frames': 290})
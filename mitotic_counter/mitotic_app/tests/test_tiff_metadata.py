@@ -0,0 +1,68 @@
+# tests/test_tiff_metadata.py
+import io
+import os
+import shutil
+import struct
+import tempfile
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from mitotic_app.utils.tiff_metadata import TiffHeaderError, read_tiff_header, validate_tiff_header
+
+
+def tiff_header(entries):
+    """A little-endian classic TIFF holding one IFD of (tag, type, count, value) entries"""
+    ifd = struct.pack('<H', len(entries))
+    for tag, field_type, count, value in entries:
+        ifd += struct.pack('<HHII', tag, field_type, count, value)
+    return b'II' + struct.pack('<HI', 42, 8) + ifd + struct.pack('<I', 0)
+
+
+class TiffHeaderTests(SimpleTestCase):
+
+    def test_reads_dimensions(self):
+        metadata = read_tiff_header(io.BytesIO(tiff_header([(256, 4, 1, 1200), (257, 3, 1, 800)])))
+        self.assertEqual((metadata['ImageWidth'], metadata['ImageLength']), (1200, 800))
+        self.assertFalse(metadata['Tiled'])
+
+    def test_tag_payload_is_bounded(self):
+        # A count claiming 4 GB of BitsPerSample values must not be read
+        f = io.BytesIO(tiff_header([(256, 4, 1, 1200), (258, 3, 2 ** 31, 8)]))
+        f.read = mock.Mock(wraps=f.read)
+        with self.assertRaises(TiffHeaderError):
+            read_tiff_header(f)
+        self.assertTrue(all(not call.args or call.args[0] < 2 ** 20 for call in f.read.call_args_list))
+
+    def test_directory_size_is_bounded(self):
+        header = b'II' + struct.pack('<HI', 42, 8) + struct.pack('<H', 60000)
+        with self.assertRaises(TiffHeaderError):
+            read_tiff_header(io.BytesIO(header))
+
+    @override_settings(TIFF_MAX_PIXELS=1000 * 1000)
+    def test_pixel_limit_comes_from_settings(self):
+        validate_tiff_header({'ImageWidth': 1000, 'ImageLength': 1000})
+        with self.assertRaises(TiffHeaderError):
+            validate_tiff_header({'ImageWidth': 1001, 'ImageLength': 1000})
+
+
+class ScannerLimitTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+    @override_settings(TIFF_MAX_PIXELS=100 * 100)
+    def test_scanner_refuses_slides_over_the_limit(self):
+        from PIL import Image
+        from mitotic_app.utils.tiff_scanner import TIFFScanner
+
+        self.addCleanup(setattr, Image, 'MAX_IMAGE_PIXELS', Image.MAX_IMAGE_PIXELS)
+        path = os.path.join(self.tmp, 'slide.tiff')
+        Image.new('RGB', (200, 100)).save(path)
+        with mock.patch.object(Image, 'open') as pillow_open, self.assertRaises(TiffHeaderError):
+            TIFFScanner(path)
+        pillow_open.assert_not_called()
+
+        small = os.path.join(self.tmp, 'small.tiff')
+        Image.new('RGB', (100, 100)).save(small)
+        self.assertEqual(TIFFScanner(small).dimensions, (100, 100))
+        self.assertEqual(Image.MAX_IMAGE_PIXELS, 100 * 100)
@@ -0,0 +1,133 @@
+# tests/test_tiles.py
+import os
+import shutil
+import tempfile
+import types
+from unittest import mock, skipUnless
+from django.test import SimpleTestCase, override_settings
+from mitotic_app.utils import tile_server
+
+try:
+    import numpy as np
+    import tifffile
+    from PIL import Image
+except ImportError:
+    tifffile = None
+
+
+@skipUnless(tifffile, "needs numpy, tifffile and Pillow")
+class TileRenderingTests(SimpleTestCase):
+    """Tiles read only the TIFF segments they overlap and never a whole level"""
+
+    width, height = 1100, 700
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.tmp)
+        media.enable()
+        self.addCleanup(media.disable)
+        # Red and green ramps: a tile from the wrong place or scale has the wrong colour
+        y, x = np.mgrid[:self.height, :self.width]
+        self.image = np.dstack([x * 255 // self.width, y * 255 // self.height, np.full_like(x, 128)]).astype(np.uint8)
+
+    def write_slide(self, name, **options):
+        path = os.path.join(self.tmp, f'{name}.tif')
+        tifffile.imwrite(path, self.image, **options)
+        return path
+
+    def test_region_matches_whole_level(self):
+        from mitotic_app.utils.slide_reader import SlideReader
+
+        layouts = {
+            'plain': {},
+            'strips': {'rowsperstrip': 64, 'compression': 'zlib'},
+            'tiled': {'tile': (256, 256), 'compression': 'zlib'},
+        }
+        boxes = [(0, 0, 10, 10), (100, 200, 700, 650), (1000, 600, 1100, 700), (255, 255, 257, 513)]
+        for name, options in layouts.items():
+            reader = SlideReader(self.write_slide(name, **options))
+            level = reader.levels[0]
+            for box in boxes:
+                with self.subTest(name=name, box=box):
+                    region = np.asarray(reader.read_region(level, box))
+                    self.assertTrue((region == self.image[box[1]:box[3], box[0]:box[2]]).all())
+
+    def test_stepped_region_keeps_every_step_th_pixel(self):
+        from mitotic_app.utils.slide_reader import SlideReader
+
+        layouts = {
+            'plain': {},
+            'strips': {'rowsperstrip': 64, 'compression': 'zlib'},
+            'tiled': {'tile': (256, 256), 'compression': 'zlib'},
+        }
+        for name, options in layouts.items():
+            reader = SlideReader(self.write_slide(name, **options))
+            for box, step in [((0, 0, 1100, 700), 8), ((100, 200, 700, 650), 3), ((250, 60, 270, 70), 16)]:
+                with self.subTest(name=name, box=box, step=step):
+                    region = np.asarray(reader.read_region(reader.levels[0], box, step))
+                    self.assertTrue((region == self.image[box[1]:box[3]:step, box[0]:box[2]:step]).all())
+
+    def test_16_bit_samples_are_scaled(self):
+        from mitotic_app.utils.slide_reader import SlideReader
+
+        path = os.path.join(self.tmp, 'deep.tif')
+        # Low bytes all 0x80: wrapping instead of scaling would give a flat image
+        tifffile.imwrite(path, self.image.astype(np.uint16) << 8 | 0x80, tile=(256, 256))
+        reader = SlideReader(path)
+        box = (100, 200, 700, 650)
+        region = np.asarray(reader.read_region(reader.levels[0], box))
+        self.assertTrue((region == self.image[box[1]:box[3], box[0]:box[2]]).all())
+
+    def test_tiles_never_decode_a_whole_level(self):
+        analysis = types.SimpleNamespace(
+            id='tiles', image_width=self.width, image_height=self.height,
+            uploaded_image=types.SimpleNamespace(path=self.write_slide('slide', tile=(128, 128))),
+        )
+        top = tile_server.max_level(self.width, self.height)
+        with mock.patch('mitotic_app.utils.slide_reader.SlideReader.read_level', side_effect=AssertionError):
+            for level in range(top + 1):
+                level_w, level_h = tile_server.level_dimensions(self.width, self.height, level)
+                expected = Image.fromarray(self.image).resize((level_w, level_h), Image.LANCZOS)
+                expected = np.asarray(expected, dtype=int)
+                for row in range(-(-level_h // tile_server.TILE_SIZE)):
+                    for col in range(-(-level_w // tile_server.TILE_SIZE)):
+                        x0, y0, x1, y1 = tile_server.tile_bounds(self.width, self.height, level, col, row)
+                        with Image.open(tile_server.render_tile(analysis, level, col, row)) as tile:
+                            pixels = np.asarray(tile, dtype=int)
+                        self.assertEqual(pixels.shape[:2], (y1 - y0, x1 - x0))
+                        if min(level_w, level_h) >= 20:
+                            # Below that, Deep Zoom's rounded-up level sizes shift the few pixels there are
+                            self.assertLess(np.abs(pixels - expected[y0:y1, x0:x1]).mean(), 3, (level, col, row))
+
+    def test_coarse_tile_without_a_pyramid_reads_the_slide_once(self):
+        self.width, self.height = 2000, 1500
+        y, x = np.mgrid[:self.height, :self.width]
+        self.image = np.dstack([x * 255 // self.width, y * 255 // self.height, np.full_like(x, 128)]).astype(np.uint8)
+        analysis = types.SimpleNamespace(
+            id='coarse', image_width=self.width, image_height=self.height,
+            uploaded_image=types.SimpleNamespace(path=self.write_slide('flat', tile=(128, 128), compression='zlib')),
+        )
+        from mitotic_app.utils.slide_reader import SlideReader
+
+        read_region = SlideReader.read_region
+        boxes = []
+
+        def counted(reader, level, box, step=1):
+            boxes.append(box)
+            return read_region(reader, level, box, step)
+
+        # Level 7 is 125 x 94, sixteen slide pixels per tile pixel
+        with mock.patch.object(SlideReader, 'read_region', counted):
+            path = tile_server.render_tile(analysis, 7, 0, 0)
+        self.assertEqual(boxes, [(0, 0, self.width, self.height)])
+        self.assertEqual(os.listdir(tile_server.tiles_dir(analysis)), ['7'])
+        expected = Image.fromarray(self.image).resize((125, 94), Image.LANCZOS)
+        with Image.open(path) as tile:
+            self.assertLess(np.abs(np.asarray(tile, dtype=int) - np.asarray(expected, dtype=int)).mean(), 3)
+
+        # One level finer, the tile is still pasted from the (directly read) tiles below it
+        boxes.clear()
+        with mock.patch.object(SlideReader, 'read_region', counted):
+            tile_server.render_tile(analysis, 8, 0, 0)
+        self.assertEqual(len(boxes), 4)
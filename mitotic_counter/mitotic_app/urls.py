@@ -4,10 +4,21 @@ from . import views
 
 urlpatterns = [
     path('', views.home, name='home'),
+    path('roi/<int:analysis_id>/', views.select_roi, name='select_roi'),
     path('processing/<int:analysis_id>/', views.processing, name='processing'),
     path('results/<int:analysis_id>/', views.results, name='results'),
+    path('regenerate-media/<int:analysis_id>/', views.regenerate_media, name='regenerate_media'),
+    path('duplicates/<int:analysis_id>/', views.duplicates, name='duplicates'),
     path('move-figure/<int:figure_id>/', views.move_figure_view, name='move_figure'),
     path('download/<int:analysis_id>/', views.download_figures, name='download_all'),
     path('download/<int:analysis_id>/<str:category>/', views.download_figures, name='download_category'),
     path('download-hpf-report/<int:analysis_id>/', views.download_hpf_report, name='download_hpf_report'),
+    path('slide/<int:analysis_id>/', views.slide_viewer, name='slide_viewer'),
+    path('slide/<int:analysis_id>.dzi', views.slide_dzi, name='slide_dzi'),
+    path('slide/<int:analysis_id>_files/<int:level>/<int:col>_<int:row>.jpeg', views.slide_tile, name='slide_tile'),
+    path('export-reports/', views.export_reports, name='export_reports'),
+    path('api/analyses/', views.api_analyses, name='api_analyses'),
+    path('api/analyses/<int:analysis_id>/', views.api_analysis, name='api_analysis'),
+    path('api/analyses/<int:analysis_id>/overlay/', views.api_overlay, name='api_overlay'),
+    path('api/analyses/<int:analysis_id>/figures/', views.api_figures, name='api_figures'),
 ]
\ No newline at end of file
@@ -0,0 +1,69 @@
+# utils/api.py
+import base64
+import hashlib
+from django.db.models import Q
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+
+def encode_cursor(*values):
+    return base64.urlsafe_b64encode(':'.join(str(v) for v in values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, parts):
+    """Inverse of encode_cursor; raises ValueError for anything it did not produce"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        values = [int(v) for v in raw.split(':')]
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if len(values) != parts:
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def parse_limit(value):
+    if not value:
+        return DEFAULT_LIMIT
+    limit = int(value)
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, MAX_LIMIT)
+
+
+def make_api_etag(*parts):
+    """Weak ETag over the resource version and the request's query string"""
+    digest = hashlib.sha1('|'.join(str(p) for p in parts).encode()).hexdigest()[:16]
+    return f'W/"{digest}"'
+
+
+def after_figure_cursor(cursor):
+    """Figures are ordered by (frame_number, id); the cursor is the last row returned"""
+    frame_number, figure_id = decode_cursor(cursor, 2)
+    return Q(frame_number__gt=frame_number) | Q(frame_number=frame_number, id__gt=figure_id)
+
+
+def figure_json(figure):
+    return {
+        'id': figure.id,
+        'category': figure.category,
+        'confidence': figure.confidence,
+        'frame_number': figure.frame_number,
+        'image_url': figure.image_file.url,
+        'slide_x': figure.slide_x,
+        'slide_y': figure.slide_y,
+        'duplicate_of': figure.duplicate_of_id,
+    }
+
+
+def analysis_json(analysis):
+    return {
+        'id': analysis.id,
+        'status': analysis.status,
+        'upload_date': analysis.upload_date.isoformat(),
+        'source_path': analysis.source_path,
+        'mitoses_per_10_hpf': analysis.mitoses_per_10_hpf,
+        'tumor_grade': analysis.tumor_grade,
+        'version': analysis.version,
+    }
@@ -0,0 +1,349 @@
+# utils/detectors.py
+import glob
+import os
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff')
+
+
+class Detector:
+    """Base class for detector backends.
+
+    detect() takes a BGR frame and returns a list of
+    (x1, y1, x2, y2, confidence, class_id) tuples in frame pixel coordinates.
+    """
+
+    def detect(self, frame):
+        raise NotImplementedError
+
+
+class YoloDetector(Detector):
+    """Ultralytics PyTorch backend (the original process_video path).
+
+    imgsz and conf are passed through to the model call when given; by
+    default Ultralytics uses 640 and 0.25.
+    """
+
+    def __init__(self, model_path, imgsz=None, conf=None, **kwargs):
+        from ultralytics import YOLO
+        self.model = YOLO(model_path)
+        self.call_options = {k: v for k, v in [('imgsz', imgsz), ('conf', conf)] if v is not None}
+
+    def detect(self, frame):
+        results = self.model(frame, verbose=False, **self.call_options)
+        detections = []
+        for box in results[0].boxes:
+            x1, y1, x2, y2 = map(int, box.xyxy[0])
+            detections.append((x1, y1, x2, y2, box.conf.item(), int(box.cls.item())))
+        return detections
+
+
+def letterbox(frame, size):
+    """Resize a BGR frame into a size x size canvas keeping aspect ratio.
+
+    Returns the padded image together with the scale and (pad_x, pad_y) needed
+    to map boxes back to the original frame.
+    """
+    h, w = frame.shape[:2]
+    scale = min(size / w, size / h)
+    new_w, new_h = int(round(w * scale)), int(round(h * scale))
+    resized = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = resized
+    return canvas, scale, (pad_x, pad_y)
+
+
+def to_input_tensor(image):
+    """BGR uint8 HWC -> RGB float32 NCHW in [0, 1]"""
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return np.ascontiguousarray(rgb.transpose(2, 0, 1)[np.newaxis], dtype=np.float32) / 255.0
+
+
+class TileCalibrationReader:
+    """Feeds calibration tiles to onnxruntime's static quantizer"""
+
+    def __init__(self, calibration_dir, input_name, imgsz, limit=200):
+        paths = sorted(
+            p for p in glob.glob(os.path.join(calibration_dir, '**', '*'), recursive=True)
+            if p.lower().endswith(IMAGE_EXTENSIONS)
+        )[:limit]
+        if not paths:
+            raise ValueError(f"No calibration tiles found in {calibration_dir}")
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self.paths = iter(paths)
+
+    def get_next(self):
+        for path in self.paths:
+            frame = cv2.imread(path)
+            if frame is None:
+                continue
+            image, _, _ = letterbox(frame, self.imgsz)
+            return {self.input_name: to_input_tensor(image)}
+        return None
+
+
+class OnnxDetector(Detector):
+    """ONNX Runtime CPU backend.
+
+    best.pt is exported to ONNX next to the weights on first use. With
+    quantize=True a static INT8 copy is produced from the tiles in
+    calibration_dir and used instead.
+    """
+
+    def __init__(self, model_path, imgsz=640, intra_op_threads=0, inter_op_threads=1,
+                 quantize=False, calibration_dir=None, min_confidence=0.25, iou_threshold=0.45):
+        import onnxruntime as ort
+
+        self.imgsz = imgsz
+        self.min_confidence = min_confidence
+        self.iou_threshold = iou_threshold
+
+        onnx_path = self.export(model_path, imgsz)
+        if quantize:
+            if not calibration_dir:
+                raise ValueError("INT8 quantization needs a calibration_dir of tiles")
+            onnx_path = self.quantize(onnx_path, calibration_dir, imgsz)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads  # 0 lets onnxruntime pick
+        options.inter_op_num_threads = inter_op_threads
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    @staticmethod
+    def export(model_path, imgsz):
+        """Export the PyTorch weights to ONNX unless an up-to-date export exists.
+
+        Exports for other input sizes than 640 (e.g. a cascade's coarse pass)
+        get their own file next to the default one.
+        """
+        base = os.path.splitext(model_path)[0]
+        onnx_path = base + '.onnx' if imgsz == 640 else f'{base}_{imgsz}.onnx'
+        if os.path.exists(onnx_path) and os.path.getmtime(onnx_path) >= os.path.getmtime(model_path):
+            return onnx_path
+        from ultralytics import YOLO
+        print(f"Exporting {model_path} to ONNX (imgsz={imgsz})")
+        exported = YOLO(model_path).export(format='onnx', imgsz=imgsz, dynamic=False, simplify=True)
+        if os.path.abspath(exported) != os.path.abspath(onnx_path):
+            os.replace(exported, onnx_path)
+        return onnx_path
+
+    @staticmethod
+    def quantize(onnx_path, calibration_dir, imgsz):
+        """Produce a static INT8 copy of an ONNX model, calibrated on tiles"""
+        from onnxruntime.quantization import CalibrationDataReader, QuantType, quantize_static
+        import onnxruntime as ort
+
+        int8_path = os.path.splitext(onnx_path)[0] + '_int8.onnx'
+        if os.path.exists(int8_path) and os.path.getmtime(int8_path) >= os.path.getmtime(onnx_path):
+            return int8_path
+
+        input_name = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+
+        class Reader(TileCalibrationReader, CalibrationDataReader):
+            pass
+
+        print(f"Quantizing {onnx_path} to INT8 using tiles from {calibration_dir}")
+        quantize_static(
+            onnx_path, int8_path, Reader(calibration_dir, input_name, imgsz),
+            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+        )
+        return int8_path
+
+    def detect(self, frame):
+        image, scale, (pad_x, pad_y) = letterbox(frame, self.imgsz)
+        output = self.session.run(None, {self.input_name: to_input_tensor(image)})[0]
+
+        # Ultralytics layout: (1, 4 + num_classes, num_anchors) with cx, cy, w, h first
+        preds = output[0].T
+        scores = preds[:, 4:]
+        class_ids = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+        keep = confidences >= self.min_confidence
+        if not keep.any():
+            return []
+        preds, class_ids, confidences = preds[keep], class_ids[keep], confidences[keep]
+
+        cx, cy, w, h = preds[:, 0], preds[:, 1], preds[:, 2], preds[:, 3]
+        boxes = np.stack([
+            (cx - w / 2 - pad_x) / scale,
+            (cy - h / 2 - pad_y) / scale,
+            (cx + w / 2 - pad_x) / scale,
+            (cy + h / 2 - pad_y) / scale,
+        ], axis=1)
+        frame_h, frame_w = frame.shape[:2]
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, frame_w)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, frame_h)
+
+        # Class-aware NMS by offsetting each class into its own coordinate range
+        offset = class_ids[:, None] * (max(frame_w, frame_h) + 1)
+        shifted = boxes + offset
+        rects = [[float(x1), float(y1), float(x2 - x1), float(y2 - y1)] for x1, y1, x2, y2 in shifted]
+        indices = cv2.dnn.NMSBoxes(rects, confidences.tolist(), self.min_confidence, self.iou_threshold)
+
+        detections = []
+        for i in np.array(indices).flatten():
+            x1, y1, x2, y2 = boxes[i]
+            detections.append((int(x1), int(y1), int(x2), int(y2), float(confidences[i]), int(class_ids[i])))
+        return detections
+
+
+def merge_overlapping(detections, iou_threshold=0.45):
+    """Class-aware NMS over detections collected from overlapping regions"""
+    if len(detections) < 2:
+        return list(detections)
+    size = max(max(d[2], d[3]) for d in detections) + 1
+    rects = [[float(x1 + cls * size), float(y1), float(x2 - x1), float(y2 - y1)]
+             for x1, y1, x2, y2, _, cls in detections]
+    indices = cv2.dnn.NMSBoxes(rects, [float(d[4]) for d in detections], 0.0, iou_threshold)
+    return [detections[i] for i in np.array(indices).flatten()]
+
+
+def candidate_regions(candidates, frame_w, frame_h, region_size):
+    """Cover candidate boxes with region_size squares, clipped to the frame.
+
+    A candidate already inside an earlier region does not open a new one.
+    """
+    regions = []
+    for x1, y1, x2, y2, _, _ in sorted(candidates, key=lambda d: -d[4]):
+        if any(rx1 <= x1 and ry1 <= y1 and x2 <= rx2 and y2 <= ry2 for rx1, ry1, rx2, ry2 in regions):
+            continue
+        cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
+        rx1 = min(max(0, cx - region_size // 2), max(0, frame_w - region_size))
+        ry1 = min(max(0, cy - region_size // 2), max(0, frame_h - region_size))
+        regions.append((rx1, ry1, min(frame_w, rx1 + region_size), min(frame_h, ry1 + region_size)))
+    return regions
+
+
+class CascadeDetector(Detector):
+    """Two-resolution cascade around another backend.
+
+    A coarse pass of the same weights at coarse_imgsz flags candidates at
+    the (deliberately low) threshold; only then does the full-resolution
+    pass run, on region_size crops around the candidates, or on the whole
+    frame when the frame is no larger than one region. Windows without
+    candidates cost a single cheap pass and return no detections.
+    """
+
+    def __init__(self, model_path, backend='yolo', coarse_imgsz=320, threshold=0.1, region_size=640, **options):
+        if backend == 'cascade' or backend not in BACKENDS:
+            raise ValueError(f"Unknown cascade backend: {backend}")
+        self.threshold = threshold
+        self.region_size = region_size
+        coarse_options = dict(options, imgsz=coarse_imgsz)
+        coarse_options['conf' if backend == 'yolo' else 'min_confidence'] = threshold
+        self.coarse = get_detector(model_path, backend=backend, **coarse_options)
+        self.fine = get_detector(model_path, backend=backend, **options)
+        self.frames = 0
+        self.fine_frames = 0  # Frames that needed the full-resolution pass
+
+    def detect(self, frame):
+        self.frames += 1
+        candidates = [d for d in self.coarse.detect(frame) if d[4] >= self.threshold]
+        if not candidates:
+            return []
+        self.fine_frames += 1
+
+        frame_h, frame_w = frame.shape[:2]
+        if max(frame_w, frame_h) <= self.region_size:
+            return self.fine.detect(frame)
+
+        regions = candidate_regions(candidates, frame_w, frame_h, self.region_size)
+        detections = []
+        for rx1, ry1, rx2, ry2 in regions:
+            for x1, y1, x2, y2, confidence, class_id in self.fine.detect(frame[ry1:ry2, rx1:rx2]):
+                detections.append((x1 + rx1, y1 + ry1, x2 + rx1, y2 + ry1, confidence, class_id))
+        return merge_overlapping(detections) if len(regions) > 1 else detections
+
+
+BACKENDS = {
+    'yolo': YoloDetector,
+    'onnx': OnnxDetector,
+    'cascade': CascadeDetector,
+}
+
+
+def get_detector(model_path, backend=None, **options):
+    """Build the configured detector backend.
+
+    Defaults come from settings.DETECTOR_BACKEND and settings.DETECTOR_OPTIONS.
+    """
+    from django.conf import settings
+
+    backend = backend or getattr(settings, 'DETECTOR_BACKEND', 'yolo')
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown detector backend: {backend}")
+    merged = dict(getattr(settings, 'DETECTOR_OPTIONS', {}).get(backend, {}))
+    merged.update(options)
+    return BACKENDS[backend](model_path, **merged)
+
+
+def class_counts(detections, conf_threshold, num_classes=2):
+    """Per-class number of detections at or above the confidence threshold"""
+    class_ids = np.array([d[5] for d in detections if d[4] >= conf_threshold], dtype=int)
+    return np.bincount(class_ids, minlength=num_classes)[:num_classes]
+
+
+def box_iou(a, b):
+    x_left, y_top = max(a[0], b[0]), max(a[1], b[1])
+    x_right, y_bottom = min(a[2], b[2]), min(a[3], b[3])
+    if x_right <= x_left or y_bottom <= y_top:
+        return 0.0
+    intersection = (x_right - x_left) * (y_bottom - y_top)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def matched_detections(reference, candidate, conf_threshold, iou_threshold=0.5):
+    """Reference detections that the candidate also found (same class, IoU >= iou_threshold)"""
+    unmatched = [d for d in candidate if d[4] >= conf_threshold]
+    matched = 0
+    for ref in (d for d in reference if d[4] >= conf_threshold):
+        best = max(
+            (c for c in unmatched if c[5] == ref[5]),
+            key=lambda c: box_iou(ref, c), default=None,
+        )
+        if best is not None and box_iou(ref, best) >= iou_threshold:
+            unmatched.remove(best)
+            matched += 1
+    return matched
+
+
+def compare_backends(video_path, reference, candidate, conf_threshold=0.7, max_frames=None):
+    """Run two detectors over the same frames and report per-frame count agreement
+    and the candidate's recall of the reference detections"""
+    cap = cv2.VideoCapture(video_path)
+    frames = 0
+    matching_frames = 0
+    reference_total = 0
+    candidate_total = 0
+    matched_total = 0
+    while cap.isOpened() and (max_frames is None or frames < max_frames):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        ref_detections = reference.detect(frame)
+        cand_detections = candidate.detect(frame)
+        ref_counts = class_counts(ref_detections, conf_threshold)
+        cand_counts = class_counts(cand_detections, conf_threshold)
+        matched_total += matched_detections(ref_detections, cand_detections, conf_threshold)
+        frames += 1
+        reference_total += int(ref_counts.sum())
+        candidate_total += int(cand_counts.sum())
+        if np.array_equal(ref_counts, cand_counts):
+            matching_frames += 1
+    cap.release()
+
+    return {
+        'frames': frames,
+        'matching_frames': matching_frames,
+        'frame_agreement': matching_frames / frames if frames else 0,
+        'reference_detections': reference_total,
+        'candidate_detections': candidate_total,
+        'recall': matched_total / reference_total if reference_total else 1.0,
+    }
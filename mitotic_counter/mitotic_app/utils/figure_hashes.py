@@ -0,0 +1,179 @@
+# utils/figure_hashes.py
+from collections import defaultdict
+from django.conf import settings
+from mitotic_app.models import DetectedFigure
+
+HASH_BITS = 64
+HASH_MASK = (1 << HASH_BITS) - 1
+
+
+def to_signed(value):
+    """Store unsigned 64-bit hashes in a signed BigIntegerField"""
+    return value - (1 << HASH_BITS) if value >= (1 << (HASH_BITS - 1)) else value
+
+
+def hamming(a, b):
+    return bin((a ^ b) & HASH_MASK).count('1')
+
+
+def phash(image):
+    """64-bit DCT perceptual hash of a BGR or grayscale image"""
+    import cv2
+    import numpy as np
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])  # The DC term would skew the median
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return to_signed(value)
+
+
+def crop_box(frame, box, pad=0.25):
+    """The detection box plus some context, clipped to the frame"""
+    x1, y1, x2, y2 = box
+    pad_x, pad_y = int((x2 - x1) * pad), int((y2 - y1) * pad)
+    height, width = frame.shape[:2]
+    return frame[max(0, y1 - pad_y):min(height, y2 + pad_y), max(0, x1 - pad_x):min(width, x2 + pad_x)]
+
+
+def hash_figure_file(path):
+    """Hash a stored figure frame when the box was not recorded (older analyses).
+
+    The figure was saved as it crossed the counting line, so the middle of
+    the frame is the part that shows it.
+    """
+    import cv2
+
+    frame = cv2.imread(path)
+    if frame is None:
+        return None
+    height, width = frame.shape[:2]
+    return phash(frame[height // 4:height - height // 4, width // 4:width - width // 4])
+
+
+def slide_position(frame_number, layout, box=None):
+    """Level-0 slide coordinates of a figure from its frame number and box (layout is a ScanLayout)"""
+    plan = layout.plan
+    x, y = layout.window(frame_number)
+    if box is None:
+        return x + plan.window_width // 2, y + plan.window_height // 2
+    return x + (box[0] + box[2]) // 2, y + (box[1] + box[3]) // 2
+
+
+class FigureHashIndex:
+    """Nearest-neighbour lookup of figure hashes within one analysis.
+
+    Multi-index hashing: each hash is split into max_distance + 1 bands,
+    and two hashes within max_distance bits must agree exactly on at least
+    one band. Only figures sharing a band are compared bit by bit, and
+    candidates are then limited to radius pixels on the slide when both
+    positions are known.
+    """
+
+    def __init__(self, entries, max_distance, radius=None):
+        self.entries = list(entries)  # (figure id, hash, slide_x, slide_y)
+        self.max_distance = max_distance
+        self.radius = radius
+        self.bands = max_distance + 1
+        self.band_bits = HASH_BITS // self.bands
+        self.buckets = defaultdict(list)
+        for index, (_, value, _, _) in enumerate(self.entries):
+            for key in self.band_keys(value):
+                self.buckets[key].append(index)
+
+    def band_keys(self, value):
+        value &= HASH_MASK
+        band_mask = (1 << self.band_bits) - 1
+        return [(band, (value >> (band * self.band_bits)) & band_mask) for band in range(self.bands)]
+
+    def near(self, entry, other):
+        if hamming(entry[1], other[1]) > self.max_distance:
+            return False
+        if self.radius is None or None in (entry[2], entry[3], other[2], other[3]):
+            return True
+        return (entry[2] - other[2]) ** 2 + (entry[3] - other[3]) ** 2 <= self.radius ** 2
+
+    def neighbours(self, index):
+        entry = self.entries[index]
+        candidates = set()
+        for key in self.band_keys(entry[1]):
+            candidates.update(self.buckets[key])
+        candidates.discard(index)
+        return [other for other in sorted(candidates) if self.near(entry, self.entries[other])]
+
+    def groups(self):
+        """Connected groups of near-duplicates, as lists of entry indexes"""
+        parent = list(range(len(self.entries)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for index in range(len(self.entries)):
+            for other in self.neighbours(index):
+                parent[find(other)] = find(index)
+
+        groups = defaultdict(list)
+        for index in range(len(self.entries)):
+            groups[find(index)].append(index)
+        return [members for members in groups.values() if len(members) > 1]
+
+
+def group_duplicates(analysis, max_distance=None, radius=None):
+    """Mark near-duplicate figures of an analysis.
+
+    In each group the most confident figure is kept and the rest point at it
+    through duplicate_of; nothing is merged until a reviewer confirms it.
+    Returns the number of groups found.
+    """
+    if max_distance is None:
+        max_distance = getattr(settings, 'DUPLICATE_HASH_DISTANCE', 6)
+    if radius is None:
+        radius = getattr(settings, 'DUPLICATE_RADIUS_PX', 64)
+
+    # Figures already discarded (including merged duplicates) keep their links
+    candidates = analysis.figures.exclude(category=DetectedFigure.DISCARDED)
+    figures = list(
+        candidates.exclude(phash__isnull=True).values_list('id', 'phash', 'slide_x', 'slide_y', 'confidence')
+    )
+    index = FigureHashIndex([figure[:4] for figure in figures], max_distance, radius)
+
+    candidates.filter(duplicate_of__isnull=False).update(duplicate_of=None)
+    groups = index.groups()
+    for members in groups:
+        keeper = max(members, key=lambda i: (figures[i][4], -figures[i][0]))
+        duplicates = [figures[i][0] for i in members if i != keeper]
+        analysis.figures.filter(id__in=duplicates).update(duplicate_of=figures[keeper][0])
+    analysis.bump_version()
+    return len(groups)
+
+
+def merge_duplicates(analysis, keeper_ids=None):
+    """Discard the duplicates of the given keepers (all groups if None), then
+    recompute HPF metrics once. Returns the number of figures discarded."""
+    from .mitotic_counter import move_figure_file
+
+    duplicates = analysis.figures.filter(duplicate_of__isnull=False).exclude(category=DetectedFigure.DISCARDED)
+    if keeper_ids is not None:
+        duplicates = duplicates.filter(duplicate_of__in=keeper_ids)
+
+    merged = []
+    for figure in duplicates:
+        new_name = move_figure_file(figure, DetectedFigure.DISCARDED)
+        if new_name is None:
+            continue
+        figure.image_file.name = new_name
+        figure.category = DetectedFigure.DISCARDED
+        merged.append(figure)
+
+    # bulk_update skips DetectedFigure.save(), which would redo the HPF math per figure
+    DetectedFigure.objects.bulk_update(merged, ['image_file', 'category'])
+    analysis.bump_version()
+    if merged and analysis.total_hpfs:
+        analysis.update_hpf_analysis()
+    return len(merged)
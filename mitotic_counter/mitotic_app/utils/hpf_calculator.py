@@ -1,30 +1,27 @@
 # utils/hpf_calculator.py
-from PIL import Image
-from PIL.TiffImagePlugin import IFDRational
-import os
-import tempfile
-from django.conf import settings
+import math
+from .tiff_metadata import read_tiff_header
 
-def extract_strict_tiff_metadata(image_path):
-    """Extract metadata from TIFF image"""
-    with Image.open(image_path) as img:
-        tags = img.tag_v2
-        metadata = {
-            "ImageWidth": img.width,
-            "ImageLength": img.height,
-            "XResolution": tags.get(282),
-            "YResolution": tags.get(283),
-            "ResolutionUnit": tags.get(296)  # 1=None, 2=inches, 3=centimeters
-        }
-        for key in ["XResolution", "YResolution", "ResolutionUnit"]:
-            if metadata[key] is None:
-                raise ValueError(f"Missing required metadata field: {key}")
-            
-            if isinstance(metadata[key], IFDRational):
-                metadata[key] = float(metadata[key])
-            elif isinstance(metadata[key], tuple):
-                metadata[key] = float(metadata[key][0]) / metadata[key][1]
-        return metadata
+def extract_strict_tiff_metadata(image_path, metadata=None):
+    """Extract metadata from TIFF image
+
+    Reads the TIFF header only; pass an already parsed header as metadata to
+    avoid touching the file at all.
+    """
+    if metadata is None:
+        metadata = read_tiff_header(image_path)
+    metadata = {
+        "ImageWidth": metadata["ImageWidth"],
+        "ImageLength": metadata["ImageLength"],
+        "XResolution": metadata.get("XResolution"),
+        "YResolution": metadata.get("YResolution"),
+        "ResolutionUnit": metadata.get("ResolutionUnit")  # 1=None, 2=inches, 3=centimeters
+    }
+    for key in ["XResolution", "YResolution", "ResolutionUnit"]:
+        if metadata[key] is None:
+            raise ValueError(f"Missing required metadata field: {key}")
+        metadata[key] = float(metadata[key])
+    return metadata
 
 def get_microns_per_pixel(metadata):
     """Calculate microns per pixel based on image metadata"""
@@ -52,29 +49,65 @@ def hpf_dimensions_in_pixels(x_mpp, y_mpp):
     hpf_height_px = int(hpf_height_um / y_mpp)
     return hpf_width_px, hpf_height_px
 
-def estimate_hpf_count(image_width, image_height, step_x, step_y, hpf_w, hpf_h):
-    """Estimate number of HPFs in the scanned area"""
-    total_scan_area = (image_width // step_x) * (image_height // step_y) * (step_x * step_y)
+def estimate_hpf_count(image_width, image_height, step_x, step_y, hpf_w, hpf_h, roi=None):
+    """Estimate number of HPFs in the scanned area
+
+    The area is counted in whole step_x by step_y cells of a grid over the
+    slide; with roi (polygons, see utils/roi.py) only the cells a polygon
+    intersects, so an ROI covering the slide gives the full-slide count.
+    """
+    columns, rows = image_width // step_x, image_height // step_y
+    if roi:
+        cells = sum(len(roi_columns(roi, row * step_y, step_x, step_y, columns)) for row in range(rows))
+    else:
+        cells = columns * rows
+    total_scan_area = cells * (step_x * step_y)
     hpf_area = hpf_w * hpf_h
     return total_scan_area // hpf_area
 
+def roi_columns(roi, top, step_x, step_y, columns):
+    """Grid columns of the cell row starting at top that intersect an roi polygon"""
+    from .roi import band_intervals, merge_intervals
+
+    # Inset by half a pixel so a region merely touching the row does not pull it in
+    intervals = merge_intervals([
+        interval for polygon in roi for interval in band_intervals(polygon, top + 0.5, top + step_y - 0.5)
+    ])
+    hit = set()
+    for left, right in intervals:
+        hit.update(range(max(0, math.floor(left / step_x)), min(columns, math.ceil(right / step_x))))
+    return hit
+
 def mitoses_per_10_hpf(mitotic_count, hpf_count):
     """Calculate mitoses per 10 HPF"""
     return 0 if hpf_count == 0 else (mitotic_count / hpf_count) * 10
 
-def compute_mitotic_density_from_image(image_path, mitotic_count, step_x, step_y):
-    """Compute mitotic density and related metrics from image"""
+def compute_mitotic_density_from_image(image_path, mitotic_count, step_x=None, step_y=None, scan_plan=None,
+                                       metadata=None, layout=None):
+    """Compute mitotic density and related metrics from image
+
+    The scan strides come from scan_plan (or layout's plan) when given, so
+    the HPF denominator always matches the frames TIFFScanner.smooth_scan
+    produced. With an ROI-restricted layout only the grid cells the ROI
+    intersects count as HPF area. metadata is the header stored on the
+    Analysis at upload time; the file is only read when it is missing.
+    """
+    if scan_plan is None and layout is not None:
+        scan_plan = layout.plan
+    if scan_plan is not None:
+        step_x, step_y = scan_plan.step_x, scan_plan.step_y
     # Print for debugging
     print(f"Computing HPF metrics for image: {image_path}")
     print(f"Current mitotic count: {mitotic_count}")
     print(f"Scan parameters: step_x={step_x}, step_y={step_y}")
     
     try:
-        metadata = extract_strict_tiff_metadata(image_path)
+        metadata = extract_strict_tiff_metadata(image_path, metadata)
         width, height = metadata["ImageWidth"], metadata["ImageLength"]
         x_mpp, y_mpp = get_microns_per_pixel(metadata)
         hpf_w, hpf_h = hpf_dimensions_in_pixels(x_mpp, y_mpp)
-        hpf_count = estimate_hpf_count(width, height, step_x, step_y, hpf_w, hpf_h)
+        roi = layout.roi if layout is not None else None
+        hpf_count = estimate_hpf_count(width, height, step_x, step_y, hpf_w, hpf_h, roi)
         density = mitoses_per_10_hpf(mitotic_count, hpf_count)
         
         result = {
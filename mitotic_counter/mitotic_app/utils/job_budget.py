@@ -0,0 +1,156 @@
+# utils/job_budget.py
+import os
+import sys
+import time
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from mitotic_app.models import Analysis
+from .leases import acquire_lease, claimable, host_prefix
+from .scan_plan import ScanPlan
+
+try:
+    import threadpoolctl
+except ImportError:  # BLAS pools are then only limited through the environment
+    threadpoolctl = None
+
+# acquire_with_budget outcomes
+ADMITTED = 'admitted'
+OWNED = 'owned'              # Another worker holds a live lease
+OVER_BUDGET = 'over_budget'  # Admitting it would exceed the node's CPU or memory budget
+
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+
+def total_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return 8 * 1024 ** 3
+
+
+def job_budget():
+    """Node budget from settings.JOB_BUDGET, with defaults derived from this machine"""
+    budget = {
+        'cpus': os.cpu_count() or 1,
+        'memory_bytes': int(total_memory() * 0.75),
+        'threads_per_job': 4,
+        'model_memory_bytes': 1024 ** 3,
+    }
+    budget.update(getattr(settings, 'JOB_BUDGET', {}))
+    budget['threads_per_job'] = max(1, min(budget['threads_per_job'], budget['cpus']))
+    return budget
+
+
+def estimate_job_cost(image_width, image_height, plan=None, samples_per_pixel=3, bits_per_sample=8, models=1):
+    """Frames, runtime, peak memory and threads one analysis needs.
+
+    TIFFScanner decodes the whole full-resolution page, so memory is
+    dominated by the pixel buffer; each loaded model (primary plus shadows)
+    adds a roughly fixed amount.
+    """
+    budget = job_budget()
+    plan = plan or ScanPlan.from_settings()
+    estimate = plan.estimate(image_width, image_height)
+    bytes_per_sample = max(1, bits_per_sample // 8)
+    pixels = image_width * image_height * samples_per_pixel * bytes_per_sample
+    # Pillow holds the decoded page, crops copy one window and OpenCV converts it again
+    windows = 3 * plan.window_width * plan.window_height * 3
+    return {
+        'frames': estimate['frames'],
+        'estimated_seconds': estimate['estimated_seconds'],
+        'memory_bytes': pixels + windows + budget['model_memory_bytes'] * models,
+        'threads': budget['threads_per_job'],
+    }
+
+
+def analysis_cost(analysis):
+    metadata = analysis.tiff_metadata or {}
+    bits = metadata.get('BitsPerSample') or 8
+    if isinstance(bits, (list, tuple)):
+        bits = max(bits)
+    return estimate_job_cost(
+        analysis.image_width or 0, analysis.image_height or 0,
+        plan=analysis.scan_plan,
+        samples_per_pixel=metadata.get('SamplesPerPixel') or 3,
+        bits_per_sample=bits,
+        models=1 + len(getattr(settings, 'SHADOW_MODELS', {})),
+    )
+
+
+def running_load(exclude_id=None):
+    """Threads and memory committed to analyses with a live lease held on this machine"""
+    running = Analysis.objects.filter(
+        status=Analysis.RUNNING, lease_expires_at__gte=timezone.now(), lease_owner__startswith=host_prefix(),
+    )
+    if exclude_id is not None:
+        running = running.exclude(id=exclude_id)
+    load = {'jobs': 0, 'threads': 0, 'memory_bytes': 0}
+    for analysis in running:
+        cost = analysis_cost(analysis)
+        load['jobs'] += 1
+        load['threads'] += cost['threads']
+        load['memory_bytes'] += cost['memory_bytes']
+    return load
+
+
+def fits_budget(cost, load, budget):
+    # A job too big for the whole budget may still run, but only on an idle node
+    if load['jobs'] == 0:
+        return True
+    return (load['threads'] + cost['threads'] <= budget['cpus']
+            and load['memory_bytes'] + cost['memory_bytes'] <= budget['memory_bytes'])
+
+
+def acquire_with_budget(analysis, owner):
+    """Take the analysis lease only if the node has room for it.
+
+    The budget check and the lease update run in one transaction; SQLite is
+    configured with IMMEDIATE transactions, so concurrent admissions are
+    serialized on the write lock and cannot both squeeze into the last slot.
+    On other databases the lease itself stays exclusive, but two admissions
+    racing for the last slot can briefly overshoot the budget.
+    """
+    cost = analysis_cost(analysis)
+    with transaction.atomic():
+        if not Analysis.objects.filter(claimable(), id=analysis.id).exists():
+            return OWNED
+        budget = job_budget()
+        if not fits_budget(cost, running_load(exclude_id=analysis.id), budget):
+            return OVER_BUDGET
+        return ADMITTED if acquire_lease(analysis.id, owner) else OWNED
+
+
+def wait_for_admission(analysis, owner, timeout=None):
+    """Retry admission until there is room, the analysis is taken or timeout seconds pass"""
+    poll = getattr(settings, 'ADMISSION_POLL_SECONDS', 10)
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    while True:
+        outcome = acquire_with_budget(analysis, owner)
+        if outcome != OVER_BUDGET:
+            return outcome
+        if deadline is not None and time.monotonic() >= deadline:
+            return outcome
+        time.sleep(poll)
+
+
+def limit_threads(threads):
+    """Cap OpenCV, PyTorch and BLAS thread pools for the current process.
+
+    The caps are process-wide, so they are the per-job share of the budget
+    rather than anything job specific; analyses running side by side in one
+    process then share cores instead of each spawning a thread per core.
+    """
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)  # Inherited by subprocesses and late imports
+    try:
+        import cv2
+        cv2.setNumThreads(threads)
+    except ImportError:
+        pass
+    # torch imported later reads OMP_NUM_THREADS; one already loaded has to be told
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch.set_num_threads(threads)
+    if threadpoolctl is not None:
+        threadpoolctl.threadpool_limits(limits=threads)
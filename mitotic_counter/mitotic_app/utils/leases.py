@@ -0,0 +1,119 @@
+# utils/leases.py
+import os
+import socket
+import threading
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+from mitotic_app.models import Analysis
+
+
+class LeaseLost(Exception):
+    """Another worker took over the run; its results must not be written"""
+
+
+def lease_ttl():
+    return timedelta(seconds=getattr(settings, 'ANALYSIS_LEASE_SECONDS', 120))
+
+
+def host_prefix():
+    """Start of every lease owner created on this machine"""
+    return f"{socket.gethostname()}:"
+
+
+def new_owner():
+    """Identifier for one pipeline run, unique across hosts, processes and threads"""
+    return f"{host_prefix()}{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def claimable():
+    """Analyses that no live worker owns: queued, or running with an expired lease"""
+    now = timezone.now()
+    return Q(status=Analysis.QUEUED) | Q(status=Analysis.RUNNING, lease_expires_at__lt=now)
+
+
+def acquire_lease(analysis_id, owner):
+    """Atomically move an analysis to running for owner. False if someone else holds it"""
+    now = timezone.now()
+    claimed = Analysis.objects.filter(claimable(), id=analysis_id).update(
+        status=Analysis.RUNNING,
+        lease_owner=owner,
+        lease_expires_at=now + lease_ttl(),
+        heartbeat_at=now,
+        error_message='',
+        started_at=now,
+        finished_at=None,
+        version=F('version') + 1,
+    )
+    return claimed == 1
+
+
+def renew_lease(analysis_id, owner):
+    """Extend a lease we still hold. False if it was lost (expired and taken over)"""
+    now = timezone.now()
+    renewed = Analysis.objects.filter(id=analysis_id, status=Analysis.RUNNING, lease_owner=owner).update(
+        lease_expires_at=now + lease_ttl(),
+        heartbeat_at=now,
+    )
+    return renewed == 1
+
+
+def holds_lease(analysis_id, owner):
+    """Whether owner still holds the lease on a running analysis"""
+    return Analysis.objects.filter(id=analysis_id, status=Analysis.RUNNING, lease_owner=owner).exists()
+
+
+def release_lease(analysis_id, owner, status, error_message=''):
+    """Finish a run as done or failed, if we still own it"""
+    Analysis.objects.filter(id=analysis_id, lease_owner=owner).update(
+        status=status,
+        lease_owner='',
+        lease_expires_at=None,
+        error_message=error_message[:2000],
+        finished_at=timezone.now(),
+        version=F('version') + 1,
+    )
+
+
+class LeaseHeartbeat:
+    """Renew a lease from a background thread for as long as the block runs"""
+
+    def __init__(self, analysis_id, owner):
+        self.analysis_id = analysis_id
+        self.owner = owner
+        self.stopped = threading.Event()
+        self.lost = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def renew(self):
+        return renew_lease(self.analysis_id, self.owner)
+
+    def run(self):
+        interval = lease_ttl().total_seconds() / 3
+        try:
+            while not self.stopped.wait(interval):
+                if not self.renew():
+                    self.lost = True
+                    print(f"Lost lease on {self.describe()}")
+                    return
+        finally:
+            connection.close()  # The thread has its own database connection
+
+    def describe(self):
+        return f"Analysis {self.analysis_id}"
+
+    def check(self):
+        """Raise LeaseLost if a renewal failed. Call between stages and before writing results"""
+        if self.lost:
+            raise LeaseLost(f"Lost lease on {self.describe()}")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
@@ -0,0 +1,89 @@
+# utils/media_serving.py
+import os
+import re
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# What the pages link to, relative to MEDIA_ROOT: figure crops (and debug
+# frames), moved figures, thumbnails and browser videos. Uploaded slides,
+# scan videos, checkpoints and other intermediates are never served.
+SERVED_MEDIA_RE = re.compile(
+    r'^(?:analysis_\d+/(?:output_debug/)?output_[\w-]+/[^/]+\.jpg'
+    r'|analysis_\d+/(?:thumbnail\.jpg|processed_video_browser\.mp4)'
+    r'|figures/[\w-]+/[^/]+\.jpg'
+    r'|thumbnails/[^/]+'
+    r'|videos/processed/[^/]+)$'
+)
+
+
+class RangedFile:
+    """Read-only view of [start, start + length) of an open file.
+
+    It exposes fileno() so WSGI servers that implement wsgi.file_wrapper with
+    os.sendfile (gunicorn, uWSGI) can send the range without copying it
+    through Python; they start at the current offset and stop at
+    Content-Length. Servers without sendfile fall back to read().
+    """
+
+    def __init__(self, f, start, length):
+        self.f = f
+        self.remaining = length
+        f.seek(start)
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+def parse_range(header, size):
+    """Parse a single-range Range header.
+
+    Returns (start, end) inclusive, None when the header should be ignored
+    (absent, malformed or multi-range) and raises ValueError when the range
+    cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, size - 1)
+
+
+def make_etag(stat_result):
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def media_path(document_root, path):
+    """Resolve a URL path inside document_root, or None if it escapes it or is not media the pages serve"""
+    root = os.path.realpath(document_root)
+    full_path = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, full_path]) != root:
+        return None
+    if not SERVED_MEDIA_RE.match(os.path.relpath(full_path, root).replace(os.sep, '/')):
+        return None
+    return full_path
@@ -0,0 +1,209 @@
+# utils/media_storage.py
+import filecmp
+import os
+import shutil
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+
+def analysis_dir(analysis):
+    return os.path.join(settings.MEDIA_ROOT, f'analysis_{analysis.id}')
+
+
+def path_size(path):
+    """Size in bytes of a file or of everything under a directory"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def intermediate_artifacts(analysis):
+    """Files that are only needed while an analysis is running"""
+    base = analysis_dir(analysis)
+    artifacts = {
+        'scan_video': os.path.join(base, 'tiff_scan.mp4'),
+        'raw_processed_video': os.path.join(base, 'processed_video.mp4'),
+        'processed_segments': os.path.join(base, 'processed_segments'),
+        'checkpoint': os.path.join(base, 'checkpoint.json'),
+        'shard_checkpoints': os.path.join(base, 'shards'),
+    }
+    if not getattr(settings, 'MEDIA_KEEP_DEBUG_FRAMES', False):
+        artifacts['debug_frames'] = os.path.join(base, 'output_debug')
+    return artifacts
+
+
+def evictable_artifacts(analysis):
+    """Intermediates plus regenerable outputs; figure crops and the upload are never evicted"""
+    artifacts = intermediate_artifacts(analysis)
+    artifacts['tiles'] = os.path.join(analysis_dir(analysis), 'tiles')  # Re-rendered on demand
+    if analysis.processed_video:
+        artifacts['processed_video'] = os.path.join(settings.MEDIA_ROOT, analysis.processed_video.name)
+    return artifacts
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _forget_scan_video(analysis):
+    """Clear video_file once the scan video it points at is gone.
+
+    video_file marks a scanned slide: run_analysis resumes from it and the
+    processing page reports detection progress while it is set.
+    """
+    scan_video = os.path.relpath(intermediate_artifacts(analysis)['scan_video'], settings.MEDIA_ROOT)
+    if analysis.video_file and analysis.video_file.name == scan_video:
+        analysis.video_file = None
+        analysis.save(update_fields=['video_file'])
+
+
+def compact_analysis(analysis):
+    """Drop intermediates of a finished analysis. Returns the number of bytes freed"""
+    freed = 0
+    for path in intermediate_artifacts(analysis).values():
+        if os.path.exists(path):
+            freed += path_size(path)
+            _remove(path)
+    _forget_scan_video(analysis)
+    return freed
+
+
+def evict_analysis(analysis, dry_run=False):
+    """Remove all regenerable artifacts and mark the analysis as evicted"""
+    freed = 0
+    for path in evictable_artifacts(analysis).values():
+        if os.path.exists(path):
+            freed += path_size(path)
+            if not dry_run:
+                _remove(path)
+    if not dry_run:
+        _forget_scan_video(analysis)
+    # Tiles alone are re-rendered on demand; only a removed video needs regenerating
+    if not dry_run and analysis.processed_video:
+        type(analysis).objects.filter(id=analysis.id).update(media_evicted=True, version=F('version') + 1)
+        analysis.media_evicted = True
+    return freed
+
+
+def media_usage():
+    return path_size(settings.MEDIA_ROOT)
+
+
+def eviction_candidates(queryset, max_bytes=None, older_than_days=None):
+    """Pick analyses to evict, least recently used first.
+
+    Analyses not accessed within older_than_days are always chosen; after that
+    more are chosen until the evictable total brings MEDIA_ROOT under max_bytes.
+    Yields (analysis, evictable_bytes).
+    """
+    queryset = queryset.filter(media_evicted=False)
+    cutoff = timezone.now() - timedelta(days=older_than_days) if older_than_days is not None else None
+    excess = media_usage() - max_bytes if max_bytes is not None else 0
+
+    analyses = sorted(queryset, key=lambda a: a.last_accessed or a.upload_date)
+    for analysis in analyses:
+        last_used = analysis.last_accessed or analysis.upload_date
+        stale = cutoff is not None and last_used < cutoff
+        if not stale and excess <= 0:
+            break
+        size = sum(path_size(p) for p in evictable_artifacts(analysis).values() if os.path.exists(p))
+        if size == 0 and not stale:
+            continue
+        excess -= size
+        yield analysis, size
+
+
+def dedupe_scan_videos(queryset):
+    """Point legacy video_file copies under videos/ back at analysis_N/tiff_scan.mp4.
+
+    Older analyses saved the scan video twice. Identical copies are deleted;
+    if only the copy survives it is hardlinked into the analysis directory.
+    Returns the number of bytes freed.
+    """
+    freed = 0
+    for analysis in queryset.exclude(video_file='').exclude(video_file__isnull=True):
+        if not analysis.video_file.name.startswith('videos/'):
+            continue
+        copy_path = os.path.join(settings.MEDIA_ROOT, analysis.video_file.name)
+        original_path = os.path.join(analysis_dir(analysis), 'tiff_scan.mp4')
+        if not os.path.exists(copy_path):
+            continue
+        if os.path.exists(original_path):
+            if not filecmp.cmp(copy_path, original_path, shallow=False):
+                continue
+            freed += os.path.getsize(copy_path)
+            os.remove(copy_path)
+        else:
+            os.makedirs(os.path.dirname(original_path), exist_ok=True)
+            os.link(copy_path, original_path)
+            os.remove(copy_path)
+        analysis.video_file.name = os.path.relpath(original_path, settings.MEDIA_ROOT)
+        analysis.save(update_fields=['video_file'])
+    return freed
+
+
+def touch(analysis):
+    """Record an access for LRU eviction without a full model save.
+
+    Writes at most once per MEDIA_TOUCH_INTERVAL seconds so page views do not
+    contend for the database write lock.
+    """
+    now = timezone.now()
+    interval = timedelta(seconds=getattr(settings, 'MEDIA_TOUCH_INTERVAL', 3600))
+    if analysis.last_accessed and now - analysis.last_accessed < interval:
+        return
+    type(analysis).objects.filter(id=analysis.id).update(last_accessed=now)
+    analysis.last_accessed = now
+
+
+def regenerate_artifacts(analysis, model_path=None):
+    """Rebuild the processed video of an evicted analysis from the uploaded slide.
+
+    Runs the scan and the model again, so callers hold the analysis lease
+    (see pipeline.run_analysis_exclusive); the figures are left as they are.
+    """
+    from .tiff_scanner import TIFFScanner, convert_to_mp4
+    from .mitotic_counter import process_video
+
+    if model_path is None:
+        model_path = os.path.join(settings.BASE_DIR, 'model', 'best.pt')
+
+    plan = analysis.scan_plan
+    layout = analysis.scan_layout
+    scanner = TIFFScanner(analysis.uploaded_image.path)
+    video_path = scanner.smooth_scan(output_dir=analysis_dir(analysis), plan=plan, layout=layout)
+    analysis.video_file.name = os.path.relpath(video_path, settings.MEDIA_ROOT)
+    analysis.save(update_fields=['video_file'])
+    results = process_video(
+        video_path=video_path,
+        model_path=model_path,
+        analysis_id=analysis.id,
+        scan_shift=plan.step_x if plan else 0,
+        row_starts=layout.row_starts if layout else None,
+        save_figures=False
+    )
+    if not results:
+        return False
+
+    raw_video_path = os.path.join(settings.MEDIA_ROOT, results['processed_video'])
+    base, _ = os.path.splitext(results['processed_video'])
+    safe_filename = f"{base}_browser.mp4"
+    convert_to_mp4(raw_video_path, os.path.join(settings.MEDIA_ROOT, safe_filename))
+
+    analysis.processed_video.name = safe_filename
+    analysis.media_evicted = False
+    analysis.save(update_fields=['processed_video', 'media_evicted'])
+    compact_analysis(analysis)
+    return True
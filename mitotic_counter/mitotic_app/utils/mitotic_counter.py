@@ -1,17 +1,232 @@
 # utils/mitotic_counter.py
 import os
-import cv2
-import numpy as np
-from ultralytics import YOLO
+import json
 from django.conf import settings
 from django.core.files import File
 import shutil
 from mitotic_app.models import DetectedFigure
 
+# cv2, the detector backends and ffmpeg are imported inside process_video so
+# that the web process, which only needs the checkpoint and figure helpers
+# below, does not load them
 
-def process_video(video_path, model_path, analysis_id):
-    """Process video to count mitotic and non-mitotic figures"""
+
+def checkpoint_path_for(analysis_id, shard=None):
+    base_dir = os.path.join(settings.MEDIA_ROOT, f'analysis_{analysis_id}')
+    if shard is not None:
+        return os.path.join(base_dir, 'shards', f'shard_{shard}.json')
+    return os.path.join(base_dir, 'checkpoint.json')
+
+
+def load_checkpoint(analysis_id, shard=None):
+    """Return the saved process_video state for an analysis (or one of its shards), or None"""
+    path = checkpoint_path_for(analysis_id, shard)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable checkpoint {path}: {e}")
+        return None
+    # JSON object keys are strings; track ids are ints
+    state['objects_track'] = {int(k): v for k, v in state['objects_track'].items()}
+    for shadow in state.get('shadows', {}).values():
+        shadow['objects_track'] = {int(k): v for k, v in shadow['objects_track'].items()}
+    return state
+
+
+def save_checkpoint(analysis_id, state, shard=None):
+    """Write the checkpoint atomically so a crash mid-write keeps the previous one"""
+    path = checkpoint_path_for(analysis_id, shard)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def clear_checkpoint(analysis_id, shard=None):
+    path = checkpoint_path_for(analysis_id, shard)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def calculate_iou(box1, box2):
+    """Calculate IoU between two boxes [x1, y1, x2, y2]"""
+    x1_1, y1_1, x2_1, y2_1 = box1
+    x1_2, y1_2, x2_2, y2_2 = box2
+    
+    # Calculate intersection area
+    x_left = max(x1_1, x1_2)
+    y_top = max(y1_1, y1_2)
+    x_right = min(x2_1, x2_2)
+    y_bottom = min(y2_1, y2_2)
     
+    if x_right < x_left or y_bottom < y_top:
+        return 0.0
+    
+    intersection_area = (x_right - x_left) * (y_bottom - y_top)
+    
+    # Calculate union area
+    box1_area = (x2_1 - x1_1) * (y2_1 - y1_1)
+    box2_area = (x2_2 - x1_2) * (y2_2 - y1_2)
+    union_area = box1_area + box2_area - intersection_area
+    
+    return intersection_area / union_area if union_area > 0 else 0
+
+
+class LineCounter:
+    """Tracks boxes across scan frames and reports those crossing the counting line.
+
+    Tracked boxes are moved left by scan_shift before matching. A track whose
+    centre passes line_x from right to left is reported once; tracks first
+    seen left of the line never are. process_video keeps one per model, so
+    shadow models are counted by exactly the same rules as the primary.
+    """
+    max_disappeared = 15  # Frames before we forget an object
+    iou_threshold = 0.3  # Threshold for matching boxes between frames
+
+    def __init__(self, line_x, top, bottom, scan_shift=0, conf_threshold=0.7, objects_track=None, next_id=0):
+        self.line_x = line_x
+        self.top = top
+        self.bottom = bottom
+        self.scan_shift = scan_shift
+        self.conf_threshold = conf_threshold
+        self.objects_track = objects_track if objects_track is not None else {}
+        self.next_id = next_id
+
+    def update(self, detections):
+        """Match one frame's detections to the tracks.
+
+        Returns (category, box, confidence) for each track that crossed the line.
+        """
+        crossings = []
+        
+        # Mark all objects as not found in this frame
+        for obj_data in self.objects_track.values():
+            obj_data['found'] = False
+        
+        for x1, y1, x2, y2, confidence, class_id in detections:
+            if confidence < self.conf_threshold:
+                continue
+            current_box = [x1, y1, x2, y2]
+            
+            # Skip objects that are significantly outside the valid vertical region
+            if y2 < self.top or y1 > self.bottom:
+                continue
+            
+            # Try to match with existing objects
+            best_match_id = None
+            best_iou = 0
+            for obj_id, obj_data in self.objects_track.items():
+                if obj_data['found'] or obj_data['class'] != class_id:
+                    # Skip already matched objects or objects of different class
+                    continue
+                last_pos = obj_data['positions'][-1]
+                shift = self.scan_shift * (obj_data['disappeared'] + 1)
+                predicted = [last_pos[0] - shift, last_pos[1], last_pos[2] - shift, last_pos[3]]
+                curr_iou = calculate_iou(predicted, current_box)
+                if curr_iou > self.iou_threshold and curr_iou > best_iou:
+                    best_match_id = obj_id
+                    best_iou = curr_iou
+            
+            if best_match_id is None:
+                # Create a new object; one first seen left of the line has already crossed
+                self.objects_track[self.next_id] = {
+                    'positions': [current_box],
+                    'crossed': (x1 + x2) // 2 <= self.line_x,
+                    'found': True,
+                    'disappeared': 0,
+                    'class': class_id  # Store the class ID
+                }
+                self.next_id += 1
+                continue
+            
+            # Update the existing object
+            obj_data = self.objects_track[best_match_id]
+            obj_data['positions'].append(current_box)
+            obj_data['found'] = True
+            obj_data['disappeared'] = 0
+            
+            # Check if it has crossed the line from right to left
+            if not obj_data['crossed']:
+                prev_box, curr_box = obj_data['positions'][-2], obj_data['positions'][-1]
+                prev_center_x = (prev_box[0] + prev_box[2]) // 2
+                curr_center_x = (curr_box[0] + curr_box[2]) // 2
+                if prev_center_x > self.line_x and curr_center_x <= self.line_x:
+                    obj_data['crossed'] = True
+                    category = DetectedFigure.MITOTIC if obj_data['class'] == 1 else DetectedFigure.NON_MITOTIC
+                    crossings.append((category, current_box, confidence))
+        
+        # Forget objects that have been missing for too long
+        for obj_id in list(self.objects_track):
+            obj_data = self.objects_track[obj_id]
+            if not obj_data['found']:
+                obj_data['disappeared'] += 1
+                if obj_data['disappeared'] > self.max_disappeared:
+                    del self.objects_track[obj_id]
+        
+        return crossings
+
+    def state(self):
+        """Checkpointable tracker state; only the last two positions matter for tracking"""
+        return {
+            'next_id': self.next_id,
+            'objects_track': {
+                obj_id: dict(obj_data, positions=obj_data['positions'][-2:])
+                for obj_id, obj_data in self.objects_track.items()
+            },
+        }
+
+
+def process_video(video_path, model_path, analysis_id, detector=None, scan_shift=0, save_figures=True,
+                  resume=True, checkpoint_every=None, keyframe_interval=None, frames_per_row=None,
+                  write_video=True, shadow_detectors=None, start_frame=0, end_frame=None, shard=None,
+                  row_starts=None, progress=None):
+    """Process video to count mitotic and non-mitotic figures
+
+    scan_shift is the known horizontal stride between frames (ScanPlan.step_x);
+    tracked boxes are moved left by it before matching so larger strides
+    still associate across frames. With save_figures=False only the processed
+    video is written, which is how evicted videos are regenerated. With
+    write_video=False no processed video is produced at all (the slide
+    viewer shows the detections instead) and results['processed_video'] is None.
+
+    Every checkpoint_every frames the tracker state, counts and figures found
+    so far are saved to analysis_N/checkpoint.json and the processed video is
+    cut into a new segment. With resume=True a later call continues from the
+    last checkpoint instead of starting over.
+
+    With keyframe_interval=K > 1 the model only runs every K frames, on the
+    first frame of each scan row (frames_per_row) and while a box is still
+    entering at the right edge. In between, the last detections are moved
+    left by scan_shift, which is exactly how the content moves. K is capped
+    so a figure entering between keyframes is detected before it reaches
+    the counting line. For scans that skip windows (ScanLayout runs) pass
+    row_starts, the frames where each run begins, instead of frames_per_row.
+
+    shadow_detectors maps names to extra detectors that are given every
+    decoded frame alongside the primary one. They are tracked and counted the
+    same way but never draw, save crops or create figures; their counts and
+    crossings are returned in results['shadows'] for comparison.
+
+    start_frame and end_frame restrict the run to part of the scan, for the
+    shards of a distributed analysis (see utils/shards.py). Ranges should
+    start on a scan row so tracks do not span shards. end_frame may be a
+    callable, read once per frame, so a worker can be told to stop early
+    when part of its range is stolen. A shard label keeps the checkpoint and
+    video segments separate from other shards of the same analysis, and
+    skips joining the segments into processed_video.mp4.
+
+    progress, if given, is called as progress(frame_count, figures_data)
+    after every frame, e.g. to publish a running estimate.
+    """
+    import cv2
+    from .figure_hashes import crop_box, phash
+
     # Create output directories
     base_dir = os.path.join(settings.MEDIA_ROOT, f'analysis_{analysis_id}')
     output_dir_mitotic = os.path.join(base_dir, 'output_mitotic')
@@ -19,13 +234,24 @@ def process_video(video_path, model_path, analysis_id):
     output_debug_mitotic = os.path.join(base_dir, 'output_debug', 'output_mitotic')
     output_debug_non_mitotic = os.path.join(base_dir, 'output_debug', 'output_non_mitotic')
     processed_video_path = os.path.join(base_dir, 'processed_video.mp4')
+    segments_dir = os.path.join(base_dir, 'processed_segments')
+    if shard is not None:
+        segments_dir = os.path.join(segments_dir, f'shard_{shard}')
+    if not callable(end_frame):
+        end_frame = (lambda limit: lambda: limit)(end_frame)
+    if checkpoint_every is None:
+        checkpoint_every = getattr(settings, 'CHECKPOINT_EVERY_FRAMES', 500)
+    if keyframe_interval is None:
+        keyframe_interval = getattr(settings, 'DETECTION_KEYFRAME_INTERVAL', 1)
 
     # Create directories if they don't exist
     for directory in [output_dir_mitotic, output_dir_non_mitotic, output_debug_mitotic, output_debug_non_mitotic]:
         os.makedirs(directory, exist_ok=True)
 
-    # Load the YOLO model
-    model = YOLO(model_path)
+    # Load the detector backend (settings.DETECTOR_BACKEND unless one is passed in)
+    if detector is None:
+        from .detectors import get_detector
+        detector = get_detector(model_path)
 
     # Set the confidence threshold
     conf_threshold = 0.7
@@ -50,57 +276,129 @@ def process_video(video_path, model_path, analysis_id):
     line_start = (line_x, gap_top)
     line_end = (line_x, height - gap_bottom)
 
+    # Propagating boxes needs a known stride, and a figure entering right after
+    # a keyframe must be seen at least once before it reaches the line
+    if not scan_shift:
+        keyframe_interval = 1
+    elif keyframe_interval > 1:
+        max_interval = max(1, (width - line_x) // scan_shift - 1)
+        if keyframe_interval > max_interval:
+            print(f"Keyframe interval {keyframe_interval} capped to {max_interval} for a {scan_shift}px stride")
+            keyframe_interval = max_interval
+
     # Counters for objects crossing the line
     mitotic_count = 0
     non_mitotic_count = 0
-    frame_count = 0
+    frame_count = start_frame
 
     # Reset video capture to start
     cap.release()
     cap = cv2.VideoCapture(video_path)
 
-    # Set up output video writer for processed video
+    # Tracks objects and their paths across frames
+    tracker = LineCounter(line_x, gap_top, height - gap_bottom, scan_shift, conf_threshold)
+
+    figures_data = []
+
+    # Keyframe state: detections of the previous frame and frames since the model last ran
+    last_detections = None
+    frames_since_keyframe = 0
+    inference_frames = 0
+
+    # Shadow models see the same decoded frames and only count; nothing is drawn or saved for them
+    shadows = {
+        name: {
+            'detector': shadow_detector,
+            'tracker': LineCounter(line_x, gap_top, height - gap_bottom, scan_shift, conf_threshold),
+            'last_detections': None,
+            'frames_since_keyframe': 0,
+            'inference_frames': 0,
+            'figures': [],
+        }
+        for name, shadow_detector in (shadow_detectors or {}).items()
+    }
+
+    # Pick up where a previous run left off
+    state = load_checkpoint(analysis_id, shard) if resume else None
+    if state is not None:
+        frame_count = state['frame_count']
+        mitotic_count = state['mitotic_count']
+        non_mitotic_count = state['non_mitotic_count']
+        tracker = LineCounter(line_x, gap_top, height - gap_bottom, scan_shift, conf_threshold,
+                              state['objects_track'], state['next_id'])
+        figures_data = state['figures_data']
+        last_detections = state.get('last_detections')
+        frames_since_keyframe = state.get('frames_since_keyframe', 0)
+        inference_frames = state.get('inference_frames', 0)
+        for name in list(shadows):
+            shadow_state = state.get('shadows', {}).get(name)
+            if shadow_state is None:
+                # It would only see the rest of the slide, so its counts could not be compared
+                print(f"Shadow model {name} was not part of the interrupted run; skipping it")
+                del shadows[name]
+                continue
+            shadows[name].update(
+                tracker=LineCounter(line_x, gap_top, height - gap_bottom, scan_shift, conf_threshold,
+                                    shadow_state['objects_track'], shadow_state['next_id']),
+                last_detections=shadow_state['last_detections'],
+                frames_since_keyframe=shadow_state['frames_since_keyframe'],
+                inference_frames=shadow_state['inference_frames'],
+                figures=shadow_state['figures'],
+            )
+        print(f"Resuming analysis {analysis_id} from frame {frame_count}")
+    else:
+        clear_checkpoint(analysis_id, shard)
+        shutil.rmtree(segments_dir, ignore_errors=True)
+    os.makedirs(segments_dir, exist_ok=True)
+    for _ in range(frame_count):
+        if not cap.grab():
+            break
+
+    # Set up output video writer for processed video, one segment per checkpoint
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(processed_video_path, fourcc, fps, (width, height))
 
-    # Dictionary to track objects and their paths
-    objects_track = {}  
-    next_id = 0
-    max_disappeared = 15  # Frames before we forget an object
-    iou_threshold = 0.3  # Threshold for matching boxes between frames
+    def open_segment(start_frame):
+        if not write_video:
+            return None
+        segment_path = os.path.join(segments_dir, f'segment_{start_frame:08d}.mp4')
+        return cv2.VideoWriter(segment_path, fourcc, fps, (width, height))
+
+    out = open_segment(frame_count)
 
     # Colors for visualization
     COLOR_MITOTIC = (0, 255, 0)       # Green for mitotic
     COLOR_NON_MITOTIC = (255, 165, 0)  # Orange for non-mitotic
     COLOR_CROSSED = (0, 0, 255)       # Red for crossed line
 
-    figures_data = []
+    def detect_frame(frame_detector, frame, previous, since_keyframe):
+        """Run the model, or carry the previous boxes along by the scan stride.
 
-    def calculate_iou(box1, box2):
-        """Calculate IoU between two boxes [x1, y1, x2, y2]"""
-        x1_1, y1_1, x2_1, y2_1 = box1
-        x1_2, y1_2, x2_2, y2_2 = box2
-        
-        # Calculate intersection area
-        x_left = max(x1_1, x1_2)
-        y_top = max(y1_1, y1_2)
-        x_right = min(x2_1, x2_2)
-        y_bottom = min(y2_1, y2_2)
-        
-        if x_right < x_left or y_bottom < y_top:
-            return 0.0
-        
-        intersection_area = (x_right - x_left) * (y_bottom - y_top)
-        
-        # Calculate union area
-        box1_area = (x2_1 - x1_1) * (y2_1 - y1_1)
-        box2_area = (x2_2 - x1_2) * (y2_2 - y1_2)
-        union_area = box1_area + box2_area - intersection_area
-        
-        return intersection_area / union_area if union_area > 0 else 0
+        Returns (detections, frames since the model last ran, whether it ran).
+        """
+        since_keyframe += 1
+        needs_inference = (
+            keyframe_interval <= 1
+            or previous is None
+            or since_keyframe >= keyframe_interval
+            or (frame_count in row_starts if row_starts is not None
+                else frames_per_row and frame_count % frames_per_row == 0)
+            # A box touching the right edge is still entering; its full extent is unknown
+            or any(d[2] >= width - scan_shift for d in previous)
+        )
+        if needs_inference:
+            return [tuple(d) for d in frame_detector.detect(frame)], 0, True
+        # Boxes leaving on the left are clipped to the frame and dropped once gone
+        return [
+            (max(x1 - scan_shift, 0), y1, x2 - scan_shift, y2, confidence, class_id)
+            for x1, y1, x2, y2, confidence, class_id in previous
+            if x2 - scan_shift > 0
+        ], since_keyframe, False
 
     # For each frame
     while cap.isOpened():
+        limit = end_frame()
+        if limit is not None and frame_count >= limit:
+            break
         ret, frame = cap.read()
         if not ret:
             break
@@ -114,23 +412,16 @@ def process_video(video_path, model_path, analysis_id):
         # Draw the vertical line for visualization (only on debug frame)
         cv2.line(debug_frame, line_start, line_end, COLOR_CROSSED, 2)
         
-        # Perform inference
-        results = model(frame)
-        
-        # Mark all objects as not found in this frame
-        for obj_id in objects_track:
-            objects_track[obj_id]['found'] = False
+        # Perform inference, or carry the previous boxes along by the scan stride
+        detections, frames_since_keyframe, inferred = detect_frame(
+            detector, frame, last_detections, frames_since_keyframe
+        )
+        inference_frames += inferred
+        last_detections = detections
         
-        # Check for detections
-        for box in results[0].boxes:
-            confidence = box.conf.item()
-            class_id = int(box.cls.item())
-            
+        # Draw confident detections on both frames
+        for x1, y1, x2, y2, confidence, class_id in detections:
             if confidence >= conf_threshold:
-                # Get bounding box coordinates
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                current_box = [x1, y1, x2, y2]
-                
                 # Determine if this is mitotic or non-mitotic
                 is_mitotic = class_id == 0  # Change this if your class mappings are different   ##change
                 
@@ -144,129 +435,76 @@ def process_video(video_path, model_path, analysis_id):
                 # Add label only to debug frame
                 label = f'{"Mitotic" if is_mitotic else "Non-Mitotic"} {confidence:.2f}'
                 cv2.putText(debug_frame, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-                
-                # Calculate center of the box
-                center_x = (x1 + x2) // 2
-                center_y = (y1 + y2) // 2
-                
-                # Skip objects that are significantly outside the valid vertical region
-                if y2 < gap_top or y1 > (height - gap_bottom):
-                    continue
-                    
-                # Try to match with existing objects
-                matched = False
-                best_match_id = None
-                best_iou = 0
-                
-                for obj_id, obj_data in objects_track.items():
-                    if obj_data['found'] or obj_data['class'] != class_id:
-                        # Skip already matched objects or objects of different class
-                        continue
-                        
-                    if len(obj_data['positions']) > 0:
-                        last_pos = obj_data['positions'][-1]
-                        curr_iou = calculate_iou(last_pos, current_box)
-                        
-                        if curr_iou > iou_threshold and curr_iou > best_iou:
-                            best_match_id = obj_id
-                            best_iou = curr_iou
-                
-                if best_match_id is not None:
-                    # Update the existing object
-                    objects_track[best_match_id]['positions'].append(current_box)
-                    objects_track[best_match_id]['found'] = True
-                    objects_track[best_match_id]['disappeared'] = 0
-                    
-                    # Check if it has crossed the line from right to left
-                    if not objects_track[best_match_id]['crossed']:
-                        # Get previous and current positions
-                        positions = objects_track[best_match_id]['positions']
-                        
-                        if len(positions) >= 2:
-                            prev_box = positions[-2]
-                            curr_box = positions[-1]
-                            prev_center_x = (prev_box[0] + prev_box[2]) // 2
-                            curr_center_x = (curr_box[0] + curr_box[2]) // 2
-                            
-                            # Check if it crossed the line from right to left
-                            if prev_center_x > line_x and curr_center_x <= line_x:
-                                # Increment appropriate counter
-                                if objects_track[best_match_id]['class'] == 1:  # Mitotic
-                                    mitotic_count += 1
-                                    counter = mitotic_count
-                                    output_dir = output_dir_mitotic
-                                    debug_dir = output_debug_mitotic
-                                    count_type = "Mitotic"
-                                else:  # Non-mitotic
-                                    non_mitotic_count += 1
-                                    counter = non_mitotic_count
-                                    output_dir = output_dir_non_mitotic
-                                    debug_dir = output_debug_non_mitotic
-                                    count_type = "Non-Mitotic"
-                                    
-                                objects_track[best_match_id]['crossed'] = True
-                                
-                                # Draw crossing indicators (only on debug frame)
-                                cv2.circle(debug_frame, (center_x, center_y), 8, COLOR_CROSSED, -1)
-                                cv2.putText(debug_frame, f"CROSS", (center_x, center_y - 10), 
-                                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, COLOR_CROSSED, 2)
-                                
-                                # Save the clean frame with just the bounding box
-                                clean_filename = os.path.join(output_dir, f'{count_type.lower()}crossing{counter:04d}frame{frame_count:04d}.jpg')
-                                cv2.imwrite(clean_filename, vis_frame)
-                                
-                                # Save the debug frame with all visualization
-                                debug_filename = os.path.join(debug_dir, f'{count_type.lower()}crossing{counter:04d}frame{frame_count:04d}_debug.jpg')
-                                
-                                # Add count information to the debug frame
-                                info_text = f"Mitotic: {mitotic_count} | Non-Mitotic: {non_mitotic_count}"
-                                cv2.putText(debug_frame, info_text, (10, 30), 
-                                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
-                                
-                                cv2.imwrite(debug_filename, debug_frame)
-                                print(f'{count_type} figure crossed the line! Count: {counter}. Frame: {frame_count}')
-                                
-                                # Store figure data for database
-                                rel_path = os.path.relpath(clean_filename, settings.MEDIA_ROOT)
-                                figures_data.append({
-                                    'image_path': rel_path,
-                                    'category': 'mitotic' if count_type == "Mitotic" else 'non_mitotic',
-                                    'confidence': confidence,
-                                    'frame_number': frame_count
-                                })
-                else:
-                    # Create a new object
-                    objects_track[next_id] = {
-                        'positions': [current_box],
-                        'crossed': False,
-                        'found': True,
-                        'disappeared': 0,
-                        'class': class_id  # Store the class ID
-                    }
-                    # For new objects starting on the left side of the line
-                    center_x = (x1 + x2) // 2
-                    if center_x <= line_x:
-                        # Already crossed when first detected, mark as crossed
-                        objects_track[next_id]['crossed'] = True
-                    next_id += 1
-        
-        # Update tracking - increment disappeared counter for objects not found
-        object_ids_to_delete = []
         
-        for obj_id, obj_data in objects_track.items():
-            if not obj_data['found']:
-                obj_data['disappeared'] += 1
-                
-                # If object has been missing for too long, mark it for deletion
-                if obj_data['disappeared'] > max_disappeared:
-                    object_ids_to_delete.append(obj_id)
+        # Count the tracks that crossed the line from right to left in this frame
+        for category, current_box, confidence in tracker.update(detections):
+            # Increment appropriate counter
+            if category == DetectedFigure.MITOTIC:
+                mitotic_count += 1
+                counter = mitotic_count
+                output_dir = output_dir_mitotic
+                debug_dir = output_debug_mitotic
+                count_type = "Mitotic"
+            else:  # Non-mitotic
+                non_mitotic_count += 1
+                counter = non_mitotic_count
+                output_dir = output_dir_non_mitotic
+                debug_dir = output_debug_non_mitotic
+                count_type = "Non-Mitotic"
+            
+            # Draw crossing indicators (only on debug frame)
+            center_x = (current_box[0] + current_box[2]) // 2
+            center_y = (current_box[1] + current_box[3]) // 2
+            cv2.circle(debug_frame, (center_x, center_y), 8, COLOR_CROSSED, -1)
+            cv2.putText(debug_frame, f"CROSS", (center_x, center_y - 10), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, COLOR_CROSSED, 2)
+            
+            # Save the clean frame with just the bounding box
+            clean_filename = os.path.join(output_dir, f'{count_type.lower()}crossing{counter:04d}frame{frame_count:04d}.jpg')
+            if save_figures:
+                cv2.imwrite(clean_filename, vis_frame)
+            
+            # Save the debug frame with all visualization
+            debug_filename = os.path.join(debug_dir, f'{count_type.lower()}crossing{counter:04d}frame{frame_count:04d}_debug.jpg')
+            
+            # Add count information to the debug frame
+            info_text = f"Mitotic: {mitotic_count} | Non-Mitotic: {non_mitotic_count}"
+            cv2.putText(debug_frame, info_text, (10, 30), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+            
+            if save_figures:
+                cv2.imwrite(debug_filename, debug_frame)
+            print(f'{count_type} figure crossed the line! Count: {counter}. Frame: {frame_count}')
+            
+            # Store figure data for database
+            rel_path = os.path.relpath(clean_filename, settings.MEDIA_ROOT)
+            figures_data.append({
+                'image_path': rel_path,
+                'category': category,
+                'confidence': confidence,
+                'frame_number': frame_count,
+                'box': [int(v) for v in current_box],
+                # Hashed from the clean frame so duplicates from other rows can be found
+                'phash': phash(crop_box(frame, current_box))
+            })
         
-        # Remove objects that have disappeared for too long
-        for obj_id in object_ids_to_delete:
-            del objects_track[obj_id]
+        # Same frame through every shadow model
+        for shadow in shadows.values():
+            shadow_detections, shadow['frames_since_keyframe'], inferred = detect_frame(
+                shadow['detector'], frame, shadow['last_detections'], shadow['frames_since_keyframe']
+            )
+            shadow['inference_frames'] += inferred
+            shadow['last_detections'] = shadow_detections
+            for category, box, confidence in shadow['tracker'].update(shadow_detections):
+                shadow['figures'].append({
+                    'category': category,
+                    'confidence': confidence,
+                    'frame_number': frame_count,
+                    'box': [int(v) for v in box],
+                })
         
         # Draw tracking information (only on debug frame)
-        for obj_id, obj_data in objects_track.items():
+        for obj_id, obj_data in tracker.objects_track.items():
             if len(obj_data['positions']) > 0 and obj_data['disappeared'] < 3:
                 last_box = obj_data['positions'][-1]
                 x1, y1, x2, y2 = last_box
@@ -289,30 +527,89 @@ def process_video(video_path, model_path, analysis_id):
                     cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
         
         # Write the processed frame to output video
-        out.write(debug_frame)
+        if out is not None:
+            out.write(debug_frame)
         
         frame_count += 1
+        if progress is not None:
+            progress(frame_count, figures_data)
+        
+        # Close the segment and save state
+        if checkpoint_every and frame_count % checkpoint_every == 0:
+            if out is not None:
+                out.release()
+            save_checkpoint(analysis_id, {
+                'frame_count': frame_count,
+                'mitotic_count': mitotic_count,
+                'non_mitotic_count': non_mitotic_count,
+                **tracker.state(),
+                'figures_data': figures_data,
+                'last_detections': last_detections,
+                'frames_since_keyframe': frames_since_keyframe,
+                'inference_frames': inference_frames,
+                'shadows': {
+                    name: {
+                        **shadow['tracker'].state(),
+                        'last_detections': shadow['last_detections'],
+                        'frames_since_keyframe': shadow['frames_since_keyframe'],
+                        'inference_frames': shadow['inference_frames'],
+                        'figures': shadow['figures'],
+                    }
+                    for name, shadow in shadows.items()
+                },
+            }, shard)
+            out = open_segment(frame_count)
 
     print(f"Total counts:")
     print(f"- Mitotic figures: {mitotic_count}")
     print(f"- Non-mitotic figures: {non_mitotic_count}")
     print(f"- Total figures: {mitotic_count + non_mitotic_count}")
+    print(f"- Frames inferred: {inference_frames} of {frame_count}")
+    for name, shadow in shadows.items():
+        shadow_mitotic = sum(1 for f in shadow['figures'] if f['category'] == DetectedFigure.MITOTIC)
+        print(f"- Shadow {name}: {shadow_mitotic} mitotic, {len(shadow['figures']) - shadow_mitotic} non-mitotic")
     
     cap.release()
-    out.release()
+    if out is not None:
+        out.release()
+    
+    # Join the segments into the processed video, then drop the checkpoint
+    segments = sorted(
+        os.path.join(segments_dir, name) for name in os.listdir(segments_dir)
+        if int(name[len('segment_'):-len('.mp4')]) < frame_count
+    )
+    if write_video and shard is None:
+        from .tiff_scanner import concat_videos
+        concat_videos(segments, processed_video_path)
+    shutil.rmtree(segments_dir, ignore_errors=True)
+    clear_checkpoint(analysis_id, shard)
     
     results = {
         'mitotic_count': mitotic_count,
         'non_mitotic_count': non_mitotic_count,
         'total_count': mitotic_count + non_mitotic_count,
         'figures_data': figures_data,
-        'processed_video': os.path.relpath(processed_video_path, settings.MEDIA_ROOT)
+        'frame_count': frame_count,
+        'inference_frames': inference_frames,
+        'processed_video': os.path.relpath(processed_video_path, settings.MEDIA_ROOT) if write_video and shard is None else None,
+        'shadows': {
+            name: {
+                'mitotic_count': sum(1 for f in shadow['figures'] if f['category'] == DetectedFigure.MITOTIC),
+                'non_mitotic_count': sum(1 for f in shadow['figures'] if f['category'] == DetectedFigure.NON_MITOTIC),
+                'inference_frames': shadow['inference_frames'],
+                'figures': shadow['figures'],
+            }
+            for name, shadow in shadows.items()
+        },
     }
     
     return results
 
 def process_video_with_boxes(input_video_path, model_path, output_path):
     """Process video and add bounding boxes using YOLO model"""
+    import cv2
+    from ultralytics import YOLO
+
     # Load your YOLO model
     model = YOLO(model_path)
     
@@ -348,39 +645,49 @@ def process_video_with_boxes(input_video_path, model_path, output_path):
     
     return output_path
 
-def move_figure(figure_id, new_category):
-    try:
-        figure = DetectedFigure.objects.get(id=figure_id)
-        old_path = figure.image_file.path
-        old_category = figure.category
+def move_figure_file(figure, new_category):
+    """Move a figure's image into figures/<new_category>/ without touching the database.
 
-        if not os.path.exists(old_path):
-            print(f"Original file does not exist: {old_path}")
-            return False
+    Returns the new name relative to MEDIA_ROOT, or None if the file is missing.
+    """
+    old_path = figure.image_file.path
+
+    if not os.path.exists(old_path):
+        print(f"Original file does not exist: {old_path}")
+        return None
+
+    # Construct new path
+    filename = os.path.basename(old_path)
+    new_dir = os.path.join(settings.MEDIA_ROOT, 'figures', new_category)
+    os.makedirs(new_dir, exist_ok=True)
+
+    new_path = os.path.join(new_dir, filename)
 
-        # Construct new path
-        filename = os.path.basename(old_path)
-        new_dir = os.path.join(settings.MEDIA_ROOT, 'figures', new_category)
-        os.makedirs(new_dir, exist_ok=True)
+    # Prevent overwrite
+    if os.path.exists(new_path):
+        base, ext = os.path.splitext(filename)
+        count = 1
+        while os.path.exists(new_path):
+            new_filename = f"{base}_{count}{ext}"
+            new_path = os.path.join(new_dir, new_filename)
+            count += 1
 
-        new_path = os.path.join(new_dir, filename)
+    # Move file
+    shutil.move(old_path, new_path)
 
-        # Prevent overwrite
-        if os.path.exists(new_path):
-            base, ext = os.path.splitext(filename)
-            count = 1
-            while os.path.exists(new_path):
-                new_filename = f"{base}_{count}{ext}"
-                new_path = os.path.join(new_dir, new_filename)
-                count += 1
-            filename = os.path.basename(new_path)
+    relative_path = os.path.relpath(new_path, settings.MEDIA_ROOT)
+    return relative_path.replace("\\", "/")
 
-        # Move file
-        shutil.move(old_path, new_path)
+
+def move_figure(figure_id, new_category):
+    try:
+        figure = DetectedFigure.objects.get(id=figure_id)
+        new_name = move_figure_file(figure, new_category)
+        if new_name is None:
+            return False
 
         # Update database path
-        relative_path = os.path.relpath(new_path, settings.MEDIA_ROOT)
-        figure.image_file.name = relative_path.replace("\\", "/")
+        figure.image_file.name = new_name
         figure.category = new_category
         figure.save()
 
@@ -391,4 +698,4 @@ def move_figure(figure_id, new_category):
         return False
     except Exception as e:
         print(f"Error during move: {e}")
-        return False
\ No newline at end of file
+        return False
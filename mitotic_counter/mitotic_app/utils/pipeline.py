@@ -0,0 +1,372 @@
+# utils/pipeline.py
+import os
+import time
+from django.conf import settings
+from django.db import transaction
+from mitotic_app.models import Analysis, DetectedFigure
+from .mitotic_counter import load_checkpoint, process_video
+from .figure_hashes import group_duplicates, slide_position
+from .hpf_calculator import compute_mitotic_density_from_image
+from .job_budget import (
+    ADMITTED, OVER_BUDGET, acquire_with_budget, job_budget, limit_threads, wait_for_admission,
+)
+from .leases import LeaseHeartbeat, LeaseLost, holds_lease, new_owner, release_lease
+from .media_storage import compact_analysis, regenerate_artifacts
+from .progressive import RunningEstimate
+from .scan_plan import ScanPlan
+from .shadow_eval import shadow_models, store_shadow_results
+from .shards import (
+    ShardHeartbeat, claim_shard, complete_shard, fail_shard, loaded_detector,
+    merge_shard_results, plan_shards, sharded_progress, shards_failed, steal_shard,
+)
+from .tiff_metadata import read_tiff_header
+
+
+def scan_video_path(analysis):
+    return os.path.join(settings.MEDIA_ROOT, f'analysis_{analysis.id}', 'tiff_scan.mp4')
+
+
+def default_model_path():
+    return os.path.join(settings.BASE_DIR, 'model', 'best.pt')
+
+
+def run_analysis_exclusive(analysis, model_path=None, owner=None, wait=False):
+    """Run the pipeline only if this caller wins the analysis lease.
+
+    The lease is only taken when the node's JOB_BUDGET has room for the
+    slide; with wait=True the caller blocks until it does. Returns
+    (started, results). started is False when another request or worker
+    already owns a live run, or when the node is full and wait is False;
+    callers then just observe its progress.
+
+    A finished analysis queued again after its media was evicted only has
+    its processed video rebuilt; results is then True if that worked.
+    """
+    owner = owner or new_owner()
+    run_times = analysis.started_at, analysis.finished_at
+    if wait:
+        outcome = wait_for_admission(analysis, owner)
+    else:
+        outcome = acquire_with_budget(analysis, owner)
+    if outcome != ADMITTED:
+        if outcome == OVER_BUDGET:
+            print(f"Analysis {analysis.id} is waiting for CPU/memory budget")
+        return False, None
+
+    analysis.refresh_from_db()
+    limit_threads(job_budget()['threads_per_job'])
+    if analysis.media_evicted:
+        return True, regenerate_media(analysis, owner, run_times, model_path)
+    results = None
+    try:
+        with LeaseHeartbeat(analysis.id, owner) as heartbeat:
+            results = run_analysis(analysis, model_path=model_path, heartbeat=heartbeat)
+    except LeaseLost as e:
+        # The new owner finishes the run; releasing here would overwrite its status
+        print(e)
+        return True, None
+    except Exception as e:
+        release_lease(analysis.id, owner, Analysis.FAILED, str(e))
+        raise
+    if results:
+        release_lease(analysis.id, owner, Analysis.DONE)
+    else:
+        release_lease(analysis.id, owner, Analysis.FAILED, "Detection produced no results")
+    return True, results
+
+
+def regenerate_media(analysis, owner, run_times, model_path=None):
+    """Rebuild an evicted analysis's video under its lease. The analysis stays done either way"""
+    regenerated = False
+    try:
+        with LeaseHeartbeat(analysis.id, owner):
+            regenerated = regenerate_artifacts(analysis, model_path=model_path)
+    except Exception as e:
+        print(f"Error regenerating media of Analysis {analysis.id}: {e}")
+    release_lease(analysis.id, owner, Analysis.DONE, '' if regenerated else "Regenerating the processed video failed")
+    # Reports time the analysis itself, not the rebuild
+    started_at, finished_at = run_times
+    Analysis.objects.filter(id=analysis.id, lease_owner='').update(started_at=started_at, finished_at=finished_at)
+    return regenerated
+
+
+def detection_progress(analysis):
+    """Fraction of scan frames processed so far, from the last checkpoint(s)"""
+    if not analysis.estimated_frames:
+        return 0.0
+    scanned = sharded_progress(analysis)
+    if scanned is None:
+        state = load_checkpoint(analysis.id)
+        scanned = state['frame_count'] if state else 0
+    return min(1.0, scanned / analysis.estimated_frames)
+
+
+def run_analysis(analysis, model_path=None, heartbeat=None):
+    """Run the full scan -> HPF -> detection pipeline for an analysis.
+
+    An analysis whose scan video already exists resumes from its last
+    process_video checkpoint instead of starting over. With the heartbeat
+    of the run's lease, LeaseLost is raised between stages and nothing is
+    written once another worker has taken the analysis over.
+
+    Returns the results dict from process_video, or None if detection failed.
+    """
+    if model_path is None:
+        model_path = default_model_path()
+
+    # Create directory for this analysis
+    analysis_dir = os.path.join(settings.MEDIA_ROOT, f'analysis_{analysis.id}')
+    os.makedirs(analysis_dir, exist_ok=True)
+
+    video_path = scan_video_path(analysis)
+    if analysis.video_file and os.path.exists(video_path):
+        print(f"Scan video for Analysis {analysis.id} exists; resuming detection")
+    else:
+        video_path = scan_slide(analysis, analysis_dir)
+        if heartbeat:
+            heartbeat.check()
+
+    return detect_figures(analysis, video_path, model_path, heartbeat)
+
+
+def scan_slide(analysis, analysis_dir):
+    """Plan the scan, write the thumbnail and scan video and store HPF data"""
+    from .slide_reader import SlideReader
+    from .tiff_scanner import TIFFScanner
+
+    # Fix the scan plan up front so the scanner and HPF math agree
+    plan = analysis.scan_plan
+    if plan is None:
+        plan = ScanPlan.from_settings()
+        analysis.scan_plan = plan
+
+    # Header metadata is normally stored at upload time
+    if analysis.tiff_metadata is None:
+        analysis.set_tiff_metadata(read_tiff_header(analysis.uploaded_image.path))
+
+    # HPF data first: progressive scans sample HPF-sized blocks
+    layout = analysis.scan_layout
+    try:
+        print("Starting HPF calculation...")
+        hpf_data = compute_mitotic_density_from_image(
+            image_path=analysis.uploaded_image.path,
+            mitotic_count=0,  # Will be updated later after detection
+            scan_plan=plan,
+            metadata=analysis.tiff_metadata,
+            layout=layout
+        )
+
+        # Store HPF data in the analysis model
+        analysis.x_mpp = hpf_data['x_mpp']
+        analysis.y_mpp = hpf_data['y_mpp']
+        analysis.hpf_width_px, analysis.hpf_height_px = hpf_data['hpf_size']
+        analysis.total_hpfs = hpf_data['total_hpfs']
+        analysis.mitoses_per_10_hpf = 0  # Will be updated after figure detection
+        analysis.tumor_grade = 1  # Will be updated after figure detection
+        analysis.save()
+
+        print(f"HPF data saved to Analysis {analysis.id}: {hpf_data}")
+
+    except Exception as e:
+        print(f"Error calculating HPF data: {e}")
+        # Continue processing even if HPF calculation fails
+
+    samples = getattr(settings, 'PROGRESSIVE_SAMPLES', 0)
+    analysis.running_estimate = None
+    if samples and analysis.total_hpfs:
+        analysis.progressive_samples = samples
+        layout = analysis.scan_layout
+
+    estimate = plan.estimate(analysis.image_width, analysis.image_height, layout=layout)
+    analysis.estimated_frames = estimate['frames']
+    analysis.save()
+    print(f"Scan estimate for Analysis {analysis.id}: {estimate}")
+
+    # Slide overview comes from the coarsest pyramid level that is big enough
+    try:
+        reader = SlideReader(analysis.uploaded_image.path, mpp=analysis.x_mpp)
+        thumbnail_path = os.path.join(analysis_dir, 'thumbnail.jpg')
+        reader.thumbnail(getattr(settings, 'THUMBNAIL_SIZE', 1024)).save(thumbnail_path, quality=85)
+        analysis.thumbnail.name = os.path.relpath(thumbnail_path, settings.MEDIA_ROOT)
+        analysis.save()
+    except Exception as e:
+        print(f"Error creating slide thumbnail: {e}")
+
+    # Process the TIFF image (detection always runs on level 0), only where the ROI needs it
+    scanner = TIFFScanner(analysis.uploaded_image.path)
+    video_path = scanner.smooth_scan(output_dir=analysis_dir, plan=plan, layout=layout)
+
+    # Reference the scan video in place rather than saving a second copy under videos/
+    analysis.video_file.name = os.path.relpath(video_path, settings.MEDIA_ROOT)
+    analysis.save()
+    return video_path
+
+
+def detect_figures(analysis, video_path, model_path, heartbeat=None):
+    """Run (or resume) detection on the scan video and store its results"""
+    from .tiff_scanner import convert_to_mp4
+
+    plan = analysis.scan_plan
+    layout = analysis.scan_layout
+    scan_shift = plan.step_x if plan else 0
+    shadows = shadow_models()
+
+    # Progressive layouts publish a provisional grade as their samples come in
+    estimator = RunningEstimate(analysis, layout) if layout and layout.samples else None
+
+    if plan_shards(analysis):
+        # Large scans are split into row ranges that any worker can lease
+        results = run_shards(analysis, model_path)
+    else:
+        # Now process video to count mitotic/non-mitotic figures; shadow models share the decode
+        results = process_video(
+            video_path=video_path,
+            model_path=model_path,
+            analysis_id=analysis.id,
+            detector=loaded_detector(model_path),
+            scan_shift=scan_shift,
+            row_starts=layout.row_starts if layout else None,
+            write_video=getattr(settings, 'RENDER_PROCESSED_VIDEO', True),
+            shadow_detectors={name: loaded_detector(path) for name, path in shadows.items()},
+            end_frame=estimator.frame_limit if estimator else None,
+            progress=estimator.update if estimator else None
+        )
+
+    if not results:
+        return None
+    if heartbeat:
+        heartbeat.check()
+
+    if estimator:
+        estimator.update(results['frame_count'], results['figures_data'], force=True)
+        analysis.running_estimate = estimator.estimate  # Later saves must not write back the stale value
+        if results['frame_count'] < layout.frame_count and analysis.total_hpfs:
+            # Stopped once the grade was settled; densities cover the scanned cells only
+            scanned = layout.counted_cells_before(results['frame_count']) / layout.total_cells
+            analysis.total_hpfs = max(1, round(analysis.total_hpfs * scanned))
+            analysis.save(update_fields=['total_hpfs'])
+
+    safe_filename = None
+    if results['processed_video']:
+        # Path to raw mp4 from YOLO output
+        raw_video_path = os.path.join(settings.MEDIA_ROOT, results['processed_video'])
+
+        # Create new filename for safe browser-compatible mp4
+        base, _ = os.path.splitext(results['processed_video'])
+        safe_filename = f"{base}_browser.mp4"
+        safe_video_path = os.path.join(settings.MEDIA_ROOT, safe_filename)
+
+        # Convert using ffmpeg (even if it's mp4, we re-encode)
+        convert_to_mp4(raw_video_path, safe_video_path)
+
+    # Save detected figures to database; replace any left by an interrupted run
+    with transaction.atomic():
+        # Checked in the transaction that writes, so a takeover after the last renewal is caught too
+        if heartbeat and not holds_lease(analysis.id, heartbeat.owner):
+            raise LeaseLost(f"Lost lease on Analysis {analysis.id}; discarding its results")
+        analysis.figures.all().delete()
+        figures = []
+        for figure_data in results['figures_data']:
+            slide_x = slide_y = None
+            box = figure_data.get('box')
+            if layout:
+                slide_x, slide_y = slide_position(figure_data['frame_number'], layout, box)
+            figures.append(DetectedFigure(
+                analysis=analysis,
+                image_file=figure_data['image_path'],
+                category=figure_data['category'],
+                confidence=figure_data['confidence'],
+                frame_number=figure_data['frame_number'],
+                phash=figure_data.get('phash'),
+                slide_x=slide_x,
+                slide_y=slide_y,
+                box_width=box[2] - box[0] if box else None,
+                box_height=box[3] - box[1] if box else None
+            ))
+        # bulk_create skips DetectedFigure.save(), which would bump the version and redo the HPF math per
+        # figure; the version moves once here and update_hpf_analysis runs once below
+        DetectedFigure.objects.bulk_create(figures, batch_size=500)
+        analysis.bump_version()
+        store_shadow_results(analysis, results, shadows, scan_shift)
+        analysis.shards.all().delete()  # Their results now live in the figure rows
+
+    # The tracker can lose a cell between scan rows and count it again
+    groups = group_duplicates(analysis)
+    if groups:
+        print(f"Found {groups} groups of possible duplicate figures in Analysis {analysis.id}")
+
+    # Save the converted path to the model (empty when videos are disabled)
+    analysis.processed_video.name = safe_filename
+    analysis.save()
+
+    # Update HPF calculations with detected figures
+    if analysis.total_hpfs:
+        print("Updating HPF analysis with detected mitotic figures")
+        analysis.update_hpf_analysis()
+
+    # Intermediates are not needed once figures (and the browser video) exist
+    if getattr(settings, 'MEDIA_COMPACT_ON_COMPLETE', True):
+        freed = compact_analysis(analysis)
+        print(f"Compacted Analysis {analysis.id}: freed {freed} bytes")
+
+    return results
+
+
+def run_shard(shard, owner, model_path=None):
+    """Detect figures in one leased shard. Returns True if its results were stored"""
+    analysis = shard.analysis
+    plan = analysis.scan_plan
+    layout = analysis.scan_layout
+    shadows = shadow_models()
+    # The first shard holds the samples of a progressive layout; it publishes the running estimate
+    estimator = None
+    if layout.samples and shard.start_frame == 0:
+        estimator = RunningEstimate(analysis, layout, early_stop=False)
+    try:
+        with ShardHeartbeat(shard, owner) as heartbeat:
+            # Shard videos are not rendered; sharded analyses are reviewed in the slide viewer
+            results = process_video(
+                video_path=scan_video_path(analysis),
+                model_path=None,
+                analysis_id=analysis.id,
+                detector=loaded_detector(model_path or default_model_path()),
+                scan_shift=plan.step_x,
+                row_starts=layout.row_starts,
+                write_video=False,
+                shadow_detectors={name: loaded_detector(path) for name, path in shadows.items()},
+                start_frame=shard.start_frame,
+                end_frame=heartbeat.frame_limit,
+                shard=shard.id,
+                progress=estimator.update if estimator else None,
+            )
+    except Exception as e:
+        print(f"Error in {shard}: {e}")
+        fail_shard(shard, owner, str(e))
+        return False
+    if not results:
+        fail_shard(shard, owner, "Detection produced no results")
+        return False
+    return complete_shard(shard, owner, results)
+
+
+def run_shards(analysis, model_path=None):
+    """Work through an analysis's shards alongside any other workers, then merge them.
+
+    The caller holds the analysis lease. Once nothing is left to claim it
+    steals from stragglers, and otherwise waits for the other workers.
+    """
+    owner = new_owner()
+    poll_seconds = getattr(settings, 'SHARD_POLL_SECONDS', 5)
+    while True:
+        shard = claim_shard(owner, analysis.id) or steal_shard(owner, analysis.id)
+        if shard is not None:
+            run_shard(shard, owner, model_path)
+            continue
+        failed = shards_failed(analysis)
+        if failed is not None:
+            raise RuntimeError(f"{failed} failed: {failed.error_message or 'lease expired too often'}")
+        results = merge_shard_results(analysis)
+        if results is not None:
+            return results
+        time.sleep(poll_seconds)
+
@@ -0,0 +1,132 @@
+# utils/progressive.py
+import math
+import time
+from bisect import bisect_right
+from statistics import NormalDist
+from django.conf import settings
+from django.db.models import F
+from mitotic_app.models import Analysis, DetectedFigure
+from .hpf_calculator import get_tumor_grade
+
+GRADE_BOUNDS = (8, 15)  # Mitoses per 10 HPF where get_tumor_grade moves to the next grade
+
+
+def poisson_interval(count, z):
+    """Approximate two-sided interval for the mean of a Poisson count (Byar's method)"""
+    lower = 0.0
+    if count > 0:
+        lower = count * (1 - 1 / (9 * count) - z / (3 * math.sqrt(count))) ** 3
+    upper = (count + 1) * (1 - 1 / (9 * (count + 1)) + z / (3 * math.sqrt(count + 1))) ** 3
+    return max(0.0, lower), upper
+
+
+def grade_settled(low, high):
+    """Whether every density in [low, high] gets the same grade"""
+    return not any(low < bound <= high for bound in GRADE_BOUNDS)
+
+
+def running_estimate(layout, frame_count, mitotic_frames, total_hpfs, confidence=0.95):
+    """Provisional mitoses per 10 HPF after the first frame_count frames of a progressive layout.
+
+    mitotic_frames are the frame numbers of the mitotic crossings so far.
+    Mitoses already counted are exact; the cells not scanned yet are
+    extrapolated from the rate in the finished samples only, because the
+    row-by-row fill is spatially clustered. The interval is Poisson,
+    widened by the overdispersion between samples, and narrows to the exact
+    result as the scan completes. Areas are in units of total_hpfs, the
+    denominator the final result uses. Returns None before the first sample
+    is finished.
+    """
+    finished = [sample for sample in layout.samples if sample[1] <= frame_count]
+    if not finished or not layout.total_cells or not total_hpfs:
+        return None
+    frames = sorted(mitotic_frames)
+    hpfs_per_cell = total_hpfs / layout.total_cells
+
+    counts = [bisect_right(frames, end - 1) - bisect_right(frames, start - 1) for start, end, _ in finished]
+    areas = [cells * hpfs_per_cell for _, _, cells in finished]
+    sampled_count, sampled_area = sum(counts), sum(areas)
+    if not sampled_area:
+        return None
+    rate = sampled_count / sampled_area
+    dispersion = 1.0
+    if len(finished) > 1 and rate > 0:
+        chi2 = sum((c - rate * a) ** 2 / (rate * a) for c, a in zip(counts, areas) if a)
+        dispersion = max(1.0, chi2 / (len(finished) - 1))
+    z = NormalDist().inv_cdf((1 + confidence) / 2) * math.sqrt(dispersion)
+    low_count, high_count = poisson_interval(sampled_count, z)
+
+    counted = bisect_right(frames, frame_count - 1)
+    remaining = (layout.total_cells - layout.counted_cells_before(frame_count)) * hpfs_per_cell
+    density, low, high = (
+        (counted + r * remaining) / total_hpfs * 10
+        for r in (rate, low_count / sampled_area, high_count / sampled_area)
+    )
+    return {
+        'mitoses_per_10_hpf': round(density, 2),
+        'low': round(low, 2),
+        'high': round(high, 2),
+        'confidence': confidence,
+        'tumor_grade': get_tumor_grade(round(density, 2)),
+        'settled': grade_settled(low, high),
+        'samples': len(finished),
+        'sampled_hpfs': round(sampled_area, 2),
+        'scanned_fraction': round(1 - remaining / total_hpfs, 4),
+        'mitotic_counted': counted,
+    }
+
+
+class RunningEstimate:
+    """Publishes running_estimate to the analysis while process_video scans.
+
+    Pass update as process_video's progress callback and frame_limit as its
+    end_frame, then call update(..., force=True) with the final results.
+    The estimate is recomputed whenever a sample finishes and at most every
+    PROGRESSIVE_PUBLISH_SECONDS otherwise. With early_stop the scan ends
+    once all samples are in and the grade is settled.
+    """
+
+    def __init__(self, analysis, layout, end_frame=None, early_stop=None, confidence=None):
+        self.analysis_id = analysis.id
+        self.total_hpfs = analysis.total_hpfs
+        self.layout = layout
+        self.end_frame = end_frame if callable(end_frame) else (lambda: end_frame)
+        self.early_stop = getattr(settings, 'PROGRESSIVE_EARLY_STOP', False) if early_stop is None else early_stop
+        self.confidence = confidence or getattr(settings, 'PROGRESSIVE_CONFIDENCE', 0.95)
+        self.publish_seconds = getattr(settings, 'PROGRESSIVE_PUBLISH_SECONDS', 5)
+        self.sample_ends = {end for _, end, _ in layout.samples}
+        self.samples_end = max(self.sample_ends, default=0)
+        self.published_at = 0.0
+        self.estimate = None
+        self.stopped_at = None
+
+    def update(self, frame_count, figures_data, force=False):
+        if not self.layout.samples or frame_count < self.layout.samples[0][1]:
+            return
+        due = time.monotonic() - self.published_at >= self.publish_seconds
+        if not (force or due or frame_count in self.sample_ends):
+            return
+        mitotic_frames = [f['frame_number'] for f in figures_data if f['category'] == DetectedFigure.MITOTIC]
+        estimate = running_estimate(self.layout, frame_count, mitotic_frames, self.total_hpfs, self.confidence)
+        if estimate is None:
+            return
+        if self.early_stop and estimate['settled'] and frame_count >= self.samples_end:
+            estimate['stopped_early'] = frame_count < self.layout.frame_count
+            self.stopped_at = frame_count
+        self.publish(estimate)
+
+    def publish(self, estimate):
+        self.estimate = estimate
+        self.published_at = time.monotonic()
+        Analysis.objects.filter(id=self.analysis_id).update(running_estimate=estimate, version=F('version') + 1)
+        print(
+            f"Analysis {self.analysis_id} estimate after {estimate['samples']} samples: "
+            f"{estimate['mitoses_per_10_hpf']} per 10 HPF ({estimate['low']}-{estimate['high']}), "
+            f"grade {estimate['tumor_grade']}{' (settled)' if estimate['settled'] else ''}"
+        )
+
+    def frame_limit(self):
+        """end_frame for process_video: the caller's limit, or now once the grade is settled"""
+        if self.stopped_at is not None:
+            return self.stopped_at
+        return self.end_frame()
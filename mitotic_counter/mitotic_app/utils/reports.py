@@ -0,0 +1,78 @@
+# utils/reports.py
+import csv
+import json
+from datetime import datetime, time, timedelta
+from django.db.models import Count, Q
+from django.utils import timezone
+from mitotic_app.models import Analysis, DetectedFigure
+
+REPORT_FIELDS = [
+    'analysis_id', 'upload_date', 'status', 'source_path',
+    'mitotic_count', 'non_mitotic_count', 'discarded_count',
+    'total_hpfs', 'mitoses_per_10_hpf', 'tumor_grade',
+    'image_width', 'image_height', 'estimated_frames',
+    'started_at', 'finished_at', 'processing_seconds',
+]
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def report_queryset(start=None, end=None, ids=None):
+    """One row per analysis with its figure counts, from a single grouped query.
+
+    start and end are dates (inclusive) on upload_date; they become datetime
+    bounds so the upload_date index is used.
+    """
+    queryset = Analysis.objects.all()
+    if start is not None:
+        queryset = queryset.filter(upload_date__gte=day_start(start))
+    if end is not None:
+        queryset = queryset.filter(upload_date__lt=day_start(end + timedelta(days=1)))
+    if ids is not None:
+        queryset = queryset.filter(id__in=ids)
+    return queryset.annotate(
+        mitotic_count=Count('figures', filter=Q(figures__category=DetectedFigure.MITOTIC)),
+        non_mitotic_count=Count('figures', filter=Q(figures__category=DetectedFigure.NON_MITOTIC)),
+        discarded_count=Count('figures', filter=Q(figures__category=DetectedFigure.DISCARDED)),
+    ).values(
+        'id', 'upload_date', 'status', 'source_path',
+        'mitotic_count', 'non_mitotic_count', 'discarded_count',
+        'total_hpfs', 'mitoses_per_10_hpf', 'tumor_grade',
+        'image_width', 'image_height', 'estimated_frames',
+        'started_at', 'finished_at',
+    ).order_by('id')
+
+
+def report_rows(queryset, chunk_size=2000):
+    """Stream report rows; iterator() keeps memory flat however many analyses match"""
+    for row in queryset.iterator(chunk_size=chunk_size):
+        started, finished = row['started_at'], row['finished_at']
+        row['analysis_id'] = row.pop('id')
+        row['processing_seconds'] = round((finished - started).total_seconds(), 1) if started and finished else None
+        for key in ('upload_date', 'started_at', 'finished_at'):
+            row[key] = row[key].isoformat() if row[key] else None
+        yield {field: row[field] for field in REPORT_FIELDS}
+
+
+class Echo:
+    """File-like object whose write() returns the line, for streaming csv.writer output"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.DictWriter(Echo(), fieldnames=REPORT_FIELDS)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def json_chunks(rows):
+    """A JSON array written one analysis at a time"""
+    yield '['
+    for i, row in enumerate(rows):
+        yield (',\n' if i else '\n') + json.dumps(row)
+    yield '\n]\n'
@@ -0,0 +1,117 @@
+# utils/roi.py
+import json
+
+
+class ROIError(ValueError):
+    """An ROI that cannot be parsed or does not overlap the slide"""
+
+
+def parse_roi(data, image_width=None, image_height=None):
+    """Normalise an ROI to a list of polygons in level-0 pixels.
+
+    data is a JSON string or the decoded value: one shape or a list of
+    shapes. A shape is a list of [x, y] points (a polygon of at least three
+    points) or a rectangle {"x", "y", "width", "height"}. A {"shapes": [...]}
+    wrapper is accepted too. Returns None for an empty ROI, which means the
+    whole slide. Raises ROIError for anything else.
+    """
+    if isinstance(data, str):
+        if not data.strip():
+            return None
+        try:
+            data = json.loads(data)
+        except json.JSONDecodeError as e:
+            raise ROIError(f"ROI is not valid JSON: {e}")
+    if isinstance(data, dict) and 'shapes' in data:
+        data = data['shapes']
+    if not data:
+        return None
+    if isinstance(data, dict) or (isinstance(data, list) and data and is_point(data[0])):
+        data = [data]
+    if not isinstance(data, list):
+        raise ROIError("ROI must be a list of polygons or rectangles")
+
+    polygons = [shape_polygon(shape) for shape in data]
+    if image_width and image_height:
+        if not any(polygon_overlaps(polygon, 0, 0, image_width, image_height) for polygon in polygons):
+            raise ROIError("ROI does not overlap the slide")
+    return polygons
+
+
+def is_point(value):
+    return (
+        isinstance(value, (list, tuple)) and len(value) == 2
+        and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value)
+    )
+
+
+def shape_polygon(shape):
+    """One ROI shape as a list of [x, y] points"""
+    if isinstance(shape, dict):
+        try:
+            x, y = float(shape['x']), float(shape['y'])
+            width, height = float(shape['width']), float(shape['height'])
+        except (KeyError, TypeError, ValueError):
+            raise ROIError("Rectangles need numeric x, y, width and height")
+        if width <= 0 or height <= 0:
+            raise ROIError("Rectangles need a positive width and height")
+        return [[x, y], [x + width, y], [x + width, y + height], [x, y + height]]
+    if not isinstance(shape, list) or len(shape) < 3 or not all(is_point(p) for p in shape):
+        raise ROIError("Polygons need at least three [x, y] points")
+    if polygon_area(shape) == 0:
+        raise ROIError("Polygons must enclose an area")
+    return [[float(x), float(y)] for x, y in shape]
+
+
+def polygon_area(polygon):
+    """Shoelace area in square pixels"""
+    total = 0.0
+    for (x1, y1), (x2, y2) in zip(polygon, polygon[1:] + polygon[:1]):
+        total += x1 * y2 - x2 * y1
+    return abs(total) / 2
+
+
+def band_intervals(polygon, top, bottom):
+    """x intervals of the part of a polygon between two horizontal lines.
+
+    The projection of a region onto the x axis is the projection of its
+    boundary, which inside the band is made of clipped polygon edges and of
+    the stretches of the two band lines that lie inside the polygon.
+    """
+    intervals = []
+    edges = list(zip(polygon, polygon[1:] + polygon[:1]))
+    for (x1, y1), (x2, y2) in edges:
+        if max(y1, y2) < top or min(y1, y2) > bottom:
+            continue
+        if y1 == y2:
+            intervals.append((min(x1, x2), max(x1, x2)))
+            continue
+        # Clip the edge to the band
+        t1 = (max(top, min(y1, y2)) - y1) / (y2 - y1)
+        t2 = (min(bottom, max(y1, y2)) - y1) / (y2 - y1)
+        xa, xb = x1 + t1 * (x2 - x1), x1 + t2 * (x2 - x1)
+        intervals.append((min(xa, xb), max(xa, xb)))
+    for line in (top, bottom):
+        crossings = sorted(
+            x1 + (line - y1) * (x2 - x1) / (y2 - y1)
+            for (x1, y1), (x2, y2) in edges
+            if (y1 <= line < y2) or (y2 <= line < y1)
+        )
+        intervals.extend(zip(crossings[::2], crossings[1::2]))
+    return merge_intervals(intervals)
+
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def polygon_overlaps(polygon, left, top, right, bottom):
+    """Whether a polygon intersects an axis-aligned rectangle"""
+    return any(a <= right and b >= left for a, b in band_intervals(polygon, top, bottom))
+
@@ -0,0 +1,236 @@
+# utils/scan_plan.py
+import math
+from bisect import bisect_left, bisect_right
+
+
+class ScanPlan:
+    """Window size and strides used to sweep a slide into video frames.
+
+    process_video counts figures as they cross the vertical centre line, so
+    consecutive frames must overlap by at least half a window horizontally.
+    """
+
+    def __init__(self, window_width=256, window_height=256, step_x=20, step_y=250):
+        if window_width <= 0 or window_height <= 0:
+            raise ValueError("Window size must be positive")
+        if not 0 < step_x <= window_width // 2:
+            raise ValueError("step_x must be between 1 and half the window width")
+        if not 0 < step_y <= window_height:
+            raise ValueError("step_y must be between 1 and the window height")
+        self.window_width = int(window_width)
+        self.window_height = int(window_height)
+        self.step_x = int(step_x)
+        self.step_y = int(step_y)
+
+    def __repr__(self):
+        return (f"ScanPlan(window={self.window_width}x{self.window_height}, "
+                f"step_x={self.step_x}, step_y={self.step_y})")
+
+    def __eq__(self, other):
+        return isinstance(other, ScanPlan) and self.as_dict() == other.as_dict()
+
+    @classmethod
+    def for_model(cls, input_size=640, overlap_x=0.9, overlap_y=0.1):
+        """Square windows matching the model input, with fractional overlaps"""
+        step_x = max(1, int(input_size * (1 - overlap_x)))
+        step_y = max(1, int(input_size * (1 - overlap_y)))
+        return cls(input_size, input_size, step_x, step_y)
+
+    @classmethod
+    def from_settings(cls):
+        from django.conf import settings
+        return cls(**getattr(settings, 'SCAN_PLAN', {}))
+
+    @property
+    def window_size(self):
+        return (self.window_width, self.window_height)
+
+    def as_dict(self):
+        return {
+            'window_width': self.window_width,
+            'window_height': self.window_height,
+            'step_x': self.step_x,
+            'step_y': self.step_y,
+        }
+
+    def x_positions(self, image_width):
+        return range(0, image_width - self.window_width + 1, self.step_x)
+
+    def y_positions(self, image_height):
+        return range(0, image_height - self.window_height + 1, self.step_y)
+
+    def frame_count(self, image_width, image_height):
+        return len(self.x_positions(image_width)) * len(self.y_positions(image_height))
+
+    def layout(self, image_width, image_height, roi=None):
+        """The ScanLayout for a slide, restricted to roi polygons when given"""
+        return ScanLayout.for_roi(self, image_width, image_height, roi)
+
+    def estimate(self, image_width, image_height, seconds_per_frame=None, roi=None, layout=None):
+        """Up-front estimate of frames and inference time for a slide.
+
+        The detector resizes every frame to its input size, so cost scales
+        with the number of frames rather than with window area. layout
+        overrides the default one (e.g. a progressive layout).
+        """
+        if seconds_per_frame is None:
+            from django.conf import settings
+            seconds_per_frame = getattr(settings, 'SCAN_SECONDS_PER_FRAME', 0.1)
+        if layout is None:
+            layout = self.layout(image_width, image_height, roi)
+        frames = layout.frame_count
+        return {
+            'frames': frames,
+            'rows': len({y for y, _, _ in layout.runs}),
+            'estimated_seconds': int(math.ceil(frames * seconds_per_frame)),
+        }
+
+
+class ScanLayout:
+    """Which windows of a ScanPlan are scanned, and in what order.
+
+    The scan is a list of runs (y, first_column, columns), each sweeping
+    consecutive windows of one row from left to right; frame numbers run
+    through the runs in order. A frame counts the crossings in the step_x
+    wide cell just left of its centre line, and the first frame of a run
+    counts nothing because the tracker has not seen the content before.
+
+    The full-slide layout has one run per row. With an ROI only the cells
+    that intersect its polygons are kept, each run of them preceded by one
+    lead-in frame. A progressive layout (see progressive()) scans the same
+    cells in a different order and lists its samples as
+    (start_frame, end_frame, cells).
+    """
+
+    def __init__(self, plan, image_width, image_height, runs=None, roi=None, samples=None):
+        self.plan = plan
+        self.image_width = image_width
+        self.image_height = image_height
+        self.columns = len(plan.x_positions(image_width))
+        self.roi = roi or None
+        if runs is None:
+            runs = [(y, 0, self.columns) for y in plan.y_positions(image_height)]
+        self.runs = [tuple(run) for run in runs if run[2] > 0]
+        self.samples = samples or []
+        self.row_starts = []
+        self.cells_before_run = []
+        frames = cells = 0
+        for _, _, columns in self.runs:
+            self.row_starts.append(frames)
+            self.cells_before_run.append(cells)
+            frames += columns
+            cells += columns - 1
+        self.frame_count = frames
+        self.total_cells = cells
+
+    @classmethod
+    def for_roi(cls, plan, image_width, image_height, roi=None):
+        """The runs covering every cell that intersects one of the roi polygons"""
+        if not roi:
+            return cls(plan, image_width, image_height)
+        from .roi import band_intervals, merge_intervals
+
+        columns = len(plan.x_positions(image_width))
+        # Column j counts crossings at slide x in (line - step_x, line] with line = j * step_x + width / 2
+        line = plan.window_width / 2
+        runs = []
+        for y in plan.y_positions(image_height):
+            cells = []
+            for polygon in roi:
+                # Inset by half a pixel so a region merely touching the row does not pull it in
+                for left, right in band_intervals(polygon, y + 0.5, y + plan.step_y - 0.5):
+                    first = max(0, math.ceil((left - line) / plan.step_x))
+                    last = min(columns - 1, math.floor((right - line) / plan.step_x) + 1)
+                    if first <= last:
+                        # One lead-in frame primes the tracker before the first counted cell
+                        cells.append((max(0, first - 1), last))
+            for first, last in merge_intervals([(a, b + 1) for a, b in cells]):
+                runs.append((y, first, last - first))
+        return cls(plan, image_width, image_height, runs, roi)
+
+    def progressive(self, samples, hpf_width, hpf_height):
+        """The same cells, reordered so samples spread-out HPF-sized blocks are scanned first.
+
+        Every counted cell belongs to the block holding its row top and its
+        counting line. Blocks at least half as full as the fullest one are
+        candidates, and samples of them are taken evenly spaced in row-major
+        order. Each block row becomes a run with its own lead-in frame; the
+        cells left over are then scanned row by row.
+        """
+        step_x, step_y, line = self.plan.step_x, self.plan.step_y, self.plan.window_width / 2
+        counted = {}
+        for y, first, columns in self.runs:
+            counted.setdefault(y, []).extend(range(first + 1, first + columns))
+
+        blocks = {}
+        for y, cells in counted.items():
+            for column in cells:
+                block = (y // hpf_height, int((column * step_x + line) // hpf_width))
+                blocks.setdefault(block, {}).setdefault(y, []).append(column)
+        if not blocks or samples <= 0:
+            return self
+        fullest = max(sum(len(c) for c in rows.values()) for rows in blocks.values())
+        candidates = sorted(
+            block for block, rows in blocks.items() if 2 * sum(len(c) for c in rows.values()) >= fullest
+        )
+        chosen = [candidates[int((i + 0.5) * len(candidates) / samples)] for i in range(min(samples, len(candidates)))]
+
+        def column_runs(y, columns):
+            """Runs of consecutive counted columns, each with a lead-in frame"""
+            runs = []
+            for column in sorted(columns):
+                if runs and runs[-1][1] + runs[-1][2] == column:
+                    runs[-1] = (y, runs[-1][1], runs[-1][2] + 1)
+                else:
+                    runs.append((y, column - 1, 2))
+            return runs
+
+        runs, sample_ranges, sampled = [], [], set()
+        frames = 0
+        for block in chosen:
+            start, cells = frames, 0
+            for y, columns in sorted(blocks[block].items()):
+                for run in column_runs(y, columns):
+                    runs.append(run)
+                    frames += run[2]
+                    cells += run[2] - 1
+                sampled.update((y, column) for column in columns)
+            sample_ranges.append((start, frames, cells))
+        for y in sorted(counted):
+            runs.extend(column_runs(y, [c for c in counted[y] if (y, c) not in sampled]))
+        return ScanLayout(self.plan, self.image_width, self.image_height, runs, self.roi, sample_ranges)
+
+    def counted_cells_before(self, frame_number):
+        """Counted cells fully scanned by the first frame_number frames"""
+        if frame_number <= 0 or not self.runs:
+            return 0
+        index = bisect_right(self.row_starts, min(frame_number, self.frame_count) - 1) - 1
+        scanned = min(frame_number, self.frame_count) - self.row_starts[index]
+        return self.cells_before_run[index] + scanned - 1
+
+    def run_index(self, frame_number):
+        if not 0 <= frame_number < self.frame_count:
+            raise IndexError(f"Frame {frame_number} is outside the scan")
+        return bisect_right(self.row_starts, frame_number) - 1
+
+    def window(self, frame_number):
+        """Level-0 (x, y) of the top-left corner of a frame's window"""
+        index = self.run_index(frame_number)
+        y, first, _ = self.runs[index]
+        return (first + frame_number - self.row_starts[index]) * self.plan.step_x, y
+
+    def windows(self):
+        """Every window's (x, y) in scan order"""
+        for y, first, columns in self.runs:
+            for column in range(first, first + columns):
+                yield column * self.plan.step_x, y
+
+    def next_row_start(self, frame_number):
+        """The first run boundary at or after frame_number (frame_count past the last)"""
+        index = bisect_left(self.row_starts, frame_number)
+        return self.row_starts[index] if index < len(self.row_starts) else self.frame_count
+
+    def counted_area(self):
+        """Square pixels of the cells whose crossings the scan counts"""
+        cells = sum(columns - 1 for _, _, columns in self.runs)
+        return cells * self.plan.step_x * self.plan.step_y
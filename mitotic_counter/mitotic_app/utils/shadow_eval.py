@@ -0,0 +1,86 @@
+# utils/shadow_eval.py
+from django.conf import settings
+from mitotic_app.models import DetectedFigure, ShadowResult
+from .hpf_calculator import get_tumor_grade, mitoses_per_10_hpf
+
+
+def shadow_models():
+    """Configured shadow models as {name: model_path}"""
+    return dict(getattr(settings, 'SHADOW_MODELS', {}))
+
+
+def match_crossings(primary, shadow, scan_shift, max_frames=None, iou_threshold=0.3):
+    """Pair crossings of the same cell counted by both models.
+
+    Crossings are dicts with frame_number and box. A cell counted a few
+    frames apart by the two models has moved scan_shift pixels per frame in
+    between, so the shadow box is moved back before comparing. Category is
+    ignored here; the report compares it on the matched pairs.
+    """
+    from .detectors import box_iou
+
+    if max_frames is None:
+        max_frames = getattr(settings, 'SHADOW_MATCH_FRAMES', 2)
+    unmatched = list(shadow)
+    pairs = []
+    for figure in primary:
+        best, best_iou = None, 0.0
+        for candidate in unmatched:
+            offset = candidate['frame_number'] - figure['frame_number']
+            if abs(offset) > max_frames:
+                continue
+            x1, y1, x2, y2 = candidate['box']
+            moved = (x1 + offset * scan_shift, y1, x2 + offset * scan_shift, y2)
+            iou = box_iou(figure['box'], moved)
+            if iou >= iou_threshold and iou > best_iou:
+                best, best_iou = candidate, iou
+        if best is not None:
+            unmatched.remove(best)
+            pairs.append((figure, best))
+    return pairs
+
+
+def agreement_report(primary, shadow, scan_shift, total_hpfs=None):
+    """How far a shadow model's crossings agree with the primary model's on one slide"""
+    pairs = match_crossings(primary, shadow, scan_shift)
+    same_category = sum(1 for a, b in pairs if a['category'] == b['category'])
+    primary_mitotic = sum(1 for f in primary if f['category'] == DetectedFigure.MITOTIC)
+    shadow_mitotic = sum(1 for f in shadow if f['category'] == DetectedFigure.MITOTIC)
+    report = {
+        'primary_figures': len(primary),
+        'shadow_figures': len(shadow),
+        'matched': len(pairs),
+        'primary_only': len(primary) - len(pairs),
+        'shadow_only': len(shadow) - len(pairs),
+        # Share of the primary's crossings the shadow also counted, and the reverse
+        'recall': round(len(pairs) / len(primary), 4) if primary else 1.0,
+        'precision': round(len(pairs) / len(shadow), 4) if shadow else 1.0,
+        'category_agreement': round(same_category / len(pairs), 4) if pairs else 1.0,
+        'mitotic_delta': shadow_mitotic - primary_mitotic,
+    }
+    if total_hpfs:
+        primary_grade = get_tumor_grade(round(mitoses_per_10_hpf(primary_mitotic, total_hpfs), 2))
+        shadow_grade = get_tumor_grade(round(mitoses_per_10_hpf(shadow_mitotic, total_hpfs), 2))
+        report['grade_agrees'] = primary_grade == shadow_grade
+    return report
+
+
+def store_shadow_results(analysis, results, models, scan_shift):
+    """Replace the analysis's ShadowResult rows with the shadows of this run"""
+    analysis.shadow_results.all().delete()
+    for name, shadow in results.get('shadows', {}).items():
+        density = grade = None
+        if analysis.total_hpfs:
+            density = round(mitoses_per_10_hpf(shadow['mitotic_count'], analysis.total_hpfs), 2)
+            grade = get_tumor_grade(density)
+        ShadowResult.objects.create(
+            analysis=analysis,
+            name=name,
+            model_path=models.get(name, ''),
+            mitotic_count=shadow['mitotic_count'],
+            non_mitotic_count=shadow['non_mitotic_count'],
+            inference_frames=shadow['inference_frames'],
+            mitoses_per_10_hpf=density,
+            tumor_grade=grade,
+            agreement=agreement_report(results['figures_data'], shadow['figures'], scan_shift, analysis.total_hpfs),
+        )
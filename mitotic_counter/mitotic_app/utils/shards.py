@@ -0,0 +1,290 @@
+# utils/shards.py
+import math
+from functools import lru_cache
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from mitotic_app.models import Analysis, AnalysisShard, DetectedFigure
+from .leases import LeaseHeartbeat, lease_ttl
+from .mitotic_counter import load_checkpoint
+
+
+def shard_frames():
+    """Target scan frames per shard, or None when analyses run in one piece"""
+    return getattr(settings, 'ANALYSIS_SHARD_FRAMES', None)
+
+
+def max_attempts():
+    return getattr(settings, 'SHARD_MAX_ATTEMPTS', 3)
+
+
+@lru_cache(maxsize=4)
+def loaded_detector(model_path):
+    """Detectors stay loaded between the analyses and shards a worker process runs"""
+    from .detectors import get_detector
+
+    return get_detector(model_path)
+
+
+def plan_shards(analysis, target_frames=None):
+    """The analysis's shards, creating them on first use.
+
+    Shards cover whole scan rows (runs of the ScanLayout), about
+    target_frames frames each, so no track spans two shards. Returns []
+    when the scan fits in one shard.
+    """
+    existing = list(analysis.shards.order_by('start_frame'))
+    if existing:
+        return existing
+    target = target_frames or shard_frames()
+    layout = analysis.scan_layout
+    if not target or not layout:
+        return []
+    total = layout.frame_count
+    if total <= target:
+        return []
+    starts = [0]
+    for start, run_end in zip(layout.row_starts, layout.row_starts[1:] + [total]):
+        # Cut before a row when the shard is closer to the target without it than with it
+        size = start - starts[-1]
+        if size and abs(size - target) <= abs(run_end - starts[-1] - target):
+            starts.append(start)
+    # Racing coordinators may both plan; the (analysis, start_frame) constraint keeps one set
+    AnalysisShard.objects.bulk_create([
+        AnalysisShard(analysis=analysis, start_frame=start, end_frame=end)
+        for start, end in zip(starts, starts[1:] + [total])
+    ], ignore_conflicts=True)
+    return list(analysis.shards.order_by('start_frame'))
+
+
+def claimable_shards():
+    """Shards no live worker owns: pending, or running with an expired lease, with attempts left"""
+    now = timezone.now()
+    return (
+        Q(status=AnalysisShard.PENDING) | Q(status=AnalysisShard.RUNNING, lease_expires_at__lt=now)
+    ) & Q(attempts__lt=max_attempts())
+
+
+def acquire_shard(shard_id, owner):
+    """Atomically lease a shard for owner. False if another worker got it first"""
+    now = timezone.now()
+    claimed = AnalysisShard.objects.filter(claimable_shards(), id=shard_id).update(
+        status=AnalysisShard.RUNNING,
+        lease_owner=owner,
+        lease_expires_at=now + lease_ttl(),
+        heartbeat_at=now,
+        attempts=F('attempts') + 1,
+        started_at=now,
+    )
+    return claimed == 1
+
+
+def claim_shard(owner, analysis_id=None):
+    """Lease the next claimable shard of a running analysis, oldest analysis first"""
+    candidates = AnalysisShard.objects.filter(claimable_shards(), analysis__status=Analysis.RUNNING)
+    if analysis_id is not None:
+        candidates = candidates.filter(analysis_id=analysis_id)
+    for shard_id in candidates.order_by('analysis_id', 'start_frame').values_list('id', flat=True)[:20]:
+        if acquire_shard(shard_id, owner):
+            return AnalysisShard.objects.select_related('analysis').get(id=shard_id)
+    return None
+
+
+def renew_shard(shard_id, owner):
+    """Extend a shard lease. Returns the shard's current end_frame, or None if the lease was lost"""
+    now = timezone.now()
+    renewed = AnalysisShard.objects.filter(id=shard_id, status=AnalysisShard.RUNNING, lease_owner=owner).update(
+        lease_expires_at=now + lease_ttl(),
+        heartbeat_at=now,
+    )
+    if renewed != 1:
+        return None
+    return AnalysisShard.objects.filter(id=shard_id).values_list('end_frame', flat=True).first()
+
+
+class ShardHeartbeat(LeaseHeartbeat):
+    """Keeps a shard lease alive and picks up a lowered end_frame after a steal"""
+
+    def __init__(self, shard, owner):
+        super().__init__(shard.analysis_id, owner)
+        self.shard_id = shard.id
+        self.end_frame = shard.end_frame
+
+    def renew(self):
+        end_frame = renew_shard(self.shard_id, self.owner)
+        if end_frame is None:
+            return False
+        self.end_frame = end_frame
+        return True
+
+    def describe(self):
+        return f"shard {self.shard_id} of Analysis {self.analysis_id}"
+
+    def frame_limit(self):
+        """end_frame for process_video: stop at once when the lease is gone"""
+        return 0 if self.lost else self.end_frame
+
+
+def trim_results(results, end_frame):
+    """The part of a process_video result a shard keeps: crossings before end_frame.
+
+    A worker only learns that its tail was stolen at its next heartbeat, so
+    it may have scanned a little past the new end; the thief counts those rows.
+    """
+    return {
+        'figures_data': [f for f in results['figures_data'] if f['frame_number'] < end_frame],
+        'inference_frames': results['inference_frames'],
+        'shadows': {
+            name: {
+                'figures': [f for f in shadow['figures'] if f['frame_number'] < end_frame],
+                'inference_frames': shadow['inference_frames'],
+            }
+            for name, shadow in results.get('shadows', {}).items()
+        },
+    }
+
+
+def complete_shard(shard, owner, results):
+    """Store a finished shard's results if owner still holds it. False if the lease was lost"""
+    while True:
+        end_frame = AnalysisShard.objects.filter(id=shard.id).values_list('end_frame', flat=True).first()
+        # Conditional on end_frame so a steal between the read and the write is not missed
+        done = AnalysisShard.objects.filter(
+            id=shard.id, status=AnalysisShard.RUNNING, lease_owner=owner, end_frame=end_frame,
+        ).update(
+            status=AnalysisShard.DONE,
+            results=trim_results(results, end_frame),
+            lease_owner='',
+            lease_expires_at=None,
+            finished_at=timezone.now(),
+        )
+        if done:
+            return True
+        if not AnalysisShard.objects.filter(id=shard.id, status=AnalysisShard.RUNNING, lease_owner=owner).exists():
+            print(f"Lost lease on shard {shard.id} of Analysis {shard.analysis_id}; discarding its results")
+            return False
+
+
+def fail_shard(shard, owner, error_message):
+    """Hand a shard back for another attempt, or mark it failed once attempts run out"""
+    AnalysisShard.objects.filter(id=shard.id, lease_owner=owner).update(
+        status=AnalysisShard.PENDING,
+        lease_owner='',
+        lease_expires_at=None,
+        error_message=error_message[:2000],
+    )
+    AnalysisShard.objects.filter(
+        id=shard.id, status=AnalysisShard.PENDING, attempts__gte=max_attempts()
+    ).update(status=AnalysisShard.FAILED, finished_at=timezone.now())
+
+
+def shard_progress(shard):
+    """First frame the shard's worker has not checkpointed yet"""
+    state = load_checkpoint(shard.analysis_id, shard.id)
+    return max(shard.start_frame, state['frame_count']) if state else shard.start_frame
+
+
+def steal_shard(owner, analysis_id=None):
+    """Split the largest unscanned tail of a running shard and lease the back half.
+
+    Progress is read from the owner's checkpoint on the shared media
+    filesystem; the split falls on the scan row nearest halfway through the
+    frames left. The owner sees the lowered end_frame at its next heartbeat.
+    Returns the new shard, or None if no tail is worth taking.
+    """
+    min_frames = getattr(settings, 'SHARD_STEAL_MIN_FRAMES', 500)
+    running = AnalysisShard.objects.filter(
+        status=AnalysisShard.RUNNING, lease_expires_at__gte=timezone.now(), analysis__status=Analysis.RUNNING,
+    ).select_related('analysis')
+    if analysis_id is not None:
+        running = running.filter(analysis_id=analysis_id)
+
+    best = None
+    for shard in running:
+        layout = shard.analysis.scan_layout
+        if not layout:
+            continue
+        next_row = layout.next_row_start(shard_progress(shard))
+        split = layout.next_row_start(math.ceil((next_row + shard.end_frame) / 2))
+        stolen = shard.end_frame - split
+        if split > next_row and stolen >= min_frames and (best is None or stolen > best[2]):
+            best = (shard, split, stolen)
+    if best is None:
+        return None
+
+    shard, split, _ = best
+    now = timezone.now()
+    with transaction.atomic():
+        lowered = AnalysisShard.objects.filter(
+            id=shard.id, status=AnalysisShard.RUNNING, end_frame=shard.end_frame,
+        ).update(end_frame=split)
+        if lowered != 1:
+            return None  # It finished or someone else stole first
+        stolen_shard = AnalysisShard.objects.create(
+            analysis=shard.analysis,
+            start_frame=split,
+            end_frame=shard.end_frame,
+            status=AnalysisShard.RUNNING,
+            lease_owner=owner,
+            lease_expires_at=now + lease_ttl(),
+            heartbeat_at=now,
+            attempts=1,
+            started_at=now,
+        )
+    print(f"Stole frames {split}-{shard.end_frame} of Analysis {shard.analysis_id} from shard {shard.id}")
+    return stolen_shard
+
+
+def shards_failed(analysis):
+    """A shard that ran out of attempts, or None"""
+    return analysis.shards.filter(
+        Q(status=AnalysisShard.FAILED) | Q(status=AnalysisShard.PENDING, attempts__gte=max_attempts())
+        | Q(status=AnalysisShard.RUNNING, lease_expires_at__lt=timezone.now(), attempts__gte=max_attempts())
+    ).first()
+
+
+def merge_shard_results(analysis):
+    """Combine finished shards into one process_video-style result, or None if any range is missing"""
+    shards = list(analysis.shards.order_by('start_frame'))
+    position = 0
+    for shard in shards:
+        if shard.status != AnalysisShard.DONE or shard.start_frame != position:
+            return None
+        position = shard.end_frame
+
+    figures_data = [figure for shard in shards for figure in shard.results['figures_data']]
+    mitotic_count = sum(1 for f in figures_data if f['category'] == DetectedFigure.MITOTIC)
+    shadows = {}
+    for shard in shards:
+        for name, shadow in shard.results['shadows'].items():
+            merged = shadows.setdefault(name, {'figures': [], 'inference_frames': 0})
+            merged['figures'].extend(shadow['figures'])
+            merged['inference_frames'] += shadow['inference_frames']
+    for shadow in shadows.values():
+        shadow['mitotic_count'] = sum(1 for f in shadow['figures'] if f['category'] == DetectedFigure.MITOTIC)
+        shadow['non_mitotic_count'] = len(shadow['figures']) - shadow['mitotic_count']
+    return {
+        'mitotic_count': mitotic_count,
+        'non_mitotic_count': len(figures_data) - mitotic_count,
+        'total_count': len(figures_data),
+        'figures_data': figures_data,
+        'frame_count': position,
+        'inference_frames': sum(shard.results['inference_frames'] for shard in shards),
+        'processed_video': None,
+        'shadows': shadows,
+    }
+
+
+def sharded_progress(analysis):
+    """Frames scanned so far across all shards, or None for an unsharded analysis"""
+    shards = list(analysis.shards.all())
+    if not shards:
+        return None
+    scanned = 0
+    for shard in shards:
+        if shard.status == AnalysisShard.DONE:
+            scanned += shard.end_frame - shard.start_frame
+        elif shard.status == AnalysisShard.RUNNING:
+            scanned += min(shard.end_frame, shard_progress(shard)) - shard.start_frame
+    return scanned
@@ -0,0 +1,214 @@
+# utils/slide_reader.py
+import numpy as np
+from PIL import Image
+from .tiff_metadata import max_slide_pixels, read_ifds
+
+try:
+    import tifffile
+except ImportError:  # Pyramids stored in SubIFDs (OME-TIFF) need tifffile
+    tifffile = None
+
+# Pages whose aspect ratio differs more than this from the base page are
+# label/macro images, not pyramid levels
+ASPECT_TOLERANCE = 0.02
+
+
+class SlideLevel:
+    def __init__(self, index, width, height, downsample, page=None):
+        self.index = index
+        self.width = width
+        self.height = height
+        self.downsample = downsample
+        self.page = page  # Page in the IFD chain, or None for tifffile series levels
+
+    def __repr__(self):
+        return f"SlideLevel({self.index}, {self.width}x{self.height}, downsample={self.downsample:.2f})"
+
+
+class SlideReader:
+    """Multi-resolution access to plain, pyramidal and OME-TIFF slides.
+
+    Level 0 is always the full-resolution image used for detection. Overview
+    consumers ask for the coarsest level that still satisfies their
+    microns-per-pixel (or pixel size) requirement.
+    """
+
+    def __init__(self, slide_path, mpp=None):
+        self.slide_path = str(slide_path)
+        self.mpp = mpp  # Level 0 microns per pixel, if known
+        self.levels = self._tifffile_levels() if tifffile is not None else []
+        if len(self.levels) < 2:
+            # Plain multi-page pyramid: each level is its own page in the IFD chain
+            self.levels = self._page_levels()
+
+    def _tifffile_levels(self):
+        with tifffile.TiffFile(self.slide_path) as tif:
+            series = tif.series[0]
+            levels = []
+            for index, level in enumerate(series.levels):
+                axes = level.axes
+                width, height = level.shape[axes.index('X')], level.shape[axes.index('Y')]
+                levels.append((width, height))
+        return self._build_levels(levels, pillow_pages=False)
+
+    def _page_levels(self):
+        with open(self.slide_path, 'rb') as f:
+            pages = [(tags.get(256), tags.get(257)) for _, tags in read_ifds(f)]
+        return self._build_levels(pages, pillow_pages=True)
+
+    def _build_levels(self, sizes, pillow_pages):
+        base_w, base_h = sizes[0]
+        levels = [SlideLevel(0, base_w, base_h, 1.0, page=0)]
+        for page, (width, height) in enumerate(sizes[1:], start=1):
+            if not width or not height or width >= levels[-1].width:
+                continue
+            if abs(width / height - base_w / base_h) > ASPECT_TOLERANCE * (base_w / base_h):
+                continue
+            levels.append(SlideLevel(len(levels), width, height, base_w / width,
+                                     page=page if pillow_pages else None))
+        return levels
+
+    @property
+    def dimensions(self):
+        return (self.levels[0].width, self.levels[0].height)
+
+    def level_for_mpp(self, target_mpp):
+        """Coarsest level whose resolution is at least target_mpp"""
+        if not self.mpp:
+            raise ValueError("Slide resolution unknown; use level_for_size instead")
+        return self.level_for_downsample(target_mpp / self.mpp)
+
+    def level_for_downsample(self, downsample):
+        best = self.levels[0]
+        for level in self.levels:
+            if level.downsample <= downsample * (1 + ASPECT_TOLERANCE):
+                best = level
+        return best
+
+    def level_for_size(self, max_size):
+        """Coarsest level that is still at least max_size pixels on its long side"""
+        return self.level_for_downsample(max(self.dimensions) / max_size)
+
+    def read_level(self, level):
+        """Read a whole level as an RGB PIL image"""
+        if tifffile is None:
+            Image.MAX_IMAGE_PIXELS = max_slide_pixels()
+            with Image.open(self.slide_path) as img:
+                img.seek(level.page)
+                return img.convert('RGB')
+
+        with tifffile.TiffFile(self.slide_path) as tif:
+            if level.page is not None:
+                source = tif.pages[level.page]
+            else:
+                source = tif.series[0].levels[level.index]
+            array, axes = source.asarray(), source.axes
+
+        # Normalise to height x width x samples
+        if 'S' not in axes and 'C' in axes:
+            array = np.moveaxis(array, axes.index('C'), -1)
+        elif 'S' in axes and axes.index('S') != len(axes) - 1:
+            array = np.moveaxis(array, axes.index('S'), -1)
+        return rgb_image(array.reshape(level.height, level.width, -1))
+
+    def read_region(self, level, box, step=1):
+        """Read box = (left, top, right, bottom) of a level as an RGB PIL image.
+
+        Only the TIFF tiles or strips overlapping the box are read and
+        decoded (for uncompressed strips, only the rows inside it), so a
+        small region of a huge level-0 raster stays small in memory. With
+        step > 1 only every step-th row and column is kept, each segment
+        being thinned as it is decoded. Layouts this does not handle (no
+        tifffile, separate sample planes, levels spread over several pages)
+        fall back to cropping read_level.
+        """
+        left, top = max(0, box[0]), max(0, box[1])
+        right, bottom = min(level.width, box[2]), min(level.height, box[3])
+        if tifffile is not None:
+            with tifffile.TiffFile(self.slide_path) as tif:
+                page = self._level_page(tif, level)
+                if page is not None and page.planarconfig == 1 and page.shaped[:2] == (1, 1):
+                    return rgb_image(read_segments(tif.filehandle, page, (left, top, right, bottom), step))
+        region = self.read_level(level).crop((left, top, right, bottom))
+        return region.reduce(step) if step > 1 else region
+
+    def _level_page(self, tif, level):
+        """The single TiffPage holding a level, or None"""
+        if level.page is not None:
+            return tif.pages[level.page]
+        pages = tif.series[0].levels[level.index].pages
+        return pages[0] if len(pages) == 1 else None
+
+    def read_overview(self, target_mpp=None, max_size=None):
+        """Read the cheapest level satisfying target_mpp or max_size, then resize to fit"""
+        if target_mpp is not None:
+            level = self.level_for_mpp(target_mpp)
+            image = self.read_level(level)
+            scale = level.downsample * self.mpp / target_mpp
+        else:
+            level = self.level_for_size(max_size)
+            image = self.read_level(level)
+            scale = max_size / max(image.size)
+        if scale < 1:
+            image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))),
+                                 Image.LANCZOS)
+        return image
+
+    def thumbnail(self, max_size=1024):
+        return self.read_overview(max_size=max_size)
+
+
+def read_segments(fh, page, box, step=1):
+    """Pixels of box from a contiguous TiffPage, as height x width x samples, keeping every step-th row and column"""
+    left, top, right, bottom = box
+    samples = page.shaped[-1]
+    out = np.zeros((-(-(bottom - top) // step), -(-(right - left) // step), samples), dtype=page.dtype)
+    if page.is_tiled:
+        segment_w, segment_h = page.tilewidth, page.tilelength
+    else:
+        segment_w, segment_h = page.imagewidth, min(page.rowsperstrip or page.imagelength, page.imagelength)
+    across = -(-page.imagewidth // segment_w)
+    raw_rows = not page.is_tiled and page.compression == 1 and page.predictor == 1 and page.dtype.itemsize == 1
+
+    for row in range(top // segment_h, (bottom - 1) // segment_h + 1):
+        y = row * segment_h
+        # First kept row at or after the segment's top
+        y0, y1 = top + -(-(max(top, y) - top) // step) * step, min(bottom, y + segment_h, page.imagelength)
+        if y0 >= y1:
+            continue  # Every row of this strip is stepped over
+        for col in range(left // segment_w, (right - 1) // segment_w + 1):
+            x = col * segment_w
+            x0, x1 = left + -(-(max(left, x) - left) // step) * step, min(right, x + segment_w, page.imagewidth)
+            index = row * across + col
+            offset, count = page.dataoffsets[index], page.databytecounts[index]
+            if x0 >= x1 or not count:
+                continue  # Every column stepped over, or a sparse file whose segment was never written
+            if raw_rows:
+                # Uncompressed rows can be read on their own
+                row_bytes = page.imagewidth * samples
+                fh.seek(offset + (y0 - y) * row_bytes)
+                segment = np.frombuffer(fh.read((y1 - y0) * row_bytes), dtype=page.dtype)
+                segment = segment.reshape(y1 - y0, page.imagewidth, samples)
+                segment_y = y0
+            else:
+                fh.seek(offset)
+                segment, _, _ = page.decode(fh.read(count), index, jpegtables=page.jpegtables)
+                segment = segment.reshape(segment.shape[-3:])
+                segment_y = y
+            out[(y0 - top) // step:(y1 - top - 1) // step + 1, (x0 - left) // step:(x1 - left - 1) // step + 1] = \
+                segment[y0 - segment_y:y1 - segment_y:step, x0 - x:x1 - x:step]
+    return out
+
+
+def rgb_image(array):
+    """A height x width x samples array as an 8-bit RGB PIL image"""
+    if array.shape[2] == 1:
+        array = np.repeat(array, 3, axis=2)
+    array = array[..., :3]
+    if array.dtype.kind == 'f':
+        # Float samples are nominally 0-1
+        array = np.clip(array, 0, 1) * 255
+    elif array.dtype.kind in 'iu' and array.dtype.itemsize > 1:
+        # Keep the high byte of 16/32-bit samples; a plain cast would wrap them modulo 256
+        array = (array.astype(np.int64) - np.iinfo(array.dtype).min) >> (8 * (array.dtype.itemsize - 1))
+    return Image.fromarray(np.ascontiguousarray(array).astype(np.uint8))
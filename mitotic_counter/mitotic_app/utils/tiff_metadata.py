@@ -0,0 +1,175 @@
+# utils/tiff_metadata.py
+import struct
+
+# Tag ids we care about, named as in the TIFF spec
+TAGS = {
+    256: "ImageWidth",
+    257: "ImageLength",
+    258: "BitsPerSample",
+    259: "Compression",
+    262: "PhotometricInterpretation",
+    277: "SamplesPerPixel",
+    282: "XResolution",
+    283: "YResolution",
+    284: "PlanarConfiguration",
+    296: "ResolutionUnit",
+    322: "TileWidth",
+    323: "TileLength",
+}
+
+# Compression schemes Pillow can decode
+SUPPORTED_COMPRESSION = {
+    1: "none",
+    5: "lzw",
+    7: "jpeg",
+    8: "deflate",
+    32773: "packbits",
+    32946: "deflate",
+}
+
+# (struct code, size in bytes) per TIFF field type
+FIELD_TYPES = {
+    1: ('B', 1), 2: ('c', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8),
+    6: ('b', 1), 7: ('B', 1), 8: ('h', 2), 9: ('i', 4), 10: ('ii', 8),
+    11: ('f', 4), 12: ('d', 8), 16: ('Q', 8), 17: ('q', 8), 18: ('Q', 8),
+}
+
+
+# Header parsing never reads more than this per tag or directory, whatever the counts claim
+MAX_TAG_BYTES = 64 * 1024
+MAX_IFD_ENTRIES = 4096
+
+
+class TiffHeaderError(ValueError):
+    pass
+
+
+def max_slide_pixels():
+    """settings.TIFF_MAX_PIXELS: the largest level 0 TIFFScanner can decode into memory"""
+    from django.conf import settings
+    return getattr(settings, 'TIFF_MAX_PIXELS', None)
+
+
+def _read_value(f, byte_order, field_type, count, value_bytes, bigtiff):
+    code, size = FIELD_TYPES[field_type]
+    total = size * count
+    if total > MAX_TAG_BYTES:
+        raise TiffHeaderError(f"TIFF tag data too large ({total} bytes)")
+    inline = 8 if bigtiff else 4
+    if total > inline:
+        offset = struct.unpack(byte_order + ('Q' if bigtiff else 'I'), value_bytes)[0]
+        position = f.tell()
+        f.seek(offset)
+        data = f.read(total)
+        f.seek(position)
+    else:
+        data = value_bytes[:total]
+    if len(data) < total:
+        raise TiffHeaderError("Truncated TIFF tag data")
+
+    values = struct.unpack(byte_order + code * count, data)
+    if field_type in (5, 10):  # RATIONAL / SRATIONAL
+        values = [n / d if d else 0.0 for n, d in zip(values[::2], values[1::2])]
+    return values[0] if count == 1 else tuple(values)
+
+
+def read_ifds(f):
+    """Yield (offset, tags) for every IFD (page) in a TIFF, reading headers only"""
+    f.seek(0)
+    header = f.read(16)
+    if header[:2] == b'II':
+        byte_order = '<'
+    elif header[:2] == b'MM':
+        byte_order = '>'
+    else:
+        raise TiffHeaderError("Not a TIFF file")
+
+    version = struct.unpack(byte_order + 'H', header[2:4])[0]
+    if version == 42:
+        bigtiff = False
+        offset = struct.unpack(byte_order + 'I', header[4:8])[0]
+    elif version == 43:
+        bigtiff = True
+        offset = struct.unpack(byte_order + 'Q', header[8:16])[0]
+    else:
+        raise TiffHeaderError("Not a TIFF file")
+
+    count_fmt, entry_size, next_fmt = ('Q', 20, 'Q') if bigtiff else ('H', 12, 'I')
+    seen = set()
+    while offset and offset not in seen:
+        seen.add(offset)
+        f.seek(offset)
+        raw = f.read(struct.calcsize(count_fmt))
+        if len(raw) < struct.calcsize(count_fmt):
+            raise TiffHeaderError("Truncated TIFF directory")
+        entries = struct.unpack(byte_order + count_fmt, raw)[0]
+        if entries > MAX_IFD_ENTRIES:
+            raise TiffHeaderError(f"TIFF directory has too many entries ({entries})")
+        block = f.read(entries * entry_size + struct.calcsize(next_fmt))
+        if len(block) < entries * entry_size + struct.calcsize(next_fmt):
+            raise TiffHeaderError("Truncated TIFF directory")
+
+        tags = {}
+        for i in range(entries):
+            entry = block[i * entry_size:(i + 1) * entry_size]
+            if bigtiff:
+                tag, field_type, count = struct.unpack(byte_order + 'HHQ', entry[:12])
+                value_bytes = entry[12:20]
+            else:
+                tag, field_type, count = struct.unpack(byte_order + 'HHI', entry[:8])
+                value_bytes = entry[8:12]
+            if field_type not in FIELD_TYPES or count == 0:
+                continue
+            # Only decode small tags; strip/tile offset tables can be huge
+            if tag in TAGS or (count == 1 and FIELD_TYPES[field_type][1] <= 8):
+                tags[tag] = _read_value(f, byte_order, field_type, count, value_bytes, bigtiff)
+            else:
+                tags[tag] = None
+
+        yield offset, tags
+        offset = struct.unpack(byte_order + next_fmt, block[entries * entry_size:])[0]
+
+
+def read_tiff_header(f):
+    """Parse the first page of a TIFF without decoding any pixels.
+
+    f is a path or a binary file object positioned anywhere. Returns a dict
+    keyed by TIFF tag names (ImageWidth, ImageLength, XResolution, ...).
+    """
+    if isinstance(f, (str, bytes)) or hasattr(f, '__fspath__'):
+        with open(f, 'rb') as handle:
+            return read_tiff_header(handle)
+
+    for _, tags in read_ifds(f):
+        metadata = {name: tags.get(tag) for tag, name in TAGS.items()}
+        metadata["Tiled"] = metadata["TileWidth"] is not None
+        return metadata
+    raise TiffHeaderError("TIFF has no image directories")
+
+
+def validate_tiff_header(metadata, max_pixels=None):
+    """Raise TiffHeaderError if a parsed header describes a slide we cannot process.
+
+    max_pixels defaults to max_slide_pixels().
+    """
+    if max_pixels is None:
+        max_pixels = max_slide_pixels()
+    width, height = metadata.get("ImageWidth"), metadata.get("ImageLength")
+    if not width or not height:
+        raise TiffHeaderError("TIFF is missing its image dimensions")
+    if max_pixels and width * height > max_pixels:
+        raise TiffHeaderError(f"TIFF is too large ({width}x{height} exceeds {max_pixels} pixels)")
+
+    compression = metadata.get("Compression") or 1
+    if compression not in SUPPORTED_COMPRESSION:
+        raise TiffHeaderError(f"Unsupported TIFF compression: {compression}")
+
+    if metadata.get("Tiled"):
+        tile_w, tile_h = metadata.get("TileWidth"), metadata.get("TileLength")
+        if not tile_w or not tile_h or tile_w % 16 or tile_h % 16:
+            raise TiffHeaderError("TIFF tile size must be a positive multiple of 16")
+
+    unit = metadata.get("ResolutionUnit")
+    if metadata.get("XResolution") is not None and unit not in (None, 1, 2, 3):
+        raise TiffHeaderError(f"Invalid TIFF ResolutionUnit: {unit}")
+    return metadata
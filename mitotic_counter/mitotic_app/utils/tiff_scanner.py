@@ -4,6 +4,8 @@ import cv2
 import numpy as np
 from pathlib import Path
 from PIL import Image
+from .scan_plan import ScanPlan
+from .tiff_metadata import max_slide_pixels, read_tiff_header, validate_tiff_header
 
 class TIFFScanner:
     def __init__(self, slide_path):
@@ -11,13 +13,27 @@ class TIFFScanner:
         if path.suffix.lower() not in ['.tif', '.tiff']:
             raise ValueError("Only TIFF formats are supported")
 
+        # Level 0 is decoded whole on the first crop; refuse slides too large for that
+        # before Pillow reads anything
+        validate_tiff_header(read_tiff_header(slide_path))
+        Image.MAX_IMAGE_PIXELS = max_slide_pixels()
+
+        # Frame 0 is the full-resolution level in both pyramidal TIFF and OME-TIFF;
+        # overview levels are read through SlideReader instead
         self.slide = Image.open(slide_path)
         self.dimensions = self.slide.size
 
-    def smooth_scan(self, output_dir, window_size=(256, 256), speed=20):
-        print(f"Scanning with window size {window_size}")
-        x_steps = np.arange(0, self.dimensions[0] - window_size[0] + 1, speed)
-        y_steps = np.arange(0, self.dimensions[1] - window_size[1] + 1, speed * 12.5)
+    def smooth_scan(self, output_dir, plan=None, layout=None):
+        """Write the scan windows to tiff_scan.mp4, one frame per window.
+
+        layout (a ScanLayout) chooses the windows, e.g. only those covering
+        an ROI; by default every window of plan is scanned row by row.
+        """
+        if layout is None:
+            layout = (plan or ScanPlan()).layout(*self.dimensions)
+        plan = layout.plan
+        window_size = plan.window_size
+        print(f"Scanning with {plan}" + (f", {layout.frame_count} frames in the ROI" if layout.roi else ""))
 
         # Prepare output directories
         video_path = os.path.join(output_dir, "tiff_scan.mp4")
@@ -26,18 +42,14 @@ class TIFFScanner:
         # Initialize video writer
         out = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), 30.0, window_size)
 
-        frame_count = 0
-        for step_y, y in enumerate(y_steps):
-            for step_x, x in enumerate(x_steps):
-                frame_count += 1
+        for x, y in layout.windows():
+            region = self.slide.crop((
+                int(x), int(y),
+                int(x + window_size[0]), int(y + window_size[1])
+            ))
 
-                region = self.slide.crop((
-                    int(x), int(y),
-                    int(x + window_size[0]), int(y + window_size[1])
-                ))
-
-                frame = cv2.cvtColor(np.array(region), cv2.COLOR_RGB2BGR)
-                out.write(frame)
+            frame = cv2.cvtColor(np.array(region), cv2.COLOR_RGB2BGR)
+            out.write(frame)
 
         out.release()
         print(f"Saved video to {video_path}")
@@ -52,4 +64,24 @@ def convert_to_mp4(input_path, output_path):
         .output(output_path, vcodec='libx264', crf=23, pix_fmt='yuv420p')
         .overwrite_output()
         .run()
-    )
\ No newline at end of file
+    )
+
+def concat_videos(segment_paths, output_path):
+    """Join mp4 segments written with the same codec and size without re-encoding"""
+    if len(segment_paths) == 1:
+        os.replace(segment_paths[0], output_path)
+        return
+    list_path = output_path + '.segments.txt'
+    with open(list_path, 'w') as f:
+        for path in segment_paths:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+    try:
+        (
+            ffmpeg
+            .input(list_path, format='concat', safe=0)
+            .output(output_path, c='copy')
+            .overwrite_output()
+            .run()
+        )
+    finally:
+        os.remove(list_path)
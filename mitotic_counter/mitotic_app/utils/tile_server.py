@@ -0,0 +1,148 @@
+# utils/tile_server.py
+import math
+import os
+import threading
+from functools import lru_cache
+from django.conf import settings
+
+# Deep Zoom (DZI) layout as read by OpenSeadragon
+TILE_SIZE = 254
+TILE_OVERLAP = 1
+TILE_FORMAT = 'jpeg'
+
+# A tile that would need more source pixels than this per tile pixel (no
+# pyramid level close enough) is built from the tiles of the next finer
+# Deep Zoom level when those can be read directly, and otherwise thinned
+# straight from the source segments, so a request renders at most four
+# other tiles and decodes each source segment under it at most once
+MAX_SOURCE_FACTOR = 4
+
+
+def max_level(width, height):
+    """Deep Zoom level at which the image is full size (level 0 is 1x1)"""
+    return int(math.ceil(math.log2(max(width, height, 1))))
+
+
+def level_dimensions(width, height, level):
+    scale = 2 ** (max_level(width, height) - level)
+    return max(1, math.ceil(width / scale)), max(1, math.ceil(height / scale))
+
+
+def dzi_xml(width, height):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{TILE_FORMAT}" '
+        f'Overlap="{TILE_OVERLAP}" TileSize="{TILE_SIZE}">'
+        f'<Size Width="{width}" Height="{height}"/></Image>\n'
+    )
+
+
+def tiles_dir(analysis):
+    return os.path.join(settings.MEDIA_ROOT, f'analysis_{analysis.id}', 'tiles')
+
+
+@lru_cache(maxsize=8)
+def _reader(path, mtime):
+    from .slide_reader import SlideReader  # numpy and tifffile, only once a tile is rendered
+
+    return SlideReader(path)
+
+
+def tile_bounds(width, height, level, col, row):
+    """Pixel box of a tile within its Deep Zoom level, including overlap"""
+    level_w, level_h = level_dimensions(width, height, level)
+    if col < 0 or row < 0 or col * TILE_SIZE >= level_w or row * TILE_SIZE >= level_h:
+        raise ValueError("Tile out of range")
+    x0 = col * TILE_SIZE - (TILE_OVERLAP if col else 0)
+    y0 = row * TILE_SIZE - (TILE_OVERLAP if row else 0)
+    x1 = min(level_w, (col + 1) * TILE_SIZE + TILE_OVERLAP)
+    y1 = min(level_h, (row + 1) * TILE_SIZE + TILE_OVERLAP)
+    return x0, y0, x1, y1
+
+
+def render_tile(analysis, level, col, row):
+    """Path of a cached tile, rendering it from the uploaded slide on first use.
+
+    Tiles are read from the nearest pyramid level at or above their
+    resolution, decoding only the TIFF tiles or strips they overlap. Where
+    that level is too fine, the tile is downsampled from the four tiles
+    below it if those read the source directly, or else from every few
+    source pixels. Raises ValueError for tiles outside the pyramid.
+    """
+    path = os.path.join(tiles_dir(analysis), str(level), f'{col}_{row}.{TILE_FORMAT}')
+    if os.path.exists(path):
+        return path
+    from PIL import Image
+
+    width, height = analysis.image_width, analysis.image_height
+    if level < 0 or level > max_level(width, height):
+        raise ValueError("Level out of range")
+    x0, y0, x1, y1 = tile_bounds(width, height, level, col, row)
+
+    slide_path = analysis.uploaded_image.path
+    reader = _reader(slide_path, os.path.getmtime(slide_path))
+    scale = 2 ** (max_level(width, height) - level)  # Level-0 pixels per tile pixel
+    source = reader.level_for_downsample(scale)
+    factor = scale / source.downsample
+
+    if MAX_SOURCE_FACTOR < factor <= 2 * MAX_SOURCE_FACTOR:
+        tile = finer_tiles(analysis, level, (x0, y0, x1, y1))
+    else:
+        # Never recurse further than that: on a slide without a pyramid it would render every finer tile.
+        # Keep about two source pixels per tile pixel for the resize below to filter
+        step = max(1, int(factor / 2)) if factor > MAX_SOURCE_FACTOR else 1
+        tile = reader.read_region(source, (
+            int(x0 * factor), int(y0 * factor),
+            min(source.width, max(int(x0 * factor) + 1, int(round(x1 * factor)))),
+            min(source.height, max(int(y0 * factor) + 1, int(round(y1 * factor)))),
+        ), step)
+    if tile.size != (x1 - x0, y1 - y0):
+        tile = tile.resize((x1 - x0, y1 - y0), Image.LANCZOS)
+
+    # Concurrent requests for the same tile each write their own file; the last rename wins
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    tile.save(tmp_path, format='JPEG', quality=getattr(settings, 'TILE_JPEG_QUALITY', 85))
+    os.replace(tmp_path, path)
+    return path
+
+
+def finer_tiles(analysis, level, bounds):
+    """The pixels of bounds on a level, pasted together from the next level's tiles (twice the size)"""
+    from PIL import Image
+
+    width, height = analysis.image_width, analysis.image_height
+    finer_w, finer_h = level_dimensions(width, height, level + 1)
+    left, top = bounds[0] * 2, bounds[1] * 2
+    right, bottom = min(finer_w, bounds[2] * 2), min(finer_h, bounds[3] * 2)
+    canvas = Image.new('RGB', (right - left, bottom - top))
+    for row in range(top // TILE_SIZE, (bottom - 1) // TILE_SIZE + 1):
+        for col in range(left // TILE_SIZE, (right - 1) // TILE_SIZE + 1):
+            tile_x, tile_y, _, _ = tile_bounds(width, height, level + 1, col, row)
+            with Image.open(render_tile(analysis, level + 1, col, row)) as tile:
+                canvas.paste(tile, (tile_x - left, tile_y - top))
+    return canvas
+
+
+def figure_overlay(analysis):
+    """Detected figures as boxes in level-0 slide pixels"""
+    figures = analysis.figures.exclude(slide_x__isnull=True).only(
+        'id', 'analysis_id', 'category', 'confidence', 'frame_number', 'slide_x', 'slide_y',
+        'box_width', 'box_height', 'duplicate_of',
+    ).order_by('frame_number', 'id')
+    default_size = getattr(settings, 'OVERLAY_DEFAULT_BOX_PX', 48)  # Figures indexed without a box
+    overlay = []
+    for figure in figures:
+        box_w, box_h = figure.box_width or default_size, figure.box_height or default_size
+        overlay.append({
+            'id': figure.id,
+            'category': figure.category,
+            'confidence': figure.confidence,
+            'frame_number': figure.frame_number,
+            'x': figure.slide_x - box_w // 2,
+            'y': figure.slide_y - box_h // 2,
+            'width': box_w,
+            'height': box_h,
+            'duplicate_of': figure.duplicate_of_id,
+        })
+    return overlay
@@ -0,0 +1,48 @@
+# utils/warmup.py
+import sys
+import time
+
+# Modules the web process should never need to import; the inference stack
+# (detectors, scanner, video) pulls them in lazily
+HEAVY_MODULES = ('torch', 'ultralytics', 'onnxruntime', 'cv2', 'ffmpeg', 'numpy', 'PIL', 'tifffile')
+
+
+def heavy_modules_loaded():
+    """The HEAVY_MODULES this process has imported so far"""
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+
+def warm_up(model_path=None, plan=None):
+    """Import the inference stack, load the models and run one dummy inference.
+
+    Workers call this before claiming work so the first slide does not pay
+    for imports, weight loading and the first, slowest, model call (lazy
+    initialisation in the backend and on the GPU). The detectors stay in
+    shards.loaded_detector, where the pipeline picks them up. Returns the
+    seconds spent on each step.
+    """
+    timings = {'heavy_modules_before': heavy_modules_loaded()}
+
+    started = time.perf_counter()
+    import numpy as np
+    from . import detectors, tiff_scanner  # cv2, ffmpeg and PIL come with these
+    from .pipeline import default_model_path
+    from .scan_plan import ScanPlan
+    from .shadow_eval import shadow_models
+    from .shards import loaded_detector
+    timings['import_seconds'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    paths = [model_path or default_model_path(), *shadow_models().values()]
+    loaded = [loaded_detector(path) for path in paths]
+    timings['load_seconds'] = time.perf_counter() - started
+
+    # A blank window of the scan size goes down the same path as a real frame
+    plan = plan or ScanPlan.from_settings()
+    frame = np.full((plan.window_height, plan.window_width, 3), 255, dtype=np.uint8)
+    started = time.perf_counter()
+    for detector in loaded:
+        detector.detect(frame)
+    timings['inference_seconds'] = time.perf_counter() - started
+    timings['models'] = len(loaded)
+    return timings
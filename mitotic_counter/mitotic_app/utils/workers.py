@@ -0,0 +1,77 @@
+# utils/workers.py
+import time
+from django.conf import settings
+from django.db import connections
+from mitotic_app.models import Analysis
+from .job_budget import job_budget, limit_threads
+from .leases import claimable, new_owner
+from .pipeline import run_analysis_exclusive, run_shard
+from .shards import claim_shard, steal_shard
+from .warmup import warm_up as warm_up_models
+
+
+def work_once(owner, model_path=None):
+    """Do one unit of work. Returns False when there was nothing to do.
+
+    Shards of running analyses come first so started slides finish soonest,
+    then queued (or abandoned) analyses, whose lease makes this worker their
+    coordinator, and last the tails of straggling shards.
+    """
+    shard = claim_shard(owner)
+    if shard is not None:
+        run_shard(shard, owner, model_path)
+        return True
+
+    for analysis in Analysis.objects.filter(claimable()).order_by('upload_date')[:10]:
+        try:
+            started, _ = run_analysis_exclusive(analysis, model_path=model_path)
+        except Exception as e:
+            started = True
+            print(f"Error running {analysis}: {e}")
+        if started:
+            return True
+
+    shard = steal_shard(owner)
+    if shard is not None:
+        run_shard(shard, owner, model_path)
+        return True
+    return False
+
+
+def run_worker(model_path=None, poll_seconds=None, exit_when_idle=False, stop=None, warm_up=None):
+    """Claim and run work from the database until stopped.
+
+    Any number of workers on any number of hosts can run this against the
+    same database and media filesystem. With exit_when_idle the worker
+    returns once no analysis is queued or running. stop is an optional
+    threading.Event. With warm_up (default settings.WORKER_WARM_UP) the
+    models are loaded and run once before the first claim. Returns the
+    number of work units done.
+    """
+    if poll_seconds is None:
+        poll_seconds = getattr(settings, 'WORKER_POLL_SECONDS', 5)
+    if warm_up is None:
+        warm_up = getattr(settings, 'WORKER_WARM_UP', True)
+    owner = new_owner()
+    limit_threads(job_budget()['threads_per_job'])
+    if warm_up:
+        timings = warm_up_models(model_path)
+        print(
+            f"Worker {owner} warmed up {timings['models']} models: imports {timings['import_seconds']:.2f}s, "
+            f"load {timings['load_seconds']:.2f}s, first inference {timings['inference_seconds']:.2f}s"
+        )
+    print(f"Worker {owner} started")
+    done = 0
+    try:
+        while stop is None or not stop.is_set():
+            if work_once(owner, model_path):
+                done += 1
+                continue
+            # Other workers may still be scanning a slide whose shards are not planned yet
+            if exit_when_idle and not Analysis.objects.filter(status__in=[Analysis.QUEUED, Analysis.RUNNING]).exists():
+                break
+            time.sleep(poll_seconds)
+    finally:
+        connections.close_all()
+    print(f"Worker {owner} finished after {done} work units")
+    return done
@@ -3,21 +3,32 @@ import os
 import zipfile
 import tempfile
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.conf import settings
-from django.core.files import File
+from django.core.paginator import Paginator
+from django.db.models import Count, F
 from django.urls import reverse
 from .models import Analysis, DetectedFigure
-from .forms import TiffUploadForm
-from .utils.tiff_scanner import TIFFScanner
-from .utils.mitotic_counter import process_video, process_video_with_boxes, move_figure
-from .utils.tiff_scanner import convert_to_mp4
-from .utils.hpf_calculator import compute_mitotic_density_from_image, get_tumor_grade
+from .forms import ROIForm, TiffUploadForm
+from .utils.figure_hashes import merge_duplicates
+from .utils.mitotic_counter import move_figure
+from .utils.pipeline import detection_progress, run_analysis_exclusive
+from .utils.media_storage import touch
+from .utils.api import (
+    after_figure_cursor, analysis_json, decode_cursor, encode_cursor, figure_json, make_api_etag, parse_limit,
+)
+from .utils.tile_server import dzi_xml, figure_overlay, render_tile
+from .utils.reports import csv_lines, json_chunks, report_queryset, report_rows
 
 
 from django.template.loader import render_to_string
 import io
+import mimetypes
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date
+from django.utils.http import http_date, parse_http_date_safe
 from django.utils.text import slugify
+from .utils.media_serving import RangedFile, make_etag, media_path, parse_range
 
 def download_hpf_report(request, analysis_id):
     analysis = get_object_or_404(Analysis, id=analysis_id)
@@ -30,157 +41,199 @@ def download_hpf_report(request, analysis_id):
     return response
 
 
+def export_reports(request):
+    """Stream counts, HPF metrics and timing for many analyses as CSV or JSON.
+
+    Query parameters: format (csv or json), start and end (YYYY-MM-DD, on
+    the upload date, inclusive) and ids (comma-separated analysis ids).
+    """
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in ('csv', 'json'):
+        return HttpResponse("format must be csv or json", status=400)
+    try:
+        start, end = [
+            parse_date(request.GET[key]) if request.GET.get(key) else None for key in ('start', 'end')
+        ]
+        if (start is None and request.GET.get('start')) or (end is None and request.GET.get('end')):
+            raise ValueError("Dates must be YYYY-MM-DD")
+        ids = [int(i) for i in request.GET['ids'].split(',') if i.strip()] if request.GET.get('ids') else None
+    except ValueError:
+        return HttpResponse("Invalid start, end or ids", status=400)
+    
+    rows = report_rows(report_queryset(start, end, ids))
+    if export_format == 'json':
+        response = StreamingHttpResponse(json_chunks(rows), content_type='application/json')
+    else:
+        response = StreamingHttpResponse(csv_lines(rows), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="analysis_report.{export_format}"'
+    return response
+
+
 def home(request):
     if request.method == 'POST':
         form = TiffUploadForm(request.POST, request.FILES)
         if form.is_valid():
             analysis = form.save()
+            if analysis.status == Analysis.DRAFT:
+                return redirect('select_roi', analysis_id=analysis.id)
             return redirect('processing', analysis_id=analysis.id)
     else:
         form = TiffUploadForm()
     
     return render(request, 'mitotic_app/home.html', {'form': form})
 
+def select_roi(request, analysis_id):
+    """Draw the region of interest of a draft upload on its deep-zoom tiles, then queue it"""
+    analysis = get_object_or_404(Analysis, id=analysis_id)
+    if analysis.status != Analysis.DRAFT:
+        return redirect('processing', analysis_id=analysis.id)
+    
+    if request.method == 'POST':
+        if 'whole_slide' in request.POST:
+            analysis.roi = None
+        else:
+            form = ROIForm(request.POST, analysis=analysis)
+            if not form.is_valid():
+                return render(request, 'mitotic_app/select_roi.html', {'analysis': analysis, 'form': form})
+            analysis.roi = form.cleaned_data['roi']
+        analysis.status = Analysis.QUEUED
+        analysis.save(update_fields=['roi', 'status'])
+        return redirect('processing', analysis_id=analysis.id)
+    
+    return render(request, 'mitotic_app/select_roi.html', {'analysis': analysis, 'form': ROIForm(analysis=analysis)})
+
 def processing(request, analysis_id):
     analysis = get_object_or_404(Analysis, id=analysis_id)
+    if analysis.status == Analysis.DRAFT:
+        return redirect('select_roi', analysis_id=analysis.id)
     
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         # This is for AJAX status checks
-        if analysis.video_file:
-            progress = 50
+        if analysis.status == Analysis.DONE:
+            return JsonResponse({
+                'progress': 100, 
+                'status': "Processing complete",
+                'redirect': reverse('results', args=[analysis_id])
+            })
+        elif analysis.status == Analysis.FAILED:
+            return JsonResponse({
+                'progress': 100,
+                'status': f"Processing failed: {analysis.error_message}",
+                'failed': True
+            })
+        elif analysis.status == Analysis.QUEUED:
+            if getattr(settings, 'RUN_ANALYSES_IN_WORKERS', False):
+                return JsonResponse({'progress': 0, 'status': "Queued for a worker..."})
+            # Not admitted yet (the node was busy); reloading the page retries admission
+            return JsonResponse({'progress': 0, 'status': "Waiting for a free worker...", 'retry': True})
+        elif analysis.video_file:
+            progress = 50 + int(45 * detection_progress(analysis))
             status = "Processing video..."
-            if hasattr(analysis, 'figures'):
-                if analysis.figures.count() > 0:
-                    progress = 100
-                    status = "Processing complete"
-                    return JsonResponse({
-                        'progress': progress, 
-                        'status': status,
-                        'redirect': reverse('results', args=[analysis_id])
-                    })
         else:
             progress = 25
             status = "Creating video from TIFF image..." 
         
-        return JsonResponse({'progress': progress, 'status': status})
+        # Provisional grade of progressive scans, once their first samples are in
+        return JsonResponse({'progress': progress, 'status': status, 'estimate': analysis.running_estimate})
     
-    # Check if processing needs to be started
-    if not analysis.video_file:
-        # Convert TIFF to video
+    # Start processing unless another request already owns a live run; an
+    # expired lease means the previous worker died and the run resumes from its checkpoint.
+    # With a worker pool the page only polls and run_worker picks the analysis up.
+    if analysis.status != Analysis.DONE and not getattr(settings, 'RUN_ANALYSES_IN_WORKERS', False):
         try:
-            # Create directory for this analysis
-            analysis_dir = os.path.join(settings.MEDIA_ROOT, f'analysis_{analysis.id}')
-            os.makedirs(analysis_dir, exist_ok=True)
-            
-            # Process the TIFF image
-            scanner = TIFFScanner(analysis.uploaded_image.path)
-            video_path = scanner.smooth_scan(output_dir=analysis_dir)
-            
-            # Add this section for HPF calculation
-            try:
-                print("Starting HPF calculation...")
-                # Get scan parameters from TIFFScanner.smooth_scan
-                window_size = (256, 256)
-                speed = 20
-                y_speed_multiplier = 12.5  # From TIFFScanner.smooth_scan
-                
-                hpf_data = compute_mitotic_density_from_image(
-                    image_path=analysis.uploaded_image.path,
-                    mitotic_count=0,  # Will be updated later after detection
-                    step_x=speed,
-                    step_y=int(speed * y_speed_multiplier)
-                )
-                
-                # Store HPF data in the analysis model
-                analysis.x_mpp = hpf_data['x_mpp']
-                analysis.y_mpp = hpf_data['y_mpp']
-                analysis.hpf_width_px, analysis.hpf_height_px = hpf_data['hpf_size']
-                analysis.total_hpfs = hpf_data['total_hpfs']
-                analysis.mitoses_per_10_hpf = 0  # Will be updated after figure detection
-                analysis.tumor_grade = 1  # Will be updated after figure detection
-                analysis.save()
-                
-                print(f"HPF data saved to Analysis {analysis.id}: {hpf_data}")
-                
-            except Exception as e:
-                print(f"Error calculating HPF data: {e}")
-                # Continue processing even if HPF calculation fails
-            
-            # Update the analysis with the video file
-            rel_path = os.path.relpath(video_path, settings.MEDIA_ROOT)
-            with open(video_path, 'rb') as f:
-                analysis.video_file.save(os.path.basename(video_path), File(f), save=True)
-                
-            # Now process video to count mitotic/non-mitotic figures
-            results = process_video(
-                video_path=video_path,
-                model_path=os.path.join(settings.BASE_DIR, 'model', 'best.pt'),
-                analysis_id=analysis.id
-            )
-            
+            started, results = run_analysis_exclusive(analysis)
             if results:
-                # Path to raw mp4 from YOLO output
-                raw_video_path = os.path.join(settings.MEDIA_ROOT, results['processed_video'])
-
-                # Create new filename for safe browser-compatible mp4
-                base, _ = os.path.splitext(results['processed_video'])
-                safe_filename = f"{base}_browser.mp4"
-                safe_video_path = os.path.join(settings.MEDIA_ROOT, safe_filename)
-
-                # Convert using ffmpeg (even if it's mp4, we re-encode)
-                convert_to_mp4(raw_video_path, safe_video_path)
-
-                # Save the converted path to the model
-                analysis.processed_video.name = safe_filename
-                analysis.save()
-                
-                # Save detected figures to database
-                for figure_data in results['figures_data']:
-                    DetectedFigure.objects.create(
-                        analysis=analysis,
-                        image_file=figure_data['image_path'],
-                        category=figure_data['category'],
-                        confidence=figure_data['confidence'],
-                        frame_number=figure_data['frame_number']
-                    )
-                
-                # Add this section to update HPF calculations with detected figures
-                if hasattr(analysis, 'total_hpfs') and analysis.total_hpfs:
-                    print("Updating HPF analysis with detected mitotic figures")
-                    analysis.update_hpf_analysis()
-                
                 return redirect('results', analysis_id=analysis.id)
-                
         except Exception as e:
             print(f"Error processing image: {e}")
             # Handle error
+        analysis.refresh_from_db()
     
     return render(request, 'mitotic_app/processing.html', {'analysis': analysis})
 
 def results(request, analysis_id):
     analysis = get_object_or_404(Analysis, id=analysis_id)
     
-    # Get figures grouped by category
-    mitotic_figures = analysis.figures.filter(category=DetectedFigure.MITOTIC).order_by('frame_number')
-    non_mitotic_figures = analysis.figures.filter(category=DetectedFigure.NON_MITOTIC).order_by('frame_number')
-    discarded_figures = analysis.figures.filter(category=DetectedFigure.DISCARDED).order_by('frame_number')
+    # Record the visit for LRU media eviction
+    touch(analysis)
     
     # Add this line to ensure HPF analysis is up to date
     if hasattr(analysis, 'total_hpfs') and analysis.total_hpfs:
         analysis.update_hpf_analysis()
     
+    # One grouped query for all category counts
+    counts = dict(
+        analysis.figures.values_list('category').annotate(n=Count('id')).order_by()
+    )
+    mitotic_count = counts.get(DetectedFigure.MITOTIC, 0)
+    non_mitotic_count = counts.get(DetectedFigure.NON_MITOTIC, 0)
+    
+    # Get figures grouped by category, one page at a time so large analyses render in constant time
+    per_page = getattr(settings, 'RESULTS_FIGURES_PER_PAGE', 60)
+    pages = {}
+    for category in [DetectedFigure.MITOTIC, DetectedFigure.NON_MITOTIC, DetectedFigure.DISCARDED]:
+        figures = analysis.figures.filter(category=category).only(
+            'id', 'analysis_id', 'category', 'image_file', 'confidence', 'frame_number', 'slide_x'
+        ).order_by('frame_number', 'id')
+        paginator = Paginator(figures, per_page)
+        paginator.count = counts.get(category, 0)  # Reuse the grouped count instead of another COUNT(*)
+        pages[category] = paginator.get_page(request.GET.get(f'{category}_page'))
+    
     context = {
         'analysis': analysis,
-        'mitotic_figures': mitotic_figures,
-        'non_mitotic_figures': non_mitotic_figures,
-        'discarded_figures': discarded_figures,
-        'mitotic_count': mitotic_figures.count(),
-        'non_mitotic_count': non_mitotic_figures.count(),
-        'total_count': mitotic_figures.count() + non_mitotic_figures.count()
+        'mitotic_figures': pages[DetectedFigure.MITOTIC],
+        'non_mitotic_figures': pages[DetectedFigure.NON_MITOTIC],
+        'discarded_figures': pages[DetectedFigure.DISCARDED],
+        'mitotic_count': mitotic_count,
+        'non_mitotic_count': non_mitotic_count,
+        'discarded_count': counts.get(DetectedFigure.DISCARDED, 0),
+        'duplicate_count': analysis.figures.filter(duplicate_of__isnull=False)
+                                           .exclude(category=DetectedFigure.DISCARDED).count(),
+        'shadow_results': analysis.shadow_results.order_by('name'),
+        'total_count': mitotic_count + non_mitotic_count
     }
     
     return render(request, 'mitotic_app/results.html', context)
 
+def regenerate_media(request, analysis_id):
+    """Queue a rebuild of an analysis's evicted video and follow its progress"""
+    analysis = get_object_or_404(Analysis, id=analysis_id)
+    
+    if request.method == 'POST' and analysis.media_evicted:
+        # The rebuild rescans the slide, so it runs under the analysis lease like any queued run
+        Analysis.objects.filter(id=analysis.id, status=Analysis.DONE, media_evicted=True).update(
+            status=Analysis.QUEUED, version=F('version') + 1
+        )
+        return redirect('processing', analysis_id=analysis.id)
+    
+    return redirect('results', analysis_id=analysis.id)
+
+def duplicates(request, analysis_id):
+    """Review groups of near-duplicate figures and merge them in bulk"""
+    analysis = get_object_or_404(Analysis, id=analysis_id)
+    
+    if request.method == 'POST':
+        if request.POST.get('merge_all'):
+            keeper_ids = None
+        else:
+            keeper_ids = [int(i) for i in request.POST.getlist('keeper') if i.isdigit()]
+        merged = merge_duplicates(analysis, keeper_ids)
+        print(f"Merged {merged} duplicate figures in Analysis {analysis.id}")
+        return redirect('results', analysis_id=analysis.id)
+    
+    pending = analysis.figures.filter(duplicate_of__isnull=False).exclude(
+        category=DetectedFigure.DISCARDED
+    ).select_related('duplicate_of').order_by('duplicate_of_id', 'frame_number')
+    groups = {}
+    for figure in pending:
+        group = groups.setdefault(figure.duplicate_of_id, {'keeper': figure.duplicate_of, 'duplicates': []})
+        group['duplicates'].append(figure)
+    
+    return render(request, 'mitotic_app/duplicates.html', {
+        'analysis': analysis,
+        'groups': list(groups.values()),
+    })
+
 def move_figure_view(request, figure_id):
     if request.method == 'POST':
         new_category = request.POST.get('category')
@@ -232,4 +285,204 @@ def download_figures(request, analysis_id, category=None):
         response['Content-Disposition'] = f'attachment; filename={filename}.zip'
 
     os.unlink(tmp.name)
-    return response
\ No newline at end of file
+    return response
+
+def serve_media(request, path):
+    """Serve MEDIA_ROOT files with byte ranges and conditional requests.
+
+    Only the media the pages link to is served (see SERVED_MEDIA_RE); uploads
+    and intermediates are 404s. With settings.MEDIA_ACCEL set, the response only carries an
+    X-Accel-Redirect (nginx) or X-Sendfile (Apache/lighttpd) header and the
+    front proxy sends the file itself.
+    """
+    full_path = media_path(settings.MEDIA_ROOT, path)
+    if full_path is None or not os.path.isfile(full_path):
+        raise Http404("Media file not found")
+
+    stat = os.stat(full_path)
+    etag = make_etag(stat)
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+
+    accel = getattr(settings, 'MEDIA_ACCEL', None)
+    if accel:
+        response = HttpResponse(content_type=content_type)
+        if accel == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/') + path
+        else:
+            response['X-Sendfile'] = full_path
+        return response
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=stat.st_mtime)
+    if not_modified is not None:
+        return not_modified
+
+    # A Range only applies if If-Range (when present) still matches the file
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != int(stat.st_mtime):
+        range_header = None
+
+    try:
+        byte_range = parse_range(range_header, stat.st_size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+
+    f = open(full_path, 'rb')
+    if byte_range is None:
+        response = FileResponse(f, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = FileResponse(RangedFile(f, start, end - start + 1), content_type=content_type, status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        response['Content-Length'] = end - start + 1
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    return response
+
+
+def slide_viewer(request, analysis_id):
+    """Zoomable view of the uploaded slide with the detected figures drawn on top"""
+    analysis = get_object_or_404(Analysis, id=analysis_id)
+    touch(analysis)
+    return render(request, 'mitotic_app/slide_viewer.html', {
+        'analysis': analysis,
+        'focus_figure': request.GET.get('figure', ''),
+    })
+
+def slide_dzi(request, analysis_id):
+    analysis = get_object_or_404(Analysis.objects.only('id', 'image_width', 'image_height'), id=analysis_id)
+    if not analysis.image_width or not analysis.image_height:
+        raise Http404("Slide dimensions unknown")
+    return HttpResponse(dzi_xml(analysis.image_width, analysis.image_height), content_type='application/xml')
+
+def slide_tile(request, analysis_id, level, col, row):
+    """One Deep Zoom tile, rendered from the uploaded slide on first request and cached on disk"""
+    analysis = get_object_or_404(
+        Analysis.objects.only('id', 'uploaded_image', 'image_width', 'image_height'), id=analysis_id
+    )
+    if not analysis.image_width or not analysis.image_height:
+        raise Http404("Slide dimensions unknown")
+    try:
+        path = render_tile(analysis, level, col, row)
+    except ValueError:
+        raise Http404("No such tile")
+    response = FileResponse(open(path, 'rb'), content_type='image/jpeg')
+    # Tiles never change for an upload
+    response['Cache-Control'] = 'public, max-age=604800, immutable'
+    return response
+
+
+# Read-only JSON API. ETags are derived from Analysis.version, which is bumped
+# whenever an analysis or its figures change, so a matching If-None-Match is
+# answered with 304 before the figure table is queried.
+
+ANALYSIS_LIST_FIELDS = ['id', 'status', 'upload_date', 'source_path', 'mitoses_per_10_hpf', 'tumor_grade', 'version']
+FIGURE_API_FIELDS = [
+    'id', 'analysis_id', 'category', 'confidence', 'frame_number', 'image_file', 'slide_x', 'slide_y', 'duplicate_of',
+]
+
+
+def api_response(request, etag, build):
+    """304 if the client's ETag still matches, otherwise the JSON from build()"""
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    response = JsonResponse(build())
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def api_analyses(request):
+    """Analyses, newest first, with cursor pagination (?status=&limit=&cursor=)"""
+    try:
+        limit = parse_limit(request.GET.get('limit'))
+        before_id = decode_cursor(request.GET['cursor'], 1)[0] if request.GET.get('cursor') else None
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    analyses = Analysis.objects.only(*ANALYSIS_LIST_FIELDS).order_by('-id')
+    if request.GET.get('status'):
+        analyses = analyses.filter(status=request.GET['status'])
+    if before_id is not None:
+        analyses = analyses.filter(id__lt=before_id)
+    page = list(analyses[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    
+    etag = make_api_etag('analyses', request.GET.urlencode(), *[(a.id, a.version) for a in page])
+    return api_response(request, etag, lambda: {
+        'results': [analysis_json(a) for a in page],
+        'next_cursor': encode_cursor(page[-1].id) if has_more else None,
+    })
+
+
+def api_analysis(request, analysis_id):
+    """Summary of one analysis: status, HPF metrics, scan plan and figure counts"""
+    current = get_object_or_404(Analysis.objects.only('id', 'version'), id=analysis_id)
+    etag = make_api_etag('analysis', current.id, current.version)
+    
+    def build():
+        analysis = Analysis.objects.get(id=analysis_id)
+        counts = dict(analysis.figures.values_list('category').annotate(n=Count('id')).order_by())
+        data = analysis_json(analysis)
+        data.update({
+            'image_width': analysis.image_width,
+            'image_height': analysis.image_height,
+            'x_mpp': analysis.x_mpp,
+            'y_mpp': analysis.y_mpp,
+            'total_hpfs': analysis.total_hpfs,
+            'scan_plan': analysis.scan_plan.as_dict() if analysis.scan_plan else None,
+            'roi': analysis.roi,
+            'running_estimate': analysis.running_estimate,
+            'counts': {category: counts.get(category, 0) for category, _ in DetectedFigure.CATEGORY_CHOICES},
+            'processed_video_url': analysis.processed_video.url if analysis.processed_video and not analysis.media_evicted else None,
+            'thumbnail_url': analysis.thumbnail.url if analysis.thumbnail else None,
+            'error_message': analysis.error_message,
+            'figures_url': reverse('api_figures', args=[analysis.id]),
+        })
+        return data
+    
+    return api_response(request, etag, build)
+
+
+def api_overlay(request, analysis_id):
+    """Figure boxes and ROI polygons in level-0 slide pixels, for drawing over the deep-zoom tiles"""
+    analysis = get_object_or_404(Analysis.objects.only('id', 'version', 'roi'), id=analysis_id)
+    etag = make_api_etag('overlay', analysis.id, analysis.version)
+    return api_response(request, etag, lambda: {'figures': figure_overlay(analysis), 'roi': analysis.roi or []})
+
+
+def api_figures(request, analysis_id):
+    """Figures of an analysis in frame order (?category=&limit=&cursor=)"""
+    analysis = get_object_or_404(Analysis.objects.only('id', 'version'), id=analysis_id)
+    category = request.GET.get('category')
+    if category and category not in dict(DetectedFigure.CATEGORY_CHOICES):
+        return JsonResponse({'error': f"Unknown category: {category}"}, status=400)
+    try:
+        limit = parse_limit(request.GET.get('limit'))
+        after = after_figure_cursor(request.GET['cursor']) if request.GET.get('cursor') else None
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    etag = make_api_etag('figures', analysis.id, analysis.version, request.GET.urlencode())
+    
+    def build():
+        figures = analysis.figures.only(*FIGURE_API_FIELDS).order_by('frame_number', 'id')
+        if category:
+            figures = figures.filter(category=category)
+        if after is not None:
+            figures = figures.filter(after)
+        page = list(figures[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+        return {
+            'results': [figure_json(f) for f in page],
+            'next_cursor': encode_cursor(page[-1].frame_number, page[-1].id) if has_more else None,
+        }
+    
+    return api_response(request, etag, build)
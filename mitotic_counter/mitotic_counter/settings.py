@@ -75,12 +75,37 @@ WSGI_APPLICATION = 'mitotic_counter.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite runs in WAL mode so the UI can read while a pipeline writes; writers
+# wait up to 'timeout' seconds for the lock instead of failing. Set DB_ENGINE
+# (e.g. django.db.backends.postgresql) and the DB_* variables to use a server
+# database instead; the schema and migrations are the same.
+if os.environ.get('DB_ENGINE'):
+    DATABASES = {
+        'default': {
+            'ENGINE': os.environ['DB_ENGINE'],
+            'NAME': os.environ.get('DB_NAME', 'mitotic_counter'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', ''),
+            'PORT': os.environ.get('DB_PORT', ''),
+            'CONN_MAX_AGE': 60,
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': 60,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'timeout': 20,
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -126,8 +151,151 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# How serve_media hands files to a front proxy: None serves them from Django,
+# 'x-accel-redirect' (nginx, internal location at MEDIA_ACCEL_PREFIX) or
+# 'x-sendfile' (Apache mod_xsendfile / lighttpd)
+MEDIA_ACCEL = os.environ.get('MEDIA_ACCEL') or None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
+# Stream every upload straight to a temporary file on disk; FileSystemStorage
+# then moves it into MEDIA_ROOT instead of copying it through memory.
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+FILE_UPLOAD_PERMISSIONS = 0o644
+# Largest slide (level 0 width x height) accepted for analysis. TIFFScanner
+# decodes level 0 whole, at 3 bytes per pixel (about 4.8 GB at the default), so
+# raise it only with the memory to match. Also Pillow's decompression bomb limit.
+TIFF_MAX_PIXELS = int(os.environ.get('TIFF_MAX_PIXELS', 40_000 * 40_000))
+RESULTS_FIGURES_PER_PAGE = 60
+MEDIA_TOUCH_INTERVAL = 3600  # Seconds between last_accessed updates for LRU eviction
+MEDIA_COMPACT_ON_COMPLETE = True  # Delete scan/raw videos once an analysis finishes
+MEDIA_KEEP_DEBUG_FRAMES = False  # Keep output_debug/ frames when compacting
+THUMBNAIL_SIZE = 1024  # Long side of the slide overview, read from the smallest sufficient pyramid level
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Detection backend used by process_video: 'yolo' (Ultralytics/PyTorch) or
+# 'onnx' (ONNX Runtime on CPU). Options are passed to the backend constructor.
+DETECTOR_BACKEND = os.environ.get('DETECTOR_BACKEND', 'yolo')
+DETECTOR_OPTIONS = {
+    'onnx': {
+        'imgsz': 640,
+        'intra_op_threads': int(os.environ.get('ONNX_INTRA_OP_THREADS', 0)),
+        'inter_op_threads': int(os.environ.get('ONNX_INTER_OP_THREADS', 1)),
+        'quantize': os.environ.get('ONNX_QUANTIZE') == '1',
+        'calibration_dir': os.environ.get('ONNX_CALIBRATION_DIR'),
+    },
+    # DETECTOR_BACKEND=cascade: a coarse pass at coarse_imgsz flags windows
+    # with candidates at or above threshold, and only those get the full
+    # pass. Lower thresholds trade speed for recall; check a value with
+    # `manage.py check_detector_parity <videos> --backend cascade`.
+    'cascade': {
+        'backend': os.environ.get('CASCADE_BACKEND', 'yolo'),
+        'coarse_imgsz': int(os.environ.get('CASCADE_COARSE_IMGSZ', 320)),
+        'threshold': float(os.environ.get('CASCADE_THRESHOLD', 0.1)),
+        'region_size': 640,
+    },
+}
+
+
+# Default scan plan (see mitotic_app/utils/scan_plan.py). The legacy values
+# sweep 256px windows 20px at a time; ScanPlan.for_model(640) gives fewer,
+# model-sized frames.
+SCAN_PLAN = {
+    'window_width': 256,
+    'window_height': 256,
+    'step_x': 20,
+    'step_y': 250,
+}
+SCAN_SECONDS_PER_FRAME = 0.1  # Used for the up-front runtime estimate
+
+# process_video checkpoints every N frames. A run holds a lease on its analysis
+# that its heartbeat renews; once the lease is ANALYSIS_LEASE_SECONDS past its
+# last renewal the run counts as dead and the next claim resumes it from the
+# checkpoint (see mitotic_app/utils/leases.py)
+CHECKPOINT_EVERY_FRAMES = 500
+ANALYSIS_LEASE_SECONDS = 120
+
+# Run the detector on every Nth scan frame only and move the previous boxes by
+# the known stride in between (1 = every frame). Capped per scan plan so new
+# figures are still seen before they reach the counting line; see
+# `manage.py benchmark_keyframes` for the count drift on reference slides.
+DETECTION_KEYFRAME_INTERVAL = int(os.environ.get('DETECTION_KEYFRAME_INTERVAL', 1))
+
+# Admission control: an analysis only starts while the threads and estimated
+# memory of all running analyses fit this budget (unset keys default to the
+# machine's cores and 75% of RAM). Each running job caps OpenCV/PyTorch/BLAS
+# at threads_per_job. Jobs that are turned away stay queued; batch commands
+# retry every ADMISSION_POLL_SECONDS.
+JOB_BUDGET = {
+    'threads_per_job': int(os.environ.get('JOB_THREADS', 4)),
+    'model_memory_bytes': 1024 ** 3,
+}
+ADMISSION_POLL_SECONDS = 10
+
+# Figures whose perceptual hashes differ by at most this many bits and whose
+# slide positions are within this many level-0 pixels are grouped as
+# possible duplicates of one cell for review
+DUPLICATE_HASH_DISTANCE = 6
+DUPLICATE_RADIUS_PX = 64
+
+# The annotated scan replay costs a frame write per window plus two encodes.
+# With RENDER_PROCESSED_VIDEO=0 only figures are stored and results are
+# reviewed in the deep-zoom slide viewer, whose tiles are rendered lazily
+# from the upload and cached under analysis_N/tiles/.
+RENDER_PROCESSED_VIDEO = os.environ.get('RENDER_PROCESSED_VIDEO', '1') == '1'
+TILE_JPEG_QUALITY = 85
+OVERLAY_DEFAULT_BOX_PX = 48  # Drawn size of figures whose box was not recorded
+
+# Shadow models ({name: weights path}) see every scan frame alongside the
+# primary model, in the same decode pass. Only the primary creates figures;
+# each shadow stores its counts and an agreement report (crossings matched
+# within SHADOW_MATCH_FRAMES frames) as a ShadowResult. From the environment:
+# SHADOW_MODELS="candidate=/models/new.pt,other=/models/other.pt"
+SHADOW_MODELS = dict(
+    item.split('=', 1) for item in os.environ.get('SHADOW_MODELS', '').split(',') if '=' in item
+)
+SHADOW_MATCH_FRAMES = 2
+
+# Worker pool (manage.py run_worker on any number of hosts sharing this
+# database and MEDIA_ROOT). With ANALYSIS_SHARD_FRAMES set, the detection
+# stage of larger scans is split into shards of whole scan rows (about this
+# many frames each) that workers lease like analyses; sharded analyses skip
+# the processed video. Shards are retried SHARD_MAX_ATTEMPTS times, and idle
+# workers steal half the remaining rows of a running shard when at least
+# SHARD_STEAL_MIN_FRAMES would move.
+ANALYSIS_SHARD_FRAMES = int(os.environ.get('ANALYSIS_SHARD_FRAMES', 0)) or None
+SHARD_MAX_ATTEMPTS = 3
+SHARD_STEAL_MIN_FRAMES = 500
+SHARD_POLL_SECONDS = 5
+WORKER_POLL_SECONDS = 5
+
+# With RUN_ANALYSES_IN_WORKERS=1 web requests only queue analyses and poll
+# their progress; run_worker processes do all scanning and inference, so web
+# processes never load models or hold analysis leases. Otherwise opening the
+# processing page runs the analysis inside the request.
+RUN_ANALYSES_IN_WORKERS = os.environ.get('RUN_ANALYSES_IN_WORKERS', '0') == '1'
+
+# Web processes never import the inference stack (PyTorch/Ultralytics, ONNX
+# Runtime, OpenCV, ffmpeg); detection imports it on first use. Workers load it
+# up front instead: with WORKER_WARM_UP run_worker imports it, loads the
+# primary and shadow models and runs one dummy inference before claiming
+# work. `manage.py warm_up` reports those timings and the web boot time.
+WORKER_WARM_UP = os.environ.get('WORKER_WARM_UP', '1') == '1'
+
+# Progressive scans. With PROGRESSIVE_SAMPLES=N the scan first sweeps N
+# HPF-sized blocks spread over the slide (or ROI) and publishes a running
+# mitoses per 10 HPF estimate with a PROGRESSIVE_CONFIDENCE interval (at most
+# every PROGRESSIVE_PUBLISH_SECONDS), then fills in the remaining tiles. With
+# PROGRESSIVE_EARLY_STOP=1 the scan ends once the interval lies inside one
+# grade bucket (<8, 8-14, >=15). 0 keeps the plain row-by-row scan.
+PROGRESSIVE_SAMPLES = int(os.environ.get('PROGRESSIVE_SAMPLES', 0))
+PROGRESSIVE_CONFIDENCE = 0.95
+PROGRESSIVE_EARLY_STOP = os.environ.get('PROGRESSIVE_EARLY_STOP', '0') == '1'
+PROGRESSIVE_PUBLISH_SECONDS = 5
@@ -16,11 +16,13 @@ Including another URLconf
 """
 # mitotic_counter/urls.py
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
-from django.conf.urls.static import static
+from mitotic_app.views import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('mitotic_app.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    # Range/ETag-aware serving of the media the pages link to (or X-Accel-Redirect hand-off, see MEDIA_ACCEL)
+    re_path(r'^%s(?P<path>.*)$' % settings.MEDIA_URL.lstrip('/'), serve_media, name='media'),
+]
\ No newline at end of file